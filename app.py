@@ -6,16 +6,26 @@ Production-Ready with Beautiful UI - Light/Dark Mode Compatible
 import streamlit as st
 import psycopg2
 from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import pandas as pd
 import hashlib
+import logging
 import datetime
 from datetime import timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import sys
 import pytz
-from io import BytesIO
+import smtplib
+import threading
+import time
+import uuid
+from collections import deque
+from email.message import EmailMessage
+from io import BytesIO, StringIO
+
+logger = logging.getLogger(__name__)
 
 # ============== PAGE CONFIGURATION ==============
 st.set_page_config(
@@ -610,40 +620,764 @@ def format_datetime(dt):
         return dt.astimezone(APP_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
     return str(dt)
 
+# ============== ENTRY VOCABULARY ==============
+# These back the PostgreSQL enum types on time_entries; add new labels here and
+# init_database() will extend the enum on the next start.
+ENTRY_STATUSES = ['draft', 'submitted', 'approved', 'rejected', 'recalled']
+# Statuses whose hours count toward daily_totals and overtime: reported work only
+COUNTED_STATUSES = ['submitted', 'approved']
+# Statuses the week grid shows; rejected and recalled entries have been superseded
+GRID_STATUSES = ['draft', 'submitted', 'approved']
+ENTRY_TYPES = ['project_work', 'ee_internal']
+ENTRY_CATEGORIES = ['Leave', 'Other Absence', 'Training']
+PROJECT_TASK_TYPES = ["Development", "Design", "Meeting", "Documentation",
+                      "Testing", "Support", "Research", "Other"]
+LEAVE_TYPES = ["Annual Leave", "Sick Leave", "Personal Leave",
+               "Maternity/Paternity Leave", "Unpaid Leave", "Compassionate Leave", "Other Leave"]
+ABSENCE_TYPES = ["Jury Duty", "Bereavement", "Medical Appointment",
+                 "Family Emergency", "Public Holiday", "Work From Home", "Other Absence"]
+TRAINING_TYPES = ["Internal Training", "External Course", "Conference",
+                  "Workshop", "Certification", "Self-Study", "Onboarding", "Seminar"]
+
+# Billing rate scopes, most specific first, and the entry column each one keys on
+BILLING_RATE_SCOPES = ['employee', 'project', 'role', 'client']
+BILLING_RATE_KEYS = {'employee': 'employee_id', 'project': 'project_id', 'role': 'role', 'client': 'client_id'}
+
+# enum type name -> (column on time_entries, labels, column default)
+ENTRY_ENUMS = {
+    'entry_status': ('status', ENTRY_STATUSES, 'draft'),
+    'entry_kind': ('entry_type', ENTRY_TYPES, 'project_work'),
+    'entry_category_kind': ('entry_category', ENTRY_CATEGORIES, None),
+    'task_kind': ('task_type', PROJECT_TASK_TYPES + LEAVE_TYPES + ABSENCE_TYPES + TRAINING_TYPES, None),
+}
+
+# ============== RUNTIME CONFIGURATION ==============
+def get_config(section, key, default=None):
+    """Read a setting from .streamlit/secrets.toml [section], falling back to SECTION_KEY in the environment"""
+    try:
+        if section in st.secrets and key in st.secrets[section]:
+            return st.secrets[section][key]
+    except FileNotFoundError:
+        pass
+    return os.environ.get(f"{section}_{key}".upper(), default)
+
 # ============== DATABASE CONFIGURATION ==============
+class PoolTimeout(psycopg2.pool.PoolError):
+    pass
+
+class BlockingConnectionPool:
+    """Thread-safe PostgreSQL pool that queues callers FIFO when every connection is busy.
+    
+    minconn connections are opened up front. Idle connections are pinged by a timer thread
+    rather than on checkout, and connections older than max_age seconds are closed and replaced.
+    """
+    
+    def __init__(self, minconn, maxconn, timeout, max_age, check_interval, **dsn):
+        self.minconn, self.maxconn = minconn, maxconn
+        self.timeout, self.max_age, self.check_interval = timeout, max_age, check_interval
+        self.dsn = dsn
+        self.lock = threading.Lock()
+        self.idle = deque()      # (conn, last returned) with the most recently used on the right
+        self.waiters = deque()   # FIFO queue of callers blocked in getconn
+        self.created = {}        # id(conn) -> monotonic open time
+        self.total = 0
+        self.health_failures = 0   # failed pings, reconnects and health passes, with the last error
+        self.health_error = None
+        for _ in range(minconn):
+            self.idle.append((self._connect(), time.monotonic()))
+            self.total += 1
+        threading.Thread(target=self._health_loop, name="db-pool-health", daemon=True).start()
+    
+    def _connect(self):
+        conn = psycopg2.connect(**self.dsn)
+        self.created[id(conn)] = time.monotonic()
+        return conn
+    
+    def _close(self, conn):
+        self.created.pop(id(conn), None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+    
+    def _hand_off(self, conn):
+        """Give conn (or, if None, a free slot) to the longest waiting caller. Lock must be held."""
+        if not self.waiters:
+            return False
+        waiter = self.waiters.popleft()
+        waiter['conn'], waiter['ready'] = conn, True
+        waiter['event'].set()
+        return True
+    
+    def getconn(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()[0]
+            waiter = None
+            if self.total < self.maxconn:
+                self.total += 1
+            else:
+                waiter = {'event': threading.Event(), 'conn': None, 'ready': False}
+                self.waiters.append(waiter)
+        
+        if waiter is not None:
+            if not waiter['event'].wait(self.timeout):
+                with self.lock:
+                    if not waiter['ready']:
+                        self.waiters.remove(waiter)
+                        raise PoolTimeout(f"Timed out after {self.timeout:g}s waiting for a database connection "
+                                          f"({self.total} in use, {len(self.waiters)} waiting)")
+            if waiter['conn'] is not None:
+                return waiter['conn']
+        
+        # A slot was reserved for this caller: open a new connection
+        try:
+            return self._connect()
+        except Exception:
+            with self.lock:
+                if not self._hand_off(None):
+                    self.total -= 1
+            raise
+    
+    def putconn(self, conn, close=False):
+        discard = close or conn.closed or time.monotonic() - self.created.get(id(conn), 0) > self.max_age
+        if not discard:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard:
+            self._close(conn)
+        with self.lock:
+            if discard:
+                if not self._hand_off(None):
+                    self.total -= 1
+            elif not self._hand_off(conn):
+                self.idle.append((conn, time.monotonic()))
+    
+    def _health_failed(self, message):
+        logger.warning("Connection pool health check: %s", message)
+        with self.lock:
+            self.health_failures += 1
+            self.health_error = message
+    
+    def check_idle(self):
+        """Ping connections idle for a full interval, recycle expired ones and top up to minconn"""
+        now = time.monotonic()
+        with self.lock:
+            stale = [item for item in self.idle if now - item[1] >= self.check_interval]
+            for item in stale:
+                self.idle.remove(item)
+        for conn, _ in stale:
+            healthy = not conn.closed and now - self.created.get(id(conn), now) <= self.max_age
+            if healthy:
+                try:
+                    with conn.cursor() as c:
+                        c.execute("SELECT 1")
+                    conn.rollback()
+                except psycopg2.Error as e:
+                    self._health_failed(f"idle connection failed its ping: {e}".strip())
+                    healthy = False
+            self.putconn(conn, close=not healthy)
+        
+        while True:
+            with self.lock:
+                if self.total >= self.minconn:
+                    return
+                self.total += 1
+            try:
+                conn = self._connect()
+            except psycopg2.Error as e:
+                with self.lock:
+                    self.total -= 1
+                self._health_failed(f"could not reconnect to minconn: {e}".strip())
+                return
+            self.putconn(conn)
+    
+    def _health_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.check_idle()
+            except Exception as e:
+                logger.exception("Connection pool health pass failed")
+                self._health_failed(f"{type(e).__name__}: {e}")
+    
+    def status(self):
+        with self.lock:
+            return {'total': self.total, 'idle': len(self.idle), 'in_use': self.total - len(self.idle),
+                    'waiting': len(self.waiters), 'health_failures': self.health_failures,
+                    'health_error': self.health_error}
+
 @st.cache_resource
 def init_connection_pool():
-    """Create a connection pool for PostgreSQL"""
+    """Create a connection pool for PostgreSQL, sized from [database] secrets or DATABASE_POOL_* env vars"""
     try:
         db_config = st.secrets["database"]
-        return psycopg2.pool.ThreadedConnectionPool(
-            minconn=1,
-            maxconn=10,
+        return BlockingConnectionPool(
+            minconn=int(get_config('database', 'pool_min', 2)),
+            maxconn=int(get_config('database', 'pool_max', 10)),
+            timeout=float(get_config('database', 'pool_timeout', 10)),
+            max_age=float(get_config('database', 'pool_max_age', 1800)),
+            check_interval=float(get_config('database', 'pool_check_interval', 60)),
             host=db_config["host"],
             database=db_config["database"],
             user=db_config["user"],
             password=db_config["password"],
             port=db_config.get("port", "5432"),
-            sslmode="require"
+            sslmode="require",
+            connection_factory=TrackedConnection
         )
     except Exception as e:
         st.error(f"Database connection failed: {e}")
         st.info("Please configure database credentials in .streamlit/secrets.toml")
         st.stop()
 
-def get_connection():
-    pool = init_connection_pool()
-    return pool.getconn()
+@st.cache_resource
+def get_replica_state():
+    """Last failed attempt to open the replica pool, shared by every session"""
+    return {'failed_at': None, 'error': None}
+
+def init_replica_pool():
+    """Optional read-replica pool, enabled by a [replica] secrets section or REPLICA_HOST.
+    
+    Returns None when no replica is configured, or when it could not be reached within the last
+    replica retry_seconds (default 60); callers then read from the primary.
+    """
+    if not get_config('replica', 'host'):
+        return None
+    state = get_replica_state()
+    if state['failed_at'] is not None and time.monotonic() - state['failed_at'] < float(get_config('replica', 'retry_seconds', 60)):
+        return None
+    try:
+        pool = open_replica_pool()
+    except psycopg2.Error as e:
+        logger.warning("Read replica unavailable, reading from the primary: %s", e)
+        state['failed_at'], state['error'] = time.monotonic(), str(e).strip()
+        return None
+    state['failed_at'], state['error'] = None, None
+    return pool
+
+@st.cache_resource
+def open_replica_pool():
+    """Connect the replica pool. Unset keys (database, user, password, port, sslmode, pool_*) fall back
+    to the primary's settings. Raises if the replica is unreachable, which st.cache_resource does not cache."""
+    host = get_config('replica', 'host')
+    db_config = st.secrets["database"]
+    
+    def setting(key, default=None):
+        return get_config('replica', key, get_config('database', key, db_config.get(key, default)))
+    
+    return BlockingConnectionPool(
+        minconn=int(setting('pool_min', 2)),
+        maxconn=int(setting('pool_max', 10)),
+        timeout=float(setting('pool_timeout', 10)),
+        max_age=float(setting('pool_max_age', 1800)),
+        check_interval=float(setting('pool_check_interval', 60)),
+        host=host,
+        database=setting('database'),
+        user=setting('user'),
+        password=setting('password'),
+        port=setting('port', "5432"),
+        sslmode=setting('sslmode', "require"),
+        connection_factory=PreparedConnection
+    )
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Connection that remembers which catalogue statements it has PREPAREd this session"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+class TrackedConnection(PreparedConnection):
+    """Primary connection that notes the WAL position of each committed write,
+    so the writing session can avoid reading stale data from the replica"""
+    
+    def commit(self):
+        # Only the replica setting is consulted here: opening the replica pool could fail and block the write
+        wrote = False
+        if (self.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+                and get_config('replica', 'host')):
+            with self.cursor() as c:
+                c.execute("SELECT txid_current_if_assigned() IS NOT NULL")
+                wrote = c.fetchone()[0]
+        super().commit()
+        if wrote:
+            try:
+                with self.cursor() as c:
+                    c.execute("SELECT pg_current_wal_lsn()::text")
+                    lsn = c.fetchone()[0]
+                super().rollback()
+            except psycopg2.Error:
+                lsn = None   # Committed regardless; the session just reads from the primary for a while
+            note_primary_write(lsn)
+
+def note_primary_write(lsn):
+    """Remember the session's last committed write (script runs only; background jobs have no session)"""
+    if getattr(get_run_scope(), 'active', False):
+        st.session_state.primary_write = {'at': time.monotonic(), 'lsn': lsn}
+
+# Helpers that only pass a connection through; the call site is the first frame outside them
+POOL_HELPERS = {'get_connection', 'get_read_connection', 'release_connection', 'checkout_connection', 'checkin_connection', 'execute_query', 'execute_df', 'get_setting',
+                'log_audit', 'run_idempotent_write', 'execute_with_timeout', 'execute_statement', 'estimate_rows', 'picker_options'}
+
+@st.cache_resource
+def get_pool_stats():
+    """Process-wide connection checkout counters shared by every session and the scheduler"""
+    return {'lock': threading.Lock(), 'sites': {}, 'checked_out': {}, 'exhaustions': deque(maxlen=100),
+            'peak_in_use': 0, 'since': get_local_time_naive()}
+
+def connection_call_site():
+    """Name of the function that asked for a connection, skipping the shared query helpers
+    and any frames from other modules (e.g. Streamlit's caching wrappers)"""
+    frame = sys._getframe(2)
+    here = connection_call_site.__code__.co_filename
+    while frame and (frame.f_code.co_filename != here or frame.f_code.co_name in POOL_HELPERS):
+        frame = frame.f_back
+    return frame.f_code.co_name if frame else 'unknown'
+
+def site_record(stats, site):
+    """Per-call-site counters; stats lock must be held"""
+    return stats['sites'].setdefault(site, {'calls': 0, 'reused': 0, 'wait_total': 0.0, 'wait_max': 0.0,
+                                            'hold_total': 0.0, 'hold_max': 0.0, 'holds': deque(maxlen=500)})
+
+def get_pool(name):
+    return open_replica_pool() if name == 'replica' else init_connection_pool()
+
+def checkout_connection(site, pool_name='primary'):
+    """Take a connection from the named pool, recording the wait (or timeout) against site"""
+    pool = get_pool(pool_name)
+    stats = get_pool_stats()
+    if pool_name != 'primary':
+        site = f"{site} ({pool_name})"
+    started = time.perf_counter()
+    try:
+        conn = pool.getconn()
+    except psycopg2.pool.PoolError as e:
+        with stats['lock']:
+            stats['exhaustions'].append({'Time': get_local_time_naive(), 'Site': site,
+                                         'In Use': len(stats['checked_out']), 'Error': str(e)})
+        raise
+    waited = time.perf_counter() - started
+    with stats['lock']:
+        stats['checked_out'][id(conn)] = (site, time.perf_counter(), pool_name)
+        stats['peak_in_use'] = max(stats['peak_in_use'], len(stats['checked_out']))
+        record = site_record(stats, site)
+        record['calls'] += 1
+        record['wait_total'] += waited
+        record['wait_max'] = max(record['wait_max'], waited)
+    return conn
+
+def connection_pool_name(conn):
+    """Which pool a checked-out connection came from"""
+    stats = get_pool_stats()
+    with stats['lock']:
+        checkout = stats['checked_out'].get(id(conn))
+    return checkout[2] if checkout else 'primary'
+
+def checkin_connection(conn):
+    """Return a connection to its pool, recording how long its call site held it"""
+    stats = get_pool_stats()
+    pool_name = 'primary'
+    with stats['lock']:
+        checkout = stats['checked_out'].pop(id(conn), None)
+        if checkout:
+            site, checked_out_at, pool_name = checkout
+            held = time.perf_counter() - checked_out_at
+            record = site_record(stats, site)
+            record['hold_total'] += held
+            record['hold_max'] = max(record['hold_max'], held)
+            record['holds'].append(held)
+    get_pool(pool_name).putconn(conn)
+
+@st.cache_resource
+def get_run_scope():
+    """Thread-local holder for the connection shared by one script run"""
+    return threading.local()
+
+def begin_connection_scope():
+    """Start a script run: the first get_connection() per pool checks out a connection that the whole run reuses.
+    A caller nested inside another's open transaction gets a separate checkout instead."""
+    scope = get_run_scope()
+    scope.active, scope.conns, scope.depths = True, {}, {}
+
+def end_connection_scope():
+    """Finish a script run and hand its connections back to their pools"""
+    scope = get_run_scope()
+    conns, scope.conns, scope.active = getattr(scope, 'conns', {}), {}, False
+    for conn in conns.values():
+        checkin_connection(conn)
+
+def get_connection(pool_name='primary'):
+    site = connection_call_site()
+    scope = get_run_scope()
+    if not getattr(scope, 'active', False):
+        # Scheduler thread and anything else outside a script run
+        return checkout_connection(site, pool_name)
+    conn = scope.conns.get(pool_name)
+    if conn is not None and conn.closed:
+        checkin_connection(conn)
+        conn = None
+    if conn is None:
+        conn = scope.conns[pool_name] = checkout_connection(site, pool_name)
+        scope.depths[pool_name] = 0
+    elif scope.depths[pool_name] and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        # An outer caller has a transaction open on the run's connection; give this caller its
+        # own so that its commit or rollback cannot end the outer one halfway through
+        return checkout_connection(site, pool_name)
+    else:
+        stats = get_pool_stats()
+        with stats['lock']:
+            site_record(stats, site)['reused'] += 1
+    scope.depths[pool_name] += 1
+    return conn
+
+def get_read_connection():
+    """Connection for read-only queries: the replica when configured and fresh enough for this session.
+    
+    After a write the session reads from the primary for replica fallback_seconds (default 5) unless the
+    replica has already replayed past the write's LSN. Any replica connection failure falls back to the primary.
+    """
+    if init_replica_pool() is None:
+        return get_connection()
+    try:
+        conn = get_connection('replica')
+    except (psycopg2.OperationalError, psycopg2.pool.PoolError):
+        return get_connection()
+    last_write = st.session_state.get('primary_write') if getattr(get_run_scope(), 'active', False) else None
+    if last_write and time.monotonic() - last_write['at'] < float(get_config('replica', 'fallback_seconds', 5)):
+        if last_write['lsn'] is None:
+            release_connection(conn)
+            return get_connection()
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, TRUE)", (last_write['lsn'],))
+                caught_up = c.fetchone()[0]
+        except psycopg2.Error:
+            caught_up = False
+        if not caught_up:
+            release_connection(conn)
+            return get_connection()
+    return conn
 
 def release_connection(conn):
+    scope = get_run_scope()
+    if getattr(scope, 'active', False):
+        for pool_name, scoped in scope.conns.items():
+            if conn is scoped:
+                # Keep the run's connection, but end any read or failed transaction once no caller holds it
+                scope.depths[pool_name] = max(scope.depths[pool_name] - 1, 0)
+                if (scope.depths[pool_name] == 0 and not conn.closed
+                        and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+                    conn.rollback()
+                return
+    checkin_connection(conn)
+
+def pool_snapshot():
+    """Current pool occupancy plus per-call-site wait/hold statistics in milliseconds"""
     pool = init_connection_pool()
-    pool.putconn(conn)
+    stats = get_pool_stats()
+    with stats['lock']:
+        rows = [{'Call Site': site, 'Checkouts': r['calls'], 'Reused': r['reused'],
+                 'Avg Wait (ms)': r['wait_total'] / max(r['calls'], 1) * 1000, 'Max Wait (ms)': r['wait_max'] * 1000,
+                 'Avg Hold (ms)': r['hold_total'] / max(r['calls'], 1) * 1000,
+                 'P95 Hold (ms)': pd.Series(list(r['holds'])).quantile(0.95) * 1000 if r['holds'] else 0.0,
+                 'Max Hold (ms)': r['hold_max'] * 1000, 'Total Hold (s)': r['hold_total']}
+                for site, r in stats['sites'].items()]
+        occupancy = dict(pool.status(), max=pool.maxconn, peak_in_use=stats['peak_in_use'], since=stats['since'],
+                         held_now=sorted({checkout[0] for checkout in stats['checked_out'].values()}))
+        exhaustions = pd.DataFrame(list(stats['exhaustions']))
+    sites = pd.DataFrame(rows)
+    if not sites.empty:
+        sites = sites.sort_values('Total Hold (s)', ascending=False).round(2)
+    return occupancy, sites, exhaustions
+
+def reset_pool_stats():
+    stats = get_pool_stats()
+    with stats['lock']:
+        stats['sites'].clear()
+        stats['exhaustions'].clear()
+        stats['peak_in_use'] = len(stats['checked_out'])
+        stats['since'] = get_local_time_naive()
+    for pool in (init_connection_pool(), init_replica_pool()):
+        if pool is not None:
+            with pool.lock:
+                pool.health_failures, pool.health_error = 0, None
+    statements = get_statement_stats()
+    with statements['lock']:
+        statements['statements'].clear()
+        statements['since'] = get_local_time_naive()
+
+# Statement timeouts per query class, overridable as [database] <class>_timeout_ms or DATABASE_<CLASS>_TIMEOUT_MS
+QUERY_TIMEOUTS_MS = {'interactive': 15000, 'report': 120000, 'export': 600000, 'job': 900000}
+
+class QueryCancelled(Exception):
+    """A statement hit its query-class timeout or was cancelled from the Performance tab"""
+    
+    def __init__(self, query_class, timeout_ms, by_user):
+        self.query_class, self.timeout_ms, self.by_user = query_class, timeout_ms, by_user
+        if by_user:
+            message = f"The {query_class} query was cancelled."
+        else:
+            message = (f"The {query_class} query took longer than {timeout_ms / 1000:g}s and was stopped. "
+                       "Try a narrower date range or filter.")
+        super().__init__(message)
 
-def execute_query(query, params=None, fetch=True):
-    conn = get_connection()
+def query_timeout_ms(query_class):
+    return int(get_config('database', f'{query_class}_timeout_ms', QUERY_TIMEOUTS_MS[query_class]))
+
+@st.cache_resource
+def get_running_queries():
+    """Report, export and job statements in flight, by token, so an admin can cancel them"""
+    return {'lock': threading.Lock(), 'queries': {}}
+
+def execute_with_timeout(cur, query, params, query_class):
+    """Execute under query_class's statement timeout, restoring the default afterwards so the rest of
+    the transaction is unaffected. Anything slower than interactive is registered for cancellation while it runs."""
+    timeout_ms = query_timeout_ms(query_class)
+    running = get_running_queries()
+    token = None
+    if query_class != 'interactive':
+        token = uuid.uuid4().hex
+        user = st.session_state.get('user') if getattr(get_run_scope(), 'active', False) else None
+        with running['lock']:
+            running['queries'][token] = {'Site': connection_call_site(), 'Class': query_class,
+                                         'User': user['username'] if user else 'scheduler',
+                                         'Started': get_local_time_naive(), 'started_at': time.monotonic(),
+                                         'pid': cur.connection.info.backend_pid,
+                                         'pool': connection_pool_name(cur.connection)}
+    conn = cur.connection
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with conn.cursor() as setting:
+            setting.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+        if query in STATEMENTS:
+            execute_statement(cur, query, params or ())
+        else:
             cur.execute(query, params)
+    except psycopg2.extensions.QueryCanceledError as e:
+        raise QueryCancelled(query_class, timeout_ms, 'user request' in str(e)) from e
+    finally:
+        # A failed transaction drops the setting on rollback; cur keeps its fetched rows either way
+        if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+            with conn.cursor() as setting:
+                setting.execute("SET LOCAL statement_timeout = DEFAULT")
+        if token:
+            with running['lock']:
+                running['queries'].pop(token, None)
+
+def cancel_running_query(token):
+    """Cancel a registered statement with pg_cancel_backend on the server it is running on"""
+    running = get_running_queries()
+    with running['lock']:
+        query = running['queries'].get(token)
+    if query is None:
+        return False
+    conn = get_connection(query['pool'])
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT pg_cancel_backend(%s)", (query['pid'],))
+            return c.fetchone()[0]
+    finally:
+        release_connection(conn)
+
+def render_guarded(render):
+    """Render a page section, showing timeouts and cancellations as an error instead of a traceback"""
+    try:
+        render()
+    except QueryCancelled as e:
+        st.error(f"⏱️ {e}")
+
+# Hot-path queries, prepared server-side once per connection and executed by name.
+# execute_query/execute_df accept a catalogue name in place of SQL text.
+STATEMENTS = {
+    'get_setting': "SELECT value FROM settings WHERE key = $1",
+    'log_audit': """INSERT INTO audit_logs (user_id, action, entity_type, entity_id, details, created_at)
+                    VALUES ($1, $2, $3, $4, $5, $6)""",
+    'recent_entries': """
+        SELECT te.id, COALESCE(c.name, 'EE Internal') as "Client",
+               COALESCE(p.name, te.entry_category::text) as "Project/Category", te.entry_date as "Date",
+               te.hours as "Hours", te.minutes as "Mins", te.task_type as "Task",
+               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable", te.status as "Status"
+        FROM time_entries te
+        LEFT JOIN projects p ON te.project_id = p.id
+        LEFT JOIN clients c ON p.client_id = c.id
+        WHERE te.employee_id = $1
+        ORDER BY te.entry_date DESC, te.created_at DESC LIMIT 20""",
+    'day_entries': """
+        SELECT te.id, COALESCE(c.name, 'EE Internal') as "Client",
+               COALESCE(p.name, te.entry_category::text) as "Project/Category", te.entry_date as "Date",
+               te.hours as "Hours", te.minutes as "Mins", te.task_type as "Task",
+               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable", te.status as "Status"
+        FROM time_entries te
+        LEFT JOIN projects p ON te.project_id = p.id
+        LEFT JOIN clients c ON p.client_id = c.id
+        WHERE te.employee_id = $1 AND te.entry_date = $2
+        ORDER BY te.entry_date DESC, te.created_at DESC LIMIT 20""",
+    'history_totals': """
+        SELECT COUNT(*) as entries, COALESCE(SUM(te.hours + te.minutes / 60.0), 0) as hours,
+               COALESCE(SUM(te.hours + te.minutes / 60.0) FILTER (WHERE te.status = 'approved'), 0) as approved
+        FROM time_entries te
+        WHERE te.employee_id = $1 AND te.entry_date BETWEEN $2 AND $3
+        AND ($4::entry_status IS NULL OR te.status = $4)""",
+    'history_page': """
+        SELECT te.entry_date as "Date", COALESCE(c.name, 'EE Internal') as "Client",
+               COALESCE(p.name, te.entry_category::text) as "Project",
+               te.hours as "Hours", te.minutes as "Mins", te.task_type as "Task",
+               te.description as "Description",
+               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
+               te.status as "Status", te.review_comment as "Comment"
+        FROM time_entries te
+        LEFT JOIN projects p ON te.project_id = p.id
+        LEFT JOIN clients c ON p.client_id = c.id
+        WHERE te.employee_id = $1 AND te.entry_date BETWEEN $2 AND $3
+        AND ($4::entry_status IS NULL OR te.status = $4)
+        ORDER BY te.entry_date DESC, te.id DESC
+        LIMIT $5 OFFSET $6""",
+    'pending_review_count': """
+        SELECT COUNT(*) as n FROM time_entries te LEFT JOIN projects p ON te.project_id = p.id
+        WHERE te.status = 'submitted'
+        AND (p.manager_id = $1 OR $1 IN (SELECT id FROM users WHERE role IN ('manager', 'admin')))""",
+    'pending_review_page': """
+        SELECT te.id, u.full_name as "Employee",
+               COALESCE(c.name, 'EE Internal') as "Client",
+               COALESCE(p.name, te.entry_category::text) as "Project/Category",
+               te.entry_date as "Date", te.hours as "Hours", te.minutes as "Mins",
+               te.task_type as "Type", te.description as "Description",
+               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
+               te.submitted_at as "Submitted", te.entry_type as "Entry_Type", te.entry_category as "Category"
+        FROM time_entries te
+        JOIN users u ON te.employee_id = u.id
+        LEFT JOIN projects p ON te.project_id = p.id
+        LEFT JOIN clients c ON p.client_id = c.id
+        WHERE te.status = 'submitted'
+        AND (p.manager_id = $1 OR $1 IN (SELECT id FROM users WHERE role IN ('manager', 'admin')))
+        ORDER BY te.submitted_at ASC, te.id
+        LIMIT $2 OFFSET $3""",
+    'pending_ee_internal': """
+        SELECT te.id, u.full_name as "Employee", u.department as "Department",
+               te.entry_category as "Category", te.task_type as "Request Type",
+               lower(te.entry_period) as "Start Date", upper(te.entry_period) - 1 as "End Date",
+               upper(te.entry_period) - lower(te.entry_period) as "Days", te.hours as "Total Hours",
+               te.description as "Description/Reason",
+               te.submitted_at as "Submitted",
+               (SELECT string_agg(DISTINCT ou.full_name || ' (' || o.status::text || ')', ', ')
+                FROM time_entries o
+                JOIN users ou ON o.employee_id = ou.id
+                WHERE o.entry_type = 'ee_internal' AND o.status IN ('approved', 'submitted')
+                AND o.employee_id != te.employee_id
+                AND ou.department IS NOT DISTINCT FROM u.department
+                AND o.entry_period && te.entry_period) as "Conflicts",
+               lb.balance_hours as "Balance"
+        FROM time_entries te
+        JOIN users u ON te.employee_id = u.id
+        LEFT JOIN leave_balances lb ON lb.employee_id = te.employee_id AND lb.leave_type = te.task_type
+        WHERE te.status = 'submitted' AND te.entry_type = 'ee_internal'
+        ORDER BY te.submitted_at ASC""",
+    'pending_project_time': """
+        SELECT te.id, u.full_name as "Employee",
+               c.name as "Client", p.name as "Project",
+               te.entry_date as "Date", te.hours as "Hours", te.minutes as "Mins",
+               te.task_type as "Task", te.description as "Description",
+               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
+               te.submitted_at as "Submitted"
+        FROM time_entries te
+        JOIN users u ON te.employee_id = u.id
+        JOIN projects p ON te.project_id = p.id
+        JOIN clients c ON p.client_id = c.id
+        WHERE te.status = 'submitted' AND te.entry_type = 'project_work'
+        AND (p.manager_id = $1 OR $1 IN (SELECT id FROM users WHERE role IN ('manager', 'admin')))
+        ORDER BY te.submitted_at ASC""",
+    'team_overview': """
+        SELECT u.id, u.full_name as "Name", u.email as "Email", u.department as "Department",
+               COALESCE(pa.projects, 0) as "Projects",
+               COALESCE(wk.hours, 0) as "Week_Hours"
+        FROM users u
+        LEFT JOIN (SELECT employee_id, COUNT(*) AS projects
+                   FROM project_assignments GROUP BY employee_id) pa ON u.id = pa.employee_id
+        LEFT JOIN (SELECT employee_id, SUM(hours) AS hours
+                   FROM time_entries
+                   WHERE status != 'draft' AND entry_date >= CURRENT_DATE - INTERVAL '7 days'
+                   GROUP BY employee_id) wk ON u.id = wk.employee_id
+        WHERE u.role = 'employee' AND u.is_active = TRUE
+        ORDER BY u.full_name""",
+    'project_overview': """
+        SELECT p.id, c.name as "Client", p.name as "Project", u.full_name as "Manager",
+               p.status as "Status", COALESCE(pa.team, 0) as "Team_Size",
+               COALESCE(p.consumed_hours, 0) as "Total_Hours", p.budget_hours as "Budget_Hours",
+               ROUND((p.consumed_hours * 100.0 / NULLIF(p.budget_hours, 0))::numeric, 1) as "Budget_Used_Pct"
+        FROM projects p
+        JOIN clients c ON p.client_id = c.id
+        LEFT JOIN users u ON p.manager_id = u.id
+        LEFT JOIN (SELECT project_id, COUNT(*) AS team
+                   FROM project_assignments GROUP BY project_id) pa ON p.id = pa.project_id
+        WHERE c.name != 'EE Internal'
+        ORDER BY p.created_at DESC""",
+    'week_summary': """
+        SELECT COALESCE(SUM(hours + minutes/60.0), 0) as total_hours,
+               COALESCE(SUM(CASE WHEN is_billable THEN hours + minutes/60.0 ELSE 0 END), 0) as billable_hours,
+               COUNT(*) as entry_count
+        FROM time_entries
+        WHERE employee_id = $1 AND entry_date >= $2 AND status != 'draft'""",
+    'billable_split': """
+        SELECT CASE WHEN is_billable THEN 'Billable' ELSE 'Non-Billable' END as "Type",
+               SUM(hours + minutes/60.0) as "Hours"
+        FROM time_entries
+        WHERE employee_id = $1 AND entry_date >= CURRENT_DATE - INTERVAL '30 days' AND status != 'draft'
+        GROUP BY is_billable""",
+    'daily_hours': """
+        SELECT entry_date as "Date", SUM(hours + minutes/60.0) as "Hours"
+        FROM time_entries
+        WHERE employee_id = $1 AND entry_date >= CURRENT_DATE - INTERVAL '14 days' AND status != 'draft'
+        GROUP BY entry_date ORDER BY entry_date""",
+}
+
+@st.cache_resource
+def get_statement_stats():
+    """Process-wide execution counters for the statement catalogue"""
+    return {'lock': threading.Lock(), 'statements': {}, 'since': get_local_time_naive()}
+
+def execute_statement(cur, name, params=()):
+    """Execute catalogue statement name on cur, PREPAREing it first if this connection has not yet"""
+    conn = cur.connection
+    prepared = name not in conn.prepared
+    if prepared:
+        cur.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+        conn.prepared.add(name)
+    args = f" ({', '.join(['%s'] * len(params))})" if params else ""
+    started = time.monotonic()
+    try:
+        cur.execute(f"EXECUTE {name}{args}", tuple(params))
+    finally:
+        elapsed = (time.monotonic() - started) * 1000
+        stats = get_statement_stats()
+        with stats['lock']:
+            record = stats['statements'].setdefault(name, {'calls': 0, 'prepares': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            record['calls'] += 1
+            record['prepares'] += prepared
+            record['total_ms'] += elapsed
+            record['max_ms'] = max(record['max_ms'], elapsed)
+
+def statement_snapshot():
+    """Per-statement execution stats, slowest total first"""
+    stats = get_statement_stats()
+    with stats['lock']:
+        rows = [{'Statement': name, 'Calls': r['calls'], 'Prepares': r['prepares'],
+                 'Avg (ms)': round(r['total_ms'] / r['calls'], 2), 'Max (ms)': round(r['max_ms'], 2),
+                 'Total (ms)': round(r['total_ms'], 1)}
+                for name, r in stats['statements'].items()]
+    return pd.DataFrame(rows, columns=['Statement', 'Calls', 'Prepares', 'Avg (ms)', 'Max (ms)', 'Total (ms)']).sort_values(
+        'Total (ms)', ascending=False)
+
+def execute_query(query, params=None, fetch=True, primary=False, query_class='interactive'):
+    conn = get_read_connection() if fetch and not primary else get_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_with_timeout(cur, query, params, query_class)
             if fetch:
                 result = cur.fetchall()
                 return result
@@ -652,17 +1386,77 @@ def execute_query(query, params=None, fetch=True):
     finally:
         release_connection(conn)
 
-def execute_df(query, params=None):
-    conn = get_connection()
+@st.cache_resource
+def get_enum_labels():
+    """Map enum type OIDs to their ordered labels, for categorical DataFrame columns"""
+    rows = execute_query("""
+        SELECT t.oid, array_agg(e.enumlabel::text ORDER BY e.enumsortorder) AS labels
+        FROM pg_type t JOIN pg_enum e ON e.enumtypid = t.oid
+        WHERE t.typname = ANY(%s)
+        GROUP BY t.oid
+    """, (list(ENTRY_ENUMS.keys()),))
+    return {row['oid']: row['labels'] for row in rows}
+
+def execute_df(query, params=None, primary=False, query_class='interactive'):
+    conn = get_connection() if primary else get_read_connection()
     try:
-        df = pd.read_sql_query(query, conn, params=params)
-        return df
+        with conn.cursor() as cur:
+            execute_with_timeout(cur, query, params, query_class)
+            columns = [col.name for col in cur.description]
+            type_codes = [col.type_code for col in cur.description]
+            df = pd.DataFrame.from_records(cur.fetchall(), columns=columns, coerce_float=True)
     finally:
         release_connection(conn)
 
+    # Enum-typed columns come back as pandas categoricals instead of object strings
+    enum_labels = get_enum_labels()
+    for name, type_code in zip(columns, type_codes):
+        if type_code in enum_labels:
+            categories = list(enum_labels[type_code])
+            categories += [v for v in df[name].dropna().unique() if v not in categories]
+            df[name] = pd.Categorical(df[name], categories=categories)
+    return df
+
+def ensure_entry_enums(conn):
+    """Create the time_entries enum types and convert legacy VARCHAR columns to them"""
+    with conn.cursor() as c:
+        legacy_columns = []
+        for type_name, (column, labels, default) in ENTRY_ENUMS.items():
+            c.execute("""SELECT data_type FROM information_schema.columns
+                         WHERE table_name = 'time_entries' AND column_name = %s""", (column,))
+            row = c.fetchone()
+            values = list(labels)
+            if row and row[0] != 'USER-DEFINED':
+                legacy_columns.append(type_name)
+                c.execute(f"SELECT DISTINCT NULLIF({column}, '') FROM time_entries WHERE NULLIF({column}, '') IS NOT NULL")
+                values += [r[0] for r in c.fetchall() if r[0] not in values]
+
+            c.execute("SELECT 1 FROM pg_type WHERE typname = %s", (type_name,))
+            if not c.fetchone():
+                c.execute(f"CREATE TYPE {type_name} AS ENUM ({', '.join(['%s'] * len(values))})", values)
+            else:
+                for value in values:
+                    c.execute(f"ALTER TYPE {type_name} ADD VALUE IF NOT EXISTS %s", (value,))
+        # New enum labels cannot be used until committed
+        conn.commit()
+
+        for type_name in legacy_columns:
+            column, labels, default = ENTRY_ENUMS[type_name]
+            if column == 'status':
+                c.execute("ALTER TABLE time_entries DROP CONSTRAINT IF EXISTS time_entries_status_check")
+            c.execute(f"ALTER TABLE time_entries ALTER COLUMN {column} DROP DEFAULT")
+            c.execute(f"""ALTER TABLE time_entries ALTER COLUMN {column} TYPE {type_name}
+                          USING NULLIF({column}, '')::{type_name}""")
+            if default:
+                c.execute(f"ALTER TABLE time_entries ALTER COLUMN {column} SET DEFAULT %s", (default,))
+        conn.commit()
+
+@st.cache_resource
 def init_database():
+    """Create and migrate the schema once per server process"""
     conn = get_connection()
     try:
+        ensure_entry_enums(conn)
         with conn.cursor() as c:
             # Users table
             c.execute('''CREATE TABLE IF NOT EXISTS users (
@@ -709,6 +1503,8 @@ def init_database():
                 assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(project_id, employee_id)
             )''')
+            # Share of the employee's working time planned for the project
+            c.execute("ALTER TABLE project_assignments ADD COLUMN IF NOT EXISTS allocation_pct REAL DEFAULT 0")
             
             # Time entries
             c.execute('''CREATE TABLE IF NOT EXISTS time_entries (
@@ -719,11 +1515,11 @@ def init_database():
                 hours REAL NOT NULL,
                 minutes INTEGER DEFAULT 0,
                 description TEXT,
-                task_type VARCHAR(50),
-                entry_type VARCHAR(50) DEFAULT 'project_work',
-                entry_category VARCHAR(50),
+                task_type task_kind,
+                entry_type entry_kind DEFAULT 'project_work',
+                entry_category entry_category_kind,
                 is_billable BOOLEAN DEFAULT TRUE,
-                status VARCHAR(20) DEFAULT 'draft' CHECK(status IN ('draft', 'submitted', 'approved', 'rejected', 'recalled')),
+                status entry_status DEFAULT 'draft',
                 submitted_at TIMESTAMP,
                 reviewed_by INTEGER REFERENCES users(id),
                 reviewed_at TIMESTAMP,
@@ -734,11 +1530,264 @@ def init_database():
             
             # Add new columns if they don't exist
             try:
-                c.execute("ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS entry_type VARCHAR(50) DEFAULT 'project_work'")
-                c.execute("ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS entry_category VARCHAR(50)")
+                c.execute("ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS entry_type entry_kind DEFAULT 'project_work'")
+                c.execute("ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS entry_category entry_category_kind")
             except:
                 pass
             
+            # Client-generated key per form submission so a repeated click inserts once
+            c.execute("ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64)")
+            c.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_time_entries_idempotency
+                         ON time_entries (idempotency_key) WHERE idempotency_key IS NOT NULL""")
+            
+            # Covering indexes for the dashboard, history and review queue filters
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_time_entries_status_date
+                         ON time_entries (status, entry_date) INCLUDE (employee_id, project_id, hours, minutes, is_billable)""")
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_time_entries_employee_date
+                         ON time_entries (employee_id, entry_date) INCLUDE (status, hours, minutes, is_billable)""")
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_time_entries_review_queue
+                         ON time_entries (entry_type, submitted_at) WHERE status = 'submitted'""")
+            
+            # Date range covered by an entry: a single day for project work, the
+            # requested span for EE Internal leave/training/absence
+            c.execute("ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS entry_period DATERANGE")
+            c.execute("""CREATE OR REPLACE FUNCTION set_entry_period() RETURNS trigger AS $$
+                         BEGIN
+                             IF NEW.entry_period IS NULL OR (TG_OP = 'UPDATE' AND NEW.entry_type = 'project_work') THEN
+                                 NEW.entry_period := daterange(NEW.entry_date, NEW.entry_date, '[]');
+                             END IF;
+                             RETURN NEW;
+                         END;
+                         $$ LANGUAGE plpgsql""")
+            c.execute("DROP TRIGGER IF EXISTS trg_time_entries_period ON time_entries")
+            c.execute("""CREATE TRIGGER trg_time_entries_period
+                         BEFORE INSERT OR UPDATE OF entry_date ON time_entries
+                         FOR EACH ROW EXECUTE FUNCTION set_entry_period()""")
+            # Backfill older rows, recovering EE Internal ranges from the "[start to end]" description prefix
+            c.execute("""UPDATE time_entries SET entry_period = CASE
+                             WHEN entry_type = 'ee_internal'
+                                  AND description ~ '^\\[[0-9]{4}-[0-9]{2}-[0-9]{2} to [0-9]{4}-[0-9]{2}-[0-9]{2}\\]'
+                             THEN daterange(substring(description from 2 for 10)::date,
+                                            substring(description from 16 for 10)::date, '[]')
+                             ELSE daterange(entry_date, entry_date, '[]')
+                         END
+                         WHERE entry_period IS NULL""")
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_time_entries_ee_period
+                         ON time_entries USING GIST (entry_period) WHERE entry_type = 'ee_internal'""")
+            
+            # Working-day calendar, rebuilt by refresh_work_calendar()
+            c.execute('''CREATE TABLE IF NOT EXISTS company_holidays (
+                holiday_date DATE PRIMARY KEY,
+                name VARCHAR(255) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            c.execute('''CREATE TABLE IF NOT EXISTS work_calendar (
+                cal_date DATE PRIMARY KEY,
+                week_start DATE NOT NULL,
+                is_weekend BOOLEAN NOT NULL,
+                holiday_name VARCHAR(255),
+                is_working_day BOOLEAN NOT NULL
+            )''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_work_calendar_week ON work_calendar (week_start) INCLUDE (is_working_day)")
+            # Working days in [start_date, end_date), falling back to Mon-Fri outside the calendar
+            c.execute("""CREATE OR REPLACE FUNCTION working_days_in(start_date DATE, end_date DATE) RETURNS INTEGER AS $$
+                             SELECT COUNT(*)::int
+                             FROM generate_series(start_date, end_date - 1, INTERVAL '1 day') AS d
+                             LEFT JOIN work_calendar wc ON wc.cal_date = d::date
+                             WHERE COALESCE(wc.is_working_day, EXTRACT(ISODOW FROM d) < 6)
+                         $$ LANGUAGE sql STABLE""")
+            
+            # Working days covered by an EE Internal request; hours are spread over these
+            c.execute("ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS working_days INTEGER")
+            
+            # One row per covered day. EE Internal hours are spread over the working days in
+            # the range (or over every day when the range has none); project work is one day.
+            c.execute("""CREATE OR REPLACE VIEW time_entry_days AS
+                         SELECT te.id AS entry_id, te.employee_id, te.project_id, te.entry_type,
+                                te.entry_category, te.task_type, te.status, te.is_billable, te.entry_period,
+                                d::date AS work_date,
+                                (te.hours + te.minutes / 60.0) / COALESCE(NULLIF(te.working_days, 0),
+                                    upper(te.entry_period) - lower(te.entry_period)) AS hours
+                         FROM time_entries te
+                         CROSS JOIN LATERAL generate_series(lower(te.entry_period), upper(te.entry_period) - 1,
+                                                            INTERVAL '1 day') AS d
+                         LEFT JOIN work_calendar wc ON wc.cal_date = d::date
+                         WHERE te.entry_period IS NOT NULL
+                         AND (COALESCE(te.working_days, 0) = 0 OR COALESCE(wc.is_working_day, EXTRACT(ISODOW FROM d) < 6))""")
+            
+            # Leave ledger: every accrual, approved usage and adjustment, with the running
+            # balance after each posting; leave_balances holds the current balance
+            c.execute('''CREATE TABLE IF NOT EXISTS leave_ledger (
+                id SERIAL PRIMARY KEY,
+                employee_id INTEGER NOT NULL REFERENCES users(id),
+                leave_type task_kind NOT NULL,
+                kind VARCHAR(20) NOT NULL CHECK(kind IN ('accrual', 'usage', 'adjustment', 'reversal')),
+                hours REAL NOT NULL,
+                balance_after REAL,
+                time_entry_id INTEGER REFERENCES time_entries(id) ON DELETE SET NULL,
+                note TEXT,
+                created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_leave_ledger_employee ON leave_ledger (employee_id, leave_type, id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_leave_ledger_entry ON leave_ledger (time_entry_id)")
+            c.execute('''CREATE TABLE IF NOT EXISTS leave_balances (
+                employee_id INTEGER NOT NULL REFERENCES users(id),
+                leave_type task_kind NOT NULL,
+                balance_hours REAL NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (employee_id, leave_type)
+            )''')
+            
+            # Post usage for approved leave that predates the ledger, then rebuild balances
+            c.execute("""INSERT INTO leave_ledger (employee_id, leave_type, kind, hours, time_entry_id, note, created_by, created_at)
+                         SELECT te.employee_id, te.task_type, 'usage', -(te.hours + te.minutes / 60.0), te.id,
+                                'Backfilled from approved leave', te.reviewed_by, COALESCE(te.reviewed_at, te.updated_at)
+                         FROM time_entries te
+                         WHERE te.entry_type = 'ee_internal' AND te.entry_category = 'Leave' AND te.status = 'approved'
+                         AND te.task_type IS NOT NULL
+                         AND NOT EXISTS (SELECT 1 FROM leave_ledger l WHERE l.time_entry_id = te.id)""")
+            if c.rowcount > 0:
+                c.execute("""UPDATE leave_ledger l SET balance_after = r.running
+                             FROM (SELECT id, SUM(hours) OVER (PARTITION BY employee_id, leave_type
+                                                               ORDER BY created_at, id) AS running
+                                   FROM leave_ledger) r
+                             WHERE l.id = r.id AND l.balance_after IS DISTINCT FROM r.running""")
+                c.execute("""INSERT INTO leave_balances (employee_id, leave_type, balance_hours)
+                             SELECT employee_id, leave_type, SUM(hours) FROM leave_ledger GROUP BY employee_id, leave_type
+                             ON CONFLICT (employee_id, leave_type) DO UPDATE SET balance_hours = EXCLUDED.balance_hours""")
+            
+            # Per-employee daily totals of submitted/approved hours, kept current by
+            # refresh_daily_totals() and flagged against overtime_threshold
+            c.execute('''CREATE TABLE IF NOT EXISTS daily_totals (
+                employee_id INTEGER NOT NULL REFERENCES users(id),
+                work_date DATE NOT NULL,
+                hours REAL NOT NULL DEFAULT 0,
+                is_overtime BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (employee_id, work_date)
+            )''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_daily_totals_overtime ON daily_totals (work_date) WHERE is_overtime")
+            
+            # Approved project hours per day, plus the running total on projects.consumed_hours,
+            # maintained by apply_project_hours() / recalculate_project_hours()
+            c.execute('''CREATE TABLE IF NOT EXISTS project_hours_daily (
+                project_id INTEGER NOT NULL REFERENCES projects(id),
+                work_date DATE NOT NULL,
+                hours REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (project_id, work_date)
+            )''')
+            c.execute("ALTER TABLE projects ADD COLUMN IF NOT EXISTS consumed_hours REAL")
+            c.execute("SELECT id FROM projects WHERE consumed_hours IS NULL")
+            recalculate_project_hours(c, [row[0] for row in c.fetchall()])
+            c.execute("ALTER TABLE projects ALTER COLUMN consumed_hours SET DEFAULT 0")
+            
+            # Billing rates with effective dates, and the invoices priced from them
+            c.execute('''CREATE TABLE IF NOT EXISTS billing_rates (
+                id SERIAL PRIMARY KEY,
+                scope VARCHAR(20) NOT NULL CHECK(scope IN ('employee', 'project', 'role', 'client')),
+                client_id INTEGER REFERENCES clients(id) ON DELETE CASCADE,
+                project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
+                employee_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                role VARCHAR(20),
+                hourly_rate NUMERIC(12, 2) NOT NULL,
+                effective_from DATE NOT NULL,
+                created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_billing_rates_effective ON billing_rates (effective_from)")
+            c.execute('''CREATE TABLE IF NOT EXISTS invoices (
+                id SERIAL PRIMARY KEY,
+                client_id INTEGER NOT NULL REFERENCES clients(id) ON DELETE RESTRICT,
+                period_start DATE NOT NULL,
+                period_end DATE NOT NULL,
+                total_hours REAL NOT NULL,
+                total_amount NUMERIC(14, 2) NOT NULL,
+                status VARCHAR(20) DEFAULT 'draft' CHECK(status IN ('draft', 'issued', 'void')),
+                created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            # Invoices are billing records: a client with any must not be deleted out from under them
+            c.execute("SELECT confdeltype FROM pg_constraint WHERE conname = 'invoices_client_id_fkey'")
+            row = c.fetchone()
+            if row and row[0] == 'c':
+                c.execute("""ALTER TABLE invoices DROP CONSTRAINT invoices_client_id_fkey,
+                             ADD CONSTRAINT invoices_client_id_fkey FOREIGN KEY (client_id)
+                                 REFERENCES clients(id) ON DELETE RESTRICT""")
+            c.execute('''CREATE TABLE IF NOT EXISTS invoice_lines (
+                id SERIAL PRIMARY KEY,
+                invoice_id INTEGER NOT NULL REFERENCES invoices(id) ON DELETE CASCADE,
+                time_entry_id INTEGER REFERENCES time_entries(id) ON DELETE SET NULL,
+                employee_id INTEGER,
+                project_id INTEGER,
+                entry_date DATE NOT NULL,
+                hours REAL NOT NULL,
+                rate NUMERIC(12, 2) NOT NULL,
+                rate_scope VARCHAR(20) NOT NULL,
+                amount NUMERIC(14, 2) NOT NULL,
+                voided BOOLEAN NOT NULL DEFAULT FALSE
+            )''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_invoice_lines_invoice ON invoice_lines (invoice_id)")
+            # An entry is billed on at most one live invoice; voiding an invoice frees its entries for a re-run
+            c.execute("ALTER TABLE invoice_lines ADD COLUMN IF NOT EXISTS voided BOOLEAN NOT NULL DEFAULT FALSE")
+            c.execute("ALTER TABLE invoice_lines DROP CONSTRAINT IF EXISTS invoice_lines_time_entry_id_key")
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_invoice_lines_live_entry ON invoice_lines (time_entry_id) WHERE NOT voided")
+            
+            # Append-only log of every time entry status change
+            c.execute('''CREATE TABLE IF NOT EXISTS entry_status_events (
+                id BIGSERIAL PRIMARY KEY,
+                time_entry_id INTEGER NOT NULL REFERENCES time_entries(id) ON DELETE CASCADE,
+                from_status entry_status,
+                to_status entry_status NOT NULL,
+                changed_by INTEGER,
+                changed_at TIMESTAMP NOT NULL,
+                comment TEXT
+            )''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_status_events_entry ON entry_status_events (time_entry_id, changed_at)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_status_events_decisions ON entry_status_events (changed_at) WHERE to_status IN ('approved', 'rejected')")
+            c.execute("SELECT EXISTS (SELECT 1 FROM entry_status_events)")
+            if not c.fetchone()[0]:
+                # Reconstruct submit and review events from the timestamps kept on the entries
+                c.execute("""INSERT INTO entry_status_events (time_entry_id, from_status, to_status, changed_by, changed_at)
+                             SELECT id, NULL, 'submitted', employee_id, submitted_at
+                             FROM time_entries WHERE submitted_at IS NOT NULL""")
+                c.execute("""INSERT INTO entry_status_events (time_entry_id, from_status, to_status, changed_by, changed_at, comment)
+                             SELECT id, 'submitted', status, reviewed_by, reviewed_at, review_comment
+                             FROM time_entries WHERE reviewed_at IS NOT NULL AND status IN ('approved', 'rejected')""")
+            
+            # Unlogged staging area for bulk time entry imports
+            c.execute('''CREATE UNLOGGED TABLE IF NOT EXISTS import_staging (
+                batch_id VARCHAR(32) NOT NULL,
+                row_no INTEGER NOT NULL,
+                username TEXT,
+                client TEXT,
+                project TEXT,
+                entry_date DATE,
+                hours REAL,
+                minutes INTEGER,
+                task_type TEXT,
+                description TEXT,
+                is_billable BOOLEAN,
+                status TEXT,
+                employee_id INTEGER,
+                project_id INTEGER,
+                error TEXT,
+                staged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (batch_id, row_no)
+            )''')
+            
+            # Background job run history
+            c.execute('''CREATE TABLE IF NOT EXISTS job_runs (
+                id SERIAL PRIMARY KEY,
+                job_name VARCHAR(100) NOT NULL,
+                status VARCHAR(20) NOT NULL CHECK(status IN ('running', 'success', 'failed')),
+                started_at TIMESTAMP NOT NULL,
+                finished_at TIMESTAMP,
+                duration_ms INTEGER,
+                detail TEXT
+            )''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_name_started ON job_runs (job_name, started_at DESC)")
+            
             # Recall requests
             c.execute('''CREATE TABLE IF NOT EXISTS recall_requests (
                 id SERIAL PRIMARY KEY,
@@ -763,6 +1812,38 @@ def init_database():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )''')
             
+            # Full-text search over entry descriptions and audit details
+            c.execute("""ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS search_vector tsvector
+                         GENERATED ALWAYS AS (to_tsvector('english', COALESCE(description, ''))) STORED""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_time_entries_search ON time_entries USING GIN (search_vector)")
+            c.execute("""ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS search_vector tsvector
+                         GENERATED ALWAYS AS (to_tsvector('english', COALESCE(details, ''))) STORED""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_search ON audit_logs USING GIN (search_vector)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_created ON audit_logs (created_at)")
+            # Trigram index for substring action filters; skipped where the role cannot create extensions
+            c.execute("SAVEPOINT trigram_setup")
+            try:
+                c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_audit_logs_action_trgm ON audit_logs USING GIN (action gin_trgm_ops)")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_users_name_trgm ON users USING GIN (full_name gin_trgm_ops)")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING GIN (username gin_trgm_ops)")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_projects_name_trgm ON projects USING GIN (name gin_trgm_ops)")
+                c.execute("CREATE INDEX IF NOT EXISTS idx_clients_name_trgm ON clients USING GIN (name gin_trgm_ops)")
+                c.execute("RELEASE SAVEPOINT trigram_setup")
+            except psycopg2.Error:
+                c.execute("ROLLBACK TO SAVEPOINT trigram_setup")
+            
+            # Prefix indexes for the typeahead pickers
+            c.execute("CREATE INDEX IF NOT EXISTS idx_users_username_prefix ON users (lower(username) text_pattern_ops)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_users_name_prefix ON users (lower(full_name) text_pattern_ops)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_projects_name_prefix ON projects (lower(name) text_pattern_ops)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_clients_name_prefix ON clients (lower(name) text_pattern_ops)")
+            
+            # Sort keys for the keyset-paginated admin grids
+            c.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at, id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_projects_created ON projects (created_at, id)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_time_entries_reviewed ON time_entries (entry_date, id) WHERE status IN ('approved', 'rejected')")
+            
             # System settings
             c.execute('''CREATE TABLE IF NOT EXISTS settings (
                 key VARCHAR(100) PRIMARY KEY,
@@ -783,12 +1864,34 @@ def init_database():
                 ('recall_window_hours', '24'),
                 ('overtime_threshold', '9'),
                 ('work_week_start', 'Monday'),
+                ('standard_day_hours', '8'),
+                ('budget_alert_pct', '80'),
+                ('audit_retention_days', '0'),
+                ('reminder_digests_enabled', 'false'),
                 ('company_name', 'Execution Edge')
             ]
             for key, val in defaults:
                 c.execute("""INSERT INTO settings (key, value) VALUES (%s, %s) 
                              ON CONFLICT (key) DO NOTHING""", (key, val))
             
+            refresh_work_calendar(c)
+            
+            # Seed daily totals from existing entries on first start, and rebuild them
+            # whenever the set of counted statuses changes
+            counted = ",".join(COUNTED_STATUSES)
+            c.execute("SELECT value FROM settings WHERE key = 'daily_totals_statuses'")
+            row = c.fetchone()
+            if not row or row[0] != counted:
+                c.execute("DELETE FROM daily_totals")
+                c.execute("""INSERT INTO daily_totals (employee_id, work_date, hours, is_overtime)
+                             SELECT employee_id, work_date, SUM(hours),
+                                    SUM(hours) > COALESCE((SELECT value::real FROM settings WHERE key = 'overtime_threshold'), 9)
+                             FROM time_entry_days
+                             WHERE status = ANY(%s::entry_status[])
+                             GROUP BY employee_id, work_date""", (COUNTED_STATUSES,))
+                c.execute("""INSERT INTO settings (key, value) VALUES ('daily_totals_statuses', %s)
+                             ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value""", (counted,))
+            
             # Create EE Internal client if not exists
             c.execute("SELECT id FROM clients WHERE name = 'EE Internal'")
             if not c.fetchone():
@@ -798,6 +1901,146 @@ def init_database():
     finally:
         release_connection(conn)
 
+def refresh_work_calendar(c):
+    """Rebuild work_calendar from weekends, company_holidays and work_week_start, then recount working days
+    on pending EE Internal requests and on approved ones that have not started, keeping their hours per day.
+    Approved requests already under way keep their hours and balance postings. Takes an open cursor; caller commits."""
+    c.execute("SELECT value FROM settings WHERE key = 'work_week_start'")
+    row = c.fetchone()
+    week_start_day = row[0] if row else 'Monday'
+    
+    today = datetime.date.today()
+    c.execute("""INSERT INTO work_calendar (cal_date, week_start, is_weekend, holiday_name, is_working_day)
+                 SELECT d::date,
+                        CASE WHEN %s = 'Sunday' THEN d::date - EXTRACT(DOW FROM d)::int
+                             ELSE d::date - (EXTRACT(ISODOW FROM d)::int - 1) END,
+                        EXTRACT(ISODOW FROM d) >= 6,
+                        h.name,
+                        EXTRACT(ISODOW FROM d) < 6 AND h.holiday_date IS NULL
+                 FROM generate_series(%s::date, %s::date, INTERVAL '1 day') AS d
+                 LEFT JOIN company_holidays h ON h.holiday_date = d::date
+                 ON CONFLICT (cal_date) DO UPDATE SET
+                     week_start = EXCLUDED.week_start, is_weekend = EXCLUDED.is_weekend,
+                     holiday_name = EXCLUDED.holiday_name, is_working_day = EXCLUDED.is_working_day""",
+              (week_start_day, datetime.date(today.year - 5, 1, 1), datetime.date(today.year + 2, 12, 31)))
+    
+    # Hours are per charged day (working days, or the calendar span when there are none),
+    # so rescale them along with the count
+    c.execute("""UPDATE time_entries te SET working_days = wd.days,
+                        hours = wd.old_hours * COALESCE(NULLIF(wd.days, 0), wd.span)
+                                / COALESCE(NULLIF(wd.old_days, 0), wd.span)
+                 FROM (SELECT id, hours AS old_hours, working_days AS old_days,
+                              upper(entry_period) - lower(entry_period) AS span,
+                              working_days_in(lower(entry_period), upper(entry_period)) AS days
+                       FROM time_entries
+                       WHERE entry_type = 'ee_internal' AND entry_period IS NOT NULL
+                       AND (status IN ('draft', 'submitted') OR (status = 'approved' AND lower(entry_period) > %s))) wd
+                 WHERE te.id = wd.id AND te.working_days IS DISTINCT FROM wd.days
+                 RETURNING te.id, te.employee_id, te.status, te.entry_category, te.task_type, te.hours - wd.old_hours""",
+              (today,))
+    changed = c.fetchall()
+    
+    # Approved leave that has not started already drew on the balance; post the difference
+    for entry_id, employee_id, status, category, task_type, delta in changed:
+        if status == 'approved' and category == 'Leave' and task_type and delta:
+            post_leave_ledger(c, employee_id, task_type, 'adjustment', -delta, entry_id, "Working days recounted")
+    refresh_daily_totals(c, entry_day_keys(c, [row[0] for row in changed]))
+
+def count_working_days(start_date, end_date):
+    """Working days between two dates inclusive, counted as refresh_work_calendar does"""
+    result = execute_query("SELECT working_days_in(%s::date, %s::date + 1) AS days", (start_date, end_date))
+    return int(result[0]['days']) if result else 0
+
+def get_week_start(day):
+    """First day of the configured work week containing day"""
+    result = execute_query("SELECT week_start FROM work_calendar WHERE cal_date = %s", (day,))
+    if result:
+        return result[0]['week_start']
+    return day - timedelta(days=day.weekday())
+
+def entry_day_keys(c, entry_ids):
+    """(employee_id, date) pairs covered by the given time entries"""
+    c.execute("""SELECT te.employee_id, d::date
+                 FROM time_entries te
+                 CROSS JOIN LATERAL generate_series(lower(te.entry_period), upper(te.entry_period) - 1,
+                                                    INTERVAL '1 day') AS d
+                 WHERE te.id = ANY(%s)""", (list(entry_ids),))
+    return c.fetchall()
+
+def refresh_daily_totals(c, day_keys):
+    """Recompute daily_totals and overtime flags for (employee_id, date) pairs.
+    Takes an open cursor so the totals commit with the caller's change."""
+    day_keys = list(day_keys)
+    if not day_keys:
+        return
+    c.execute("""INSERT INTO daily_totals (employee_id, work_date, hours, is_overtime, updated_at)
+                 SELECT k.employee_id, k.work_date, COALESCE(SUM(ted.hours), 0),
+                        COALESCE(SUM(ted.hours), 0) > COALESCE((SELECT value::real FROM settings WHERE key = 'overtime_threshold'), 9),
+                        %s
+                 FROM unnest(%s::int[], %s::date[]) AS k(employee_id, work_date)
+                 LEFT JOIN time_entry_days ted ON ted.employee_id = k.employee_id AND ted.work_date = k.work_date
+                      AND ted.status = ANY(%s::entry_status[])
+                 GROUP BY k.employee_id, k.work_date
+                 ON CONFLICT (employee_id, work_date) DO UPDATE
+                 SET hours = EXCLUDED.hours, is_overtime = EXCLUDED.is_overtime, updated_at = EXCLUDED.updated_at""",
+              (get_local_time_naive(), [k[0] for k in day_keys], [k[1] for k in day_keys], COUNTED_STATUSES))
+
+def apply_project_hours(c, project_id, work_date, delta):
+    """Add signed approved hours to a project's running total and daily burn"""
+    c.execute("""INSERT INTO project_hours_daily (project_id, work_date, hours) VALUES (%s, %s, %s)
+                 ON CONFLICT (project_id, work_date) DO UPDATE SET hours = project_hours_daily.hours + EXCLUDED.hours""",
+              (project_id, work_date, delta))
+    c.execute("UPDATE projects SET consumed_hours = COALESCE(consumed_hours, 0) + %s WHERE id = %s", (delta, project_id))
+
+def recalculate_project_hours(c, project_ids):
+    """Rebuild project_hours_daily and consumed_hours from approved entries"""
+    project_ids = list(project_ids)
+    if not project_ids:
+        return
+    c.execute("DELETE FROM project_hours_daily WHERE project_id = ANY(%s)", (project_ids,))
+    c.execute("""INSERT INTO project_hours_daily (project_id, work_date, hours)
+                 SELECT project_id, entry_date, SUM(hours + minutes / 60.0)
+                 FROM time_entries
+                 WHERE status = 'approved' AND project_id = ANY(%s)
+                 GROUP BY project_id, entry_date""", (project_ids,))
+    c.execute("""UPDATE projects p SET consumed_hours = COALESCE(
+                     (SELECT SUM(d.hours) FROM project_hours_daily d WHERE d.project_id = p.id), 0)
+                 WHERE p.id = ANY(%s)""", (project_ids,))
+
+def record_status_event(c, entry_id, from_status, to_status, changed_by, comment=None):
+    """Append a status transition to entry_status_events using the caller's cursor"""
+    c.execute("""INSERT INTO entry_status_events (time_entry_id, from_status, to_status, changed_by, changed_at, comment)
+                 VALUES (%s, %s, %s, %s, %s, %s)""",
+              (entry_id, from_status, to_status, changed_by, get_local_time_naive(), comment))
+
+WRITE_RETRIES = 3
+
+def run_idempotent_write(write):
+    """Run write(cursor) in its own transaction, retrying on a dropped connection.
+    Only for writes guarded by an idempotency key, so a retry after an unseen commit is a no-op."""
+    for attempt in range(WRITE_RETRIES):
+        conn = get_connection()
+        try:
+            with conn.cursor() as c:
+                result = write(c)
+                conn.commit()
+            return result
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if not conn.closed or attempt == WRITE_RETRIES - 1:
+                raise
+        finally:
+            release_connection(conn)
+        time.sleep(0.2 * 2 ** attempt)
+
+def submission_key(form, *values):
+    """Idempotency key for a form submission: kept while the form's contents stay the same, so a double-click
+    or a resubmit after the rerun is recognised as the insert already made. Editing any field starts a fresh token."""
+    contents = "|".join([form] + [str(v) for v in values])
+    state = st.session_state.get(f'submission_token_{form}')
+    if not state or state['contents'] != contents:
+        state = st.session_state[f'submission_token_{form}'] = {'contents': contents, 'token': uuid.uuid4().hex}
+    return hashlib.sha256(f"{state['token']}|{contents}".encode()).hexdigest()
+
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -809,16 +2052,176 @@ def log_audit(user_id, action, entity_type=None, entity_id=None, details=None):
     try:
         with conn.cursor() as c:
             local_time = get_local_time_naive()
-            c.execute("""INSERT INTO audit_logs (user_id, action, entity_type, entity_id, details, created_at) 
-                         VALUES (%s, %s, %s, %s, %s, %s)""", (user_id, action, entity_type, entity_id, details, local_time))
+            execute_statement(c, 'log_audit', (user_id, action, entity_type, entity_id, details, local_time))
             conn.commit()
     finally:
         release_connection(conn)
 
 def get_setting(key):
-    result = execute_query("SELECT value FROM settings WHERE key=%s", (key,))
+    result = execute_query('get_setting', (key,))
     return result[0]['value'] if result else None
 
+# ============== SEARCH ==============
+SEARCH_PAGE_SIZE = 25
+
+def search_clause(alias, term):
+    """WHERE fragment, rank expression and params for a websearch-style match on alias.search_vector"""
+    tsquery = "websearch_to_tsquery('english', %s)"
+    return (f"{alias}.search_vector @@ {tsquery}",
+            f"ts_rank_cd({alias}.search_vector, {tsquery})",
+            [term])
+
+def page_selector(total, key, page_size=SEARCH_PAGE_SIZE):
+    """Render a page picker for total rows and return the OFFSET for the chosen page"""
+    pages = max(1, -(-int(total) // page_size))
+    if pages == 1:
+        return 0
+    col1, col2 = st.columns([1, 3])
+    page = col1.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key=key)
+    col2.caption(f"Page {page} of {pages} · {total} matches")
+    return (page - 1) * page_size
+
+# ============== DATA GRID ==============
+GRID_PAGE_SIZE = 50
+
+# Admin listings shown through data_grid; per-row totals come from one pre-aggregated join each
+GRID_QUERIES = {
+    'clients': """
+        SELECT c.id, c.name as "Client", c.description as "Description",
+               CASE WHEN c.is_active THEN 'Active' ELSE 'Inactive' END as "Status",
+               COALESCE(cp.projects, 0) as "Projects",
+               COALESCE(cp.hours, 0) as "Total_Hours"
+        FROM clients c
+        LEFT JOIN (SELECT client_id, COUNT(*) AS projects, SUM(consumed_hours) AS hours
+                   FROM projects GROUP BY client_id) cp ON c.id = cp.client_id
+    """,
+    'projects': """
+        SELECT p.id, c.name as "Client", p.name as "Project", u.full_name as "Manager",
+               p.status as "Status", p.created_at as "Created",
+               COALESCE(pa.team, 0) as "Team",
+               COALESCE(p.consumed_hours, 0) as "Hours", p.budget_hours as "Budget",
+               ROUND((p.consumed_hours * 100.0 / NULLIF(p.budget_hours, 0))::numeric, 1) as "Budget_Used_Pct"
+        FROM projects p
+        JOIN clients c ON p.client_id = c.id
+        LEFT JOIN users u ON p.manager_id = u.id
+        LEFT JOIN (SELECT project_id, COUNT(*) AS team
+                   FROM project_assignments GROUP BY project_id) pa ON p.id = pa.project_id
+    """,
+}
+
+def estimate_rows(query, params=()):
+    """Planner row estimate for a query, used where an exact COUNT(*) would scan the table"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as c:
+            c.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            return int(c.fetchone()[0][0]['Plan']['Plan Rows'])
+    finally:
+        release_connection(conn)
+
+def keyset_value(value):
+    """Convert a pandas/numpy cell back to a plain Python value for a keyset bound"""
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if hasattr(value, 'item') else value
+
+def data_grid(key, base_query, params=(), sort_columns=('id',), filter_columns=(), page_size=GRID_PAGE_SIZE):
+    """Render a server-side grid over base_query and return the visible page.
+    
+    Filtering, sorting and paging run in SQL with keyset pagination on (sort column, id), so only
+    one page is fetched. base_query must expose a unique id column and sort_columns must be NOT NULL.
+    """
+    col1, col2, col3 = st.columns([2, 1, 1])
+    search = col1.text_input("🔍 Filter", key=f"{key}_filter").strip()
+    sort_col = col2.selectbox("Sort By", list(sort_columns), key=f"{key}_sort")
+    descending = col3.selectbox("Order", ["Descending", "Ascending"], key=f"{key}_order") == "Descending"
+    
+    conditions, filter_params = [], []
+    if search and filter_columns:
+        conditions.append("(" + " OR ".join(f'g."{col}"::text ILIKE %s' for col in filter_columns) + ")")
+        filter_params = [f"%{search}%"] * len(filter_columns)
+    filtered = f"SELECT * FROM ({base_query}) g"
+    filtered_params = tuple(params) + tuple(filter_params)
+    
+    # Page boundaries reset whenever the filter, sort or caller's parameters change
+    state = st.session_state.setdefault(f"{key}_keyset", {'signature': None, 'starts': [None]})
+    signature = (search, sort_col, descending, repr(filtered_params))
+    if state['signature'] != signature:
+        state.update(signature=signature, starts=[None])
+    
+    op, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+    page_conditions, page_params = list(conditions), list(filtered_params)
+    if state['starts'][-1] is not None:
+        page_conditions.append(f'(g."{sort_col}", g.id) {op} (%s, %s)')
+        page_params += list(state['starts'][-1])
+    page_query = filtered + (" WHERE " + " AND ".join(page_conditions) if page_conditions else "")
+    page_query += f' ORDER BY g."{sort_col}" {direction}, g.id {direction} LIMIT %s'
+    
+    page = execute_df(page_query, tuple(page_params) + (page_size + 1,))
+    has_next = len(page) > page_size
+    page = page.head(page_size)
+    
+    estimate = estimate_rows(filtered + (" WHERE " + " AND ".join(conditions) if conditions else ""), filtered_params)
+    first_row = (len(state['starts']) - 1) * page_size
+    
+    st.dataframe(page, use_container_width=True, hide_index=True)
+    
+    col1, col2, col3 = st.columns([1, 1, 4])
+    if col1.button("◀ Previous", key=f"{key}_prev", disabled=len(state['starts']) == 1):
+        state['starts'].pop()
+        st.rerun()
+    if col2.button("Next ▶", key=f"{key}_next", disabled=not has_next):
+        last = page.iloc[-1]
+        state['starts'].append((keyset_value(last[sort_col]), keyset_value(last['id'])))
+        st.rerun()
+    if not page.empty:
+        col3.caption(f"Rows {first_row + 1}–{first_row + len(page)} of ~{max(estimate, first_row + len(page))}")
+    elif search:
+        col3.caption(f"🔍 No rows match '{search}'")
+    
+    return page
+
+# ============== PICKERS ==============
+PICKER_LIMIT = 20
+
+# source -> (FROM clause, indexed search column, display label)
+PICKER_SOURCES = {
+    'user': ("users", ("username", "full_name"), "username || ' · ' || full_name"),
+    'employee': ("users", ("full_name",), "full_name || COALESCE(' · ' || department, '')"),
+    'client': ("clients", ("name",), "name"),
+    'project': ("projects p JOIN clients c ON p.client_id = c.id", ("p.name",), "p.name || ' · ' || c.name"),
+}
+
+def picker_options(source, text, filters=None, params=(), limit=PICKER_LIMIT):
+    """Top matches for a picker: prefix hits (text_pattern_ops index) first, then substring hits (trigram index)"""
+    from_clause, columns, label = PICKER_SOURCES[source]
+    id_column = "p.id" if source == 'project' else "id"
+    extra = f" AND ({filters})" if filters else ""
+    escaped = text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    prefix = " OR ".join(f"lower({column}) LIKE %s" for column in columns)
+    substring = " OR ".join(f"{column} ILIKE %s" for column in columns)
+    prefix_params = [escaped + '%'] * len(columns)
+    rows = execute_query(f"""
+        SELECT id, label FROM (
+            (SELECT {id_column} AS id, {label} AS label, 0 AS rank FROM {from_clause}
+             WHERE ({prefix}){extra} ORDER BY lower({columns[0]}) LIMIT %s)
+            UNION ALL
+            (SELECT {id_column}, {label}, 1 FROM {from_clause}
+             WHERE %s != '' AND ({substring}) AND NOT ({prefix}){extra} ORDER BY lower({columns[0]}) LIMIT %s)
+        ) matches ORDER BY rank, lower(label) LIMIT %s
+    """, (*prefix_params, *params, limit, escaped, *['%' + escaped + '%'] * len(columns), *prefix_params, *params, limit, limit))
+    return [(row['id'], row['label']) for row in rows]
+
+def typeahead_picker(label, source, key, filters=None, params=()):
+    """Search box plus a short list of matching rows; returns the chosen (id, label) or None"""
+    text = st.text_input(label, key=f"{key}_q", placeholder="Type to search...").strip()
+    options = picker_options(source, text, filters, params)
+    if not options:
+        st.caption("No matches")
+        return None
+    return st.selectbox(f"{label} Matches", options, format_func=lambda option: option[1],
+                        key=f"{key}_pick", label_visibility="collapsed")
+
 # ============== AUTHENTICATION ==============
 def authenticate(username, password):
     result = execute_query(
@@ -924,6 +2327,11 @@ def workhub_project_time_entry():
         st.warning("⚠️ You have no projects assigned. Contact your manager.")
         return
     
+    mode = st.radio("Entry Mode", ["Single Entry", "Week Grid"], horizontal=True, key="proj_entry_mode")
+    if mode == "Week Grid":
+        workhub_week_grid(user, projects_df)
+        return
+    
     # Form layout
     with st.container():
         col1, col2 = st.columns(2)
@@ -938,10 +2346,7 @@ def workhub_project_time_entry():
             
             project_id = int(client_projects[client_projects['project_name'] == selected_project]['id'].values[0])
             
-            task_type = st.selectbox("Task Type", [
-                "Development", "Design", "Meeting", "Documentation", 
-                "Testing", "Support", "Research", "Other"
-            ], key="proj_task")
+            task_type = st.selectbox("Task Type", PROJECT_TASK_TYPES, key="proj_task")
         
         with col2:
             st.markdown("##### ⏱️ Time Details")
@@ -962,23 +2367,166 @@ def workhub_project_time_entry():
     
     col1, col2, col3 = st.columns([1, 1, 2])
     
+    form_values = (project_id, entry_date, hours, minutes, description, task_type, is_billable)
+    
     with col1:
         if st.button("💾 Save Draft", use_container_width=True):
-            save_time_entry(user['id'], project_id, entry_date, hours, minutes, description, task_type, is_billable, 'draft', 'project_work', None)
-            st.success("✅ Draft saved!")
-            st.rerun()
+            if save_time_entry(user['id'], project_id, entry_date, hours, minutes, description, task_type, is_billable, 'draft', 'project_work', None,
+                               submission_key('project_draft', *form_values)):
+                st.success("✅ Draft saved!")
+                st.rerun()
+            else:
+                st.info("ℹ️ This draft was already saved; edit the form to log another")
     
     with col2:
         if st.button("📤 Submit", use_container_width=True, type="primary"):
-            save_time_entry(user['id'], project_id, entry_date, hours, minutes, description, task_type, is_billable, 'submitted', 'project_work', None)
-            st.success("✅ Entry submitted for approval!")
-            st.rerun()
+            if save_time_entry(user['id'], project_id, entry_date, hours, minutes, description, task_type, is_billable, 'submitted', 'project_work', None,
+                               submission_key('project_submit', *form_values)):
+                st.success("✅ Entry submitted for approval!")
+                st.rerun()
+            else:
+                st.info("ℹ️ This entry was already submitted; edit the form to log another")
     
     # Show today's entries
     st.markdown("---")
     st.markdown("##### 📋 Today's Entries")
     show_entries_table(user['id'], entry_date)
 
+def workhub_week_grid(user, projects_df):
+    """Projects × days editor for a whole week of draft project time"""
+    week_start = get_week_start(st.date_input("Week Of", datetime.date.today(), key="grid_week"))
+    days = [week_start + timedelta(days=i) for i in range(7)]
+    day_labels = [d.strftime('%a %d/%m') for d in days]
+    
+    labels = (projects_df['client_name'] + ' · ' + projects_df['project_name']).tolist()
+    labels = [f"{label} (#{pid})" if labels.count(label) > 1 else label for label, pid in zip(labels, projects_df['id'])]
+    project_ids = dict(zip(labels, projects_df['id'].astype(int)))
+    
+    week = execute_df("""
+        SELECT project_id, entry_date, status::text AS status, SUM(hours + minutes / 60.0) AS hours
+        FROM time_entries
+        WHERE employee_id = %s AND entry_type = 'project_work' AND entry_date BETWEEN %s AND %s
+        AND status = ANY(%s::entry_status[])
+        GROUP BY project_id, entry_date, status
+    """, (user['id'], days[0], days[-1], GRID_STATUSES))
+    
+    grid = pd.DataFrame(0.0, index=labels, columns=day_labels)
+    locked = pd.DataFrame(0.0, index=labels, columns=day_labels)
+    label_of = {pid: label for label, pid in project_ids.items()}
+    for _, row in week.iterrows():
+        label = label_of.get(int(row['project_id']))
+        if label is None:
+            continue
+        target = grid if row['status'] == 'draft' else locked
+        target.loc[label, day_labels[days.index(row['entry_date'])]] += float(row['hours'])
+    
+    col1, col2 = st.columns(2)
+    task_type = col1.selectbox("Task Type for New Cells", PROJECT_TASK_TYPES, key="grid_task")
+    is_billable = col2.checkbox("💰 Billable", value=True, key="grid_billable")
+    
+    st.caption("Draft hours per project and day. Clear a cell to remove its draft.")
+    edited = st.data_editor(
+        grid, use_container_width=True, key=f"grid_{week_start}",
+        column_config={label: st.column_config.NumberColumn(label, min_value=0.0, max_value=24.0, step=0.25, format="%.2f")
+                       for label in day_labels})
+    
+    if locked.values.sum() > 0:
+        with st.expander("🔒 Already Submitted This Week"):
+            st.dataframe(locked.loc[locked.sum(axis=1) > 0], use_container_width=True)
+    
+    edited = edited.fillna(0)
+    daily = edited.sum() + locked.sum()
+    st.caption("Daily totals: " + " · ".join(f"{label} {hours:.2f}h" for label, hours in daily.items()))
+    
+    cells = {(project_ids[label], days[i]): float(edited.loc[label, day_label])
+             for label in labels for i, day_label in enumerate(day_labels)}
+    
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        if st.button("💾 Save Week", use_container_width=True, key="grid_save"):
+            counts = save_week_entries(user['id'], days, cells, task_type, is_billable, submit=False)
+            st.success(f"✅ {counts['added']} added, {counts['updated']} updated, {counts['removed']} removed")
+            st.rerun()
+    with col2:
+        if st.button("📤 Save & Submit Week", use_container_width=True, type="primary", key="grid_submit"):
+            counts = save_week_entries(user['id'], days, cells, task_type, is_billable, submit=True)
+            st.success(f"✅ {counts['submitted']} entries submitted for approval!")
+            st.rerun()
+
+def save_week_entries(employee_id, days, cells, task_type, is_billable, submit):
+    """Apply a week grid to the employee's drafts in one transaction.
+    
+    cells maps (project_id, date) to decimal hours. Cells are diffed against the existing drafts:
+    new cells are inserted with one multi-row INSERT, changed cells updated with one batched
+    UPDATE and cleared cells deleted. With submit=True every draft in the week is then submitted.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as c:
+            local_time = get_local_time_naive()
+            c.execute("""SELECT id, project_id, entry_date, hours + minutes / 60.0
+                         FROM time_entries
+                         WHERE employee_id = %s AND entry_type = 'project_work' AND status = 'draft'
+                         AND entry_date BETWEEN %s AND %s AND project_id = ANY(%s)
+                         ORDER BY id FOR UPDATE""",
+                      (employee_id, days[0], days[-1], list({pid for pid, _ in cells})))
+            drafts = {}
+            for entry_id, project_id, day, hours in c.fetchall():
+                ids, total = drafts.get((project_id, day), ([], 0.0))
+                drafts[(project_id, day)] = (ids + [entry_id], total + float(hours))
+            
+            inserts, updates, deletes = [], [], []
+            for (project_id, day), value in cells.items():
+                value = round(value * 4) / 4
+                hours, minutes = int(value), int(round((value - int(value)) * 60))
+                ids, current = drafts.get((project_id, day), ([], 0.0))
+                if abs(value - current) < 0.01:
+                    continue
+                if not ids:
+                    inserts.append((employee_id, project_id, day, hours, minutes, '', task_type, is_billable,
+                                    'draft', local_time, local_time, 'project_work'))
+                elif value == 0:
+                    deletes.extend(ids)
+                else:
+                    updates.append((ids[0], hours, minutes, local_time))
+                    deletes.extend(ids[1:])
+            
+            new_ids = []
+            if inserts:
+                new_ids = [row[0] for row in execute_values(c, """
+                    INSERT INTO time_entries (employee_id, project_id, entry_date, hours, minutes, description, task_type,
+                                              is_billable, status, created_at, updated_at, entry_type)
+                    VALUES %s RETURNING id""", inserts, fetch=True)]
+                execute_values(c, """INSERT INTO entry_status_events (time_entry_id, from_status, to_status, changed_by, changed_at)
+                                     VALUES %s""", [(entry_id, None, 'draft', employee_id, local_time) for entry_id in new_ids])
+            if updates:
+                execute_values(c, """UPDATE time_entries te SET hours = v.hours, minutes = v.minutes, updated_at = v.updated_at
+                                     FROM (VALUES %s) AS v(id, hours, minutes, updated_at) WHERE te.id = v.id""", updates)
+            if deletes:
+                c.execute("DELETE FROM time_entries WHERE id = ANY(%s)", (deletes,))
+            
+            submitted = []
+            if submit:
+                c.execute("""UPDATE time_entries SET status = 'submitted', submitted_at = %s, updated_at = %s
+                             WHERE employee_id = %s AND entry_type = 'project_work' AND status = 'draft'
+                             AND entry_date BETWEEN %s AND %s RETURNING id""",
+                          (local_time, local_time, employee_id, days[0], days[-1]))
+                submitted = [row[0] for row in c.fetchall()]
+                if submitted:
+                    execute_values(c, """INSERT INTO entry_status_events (time_entry_id, from_status, to_status, changed_by, changed_at)
+                                         VALUES %s""", [(entry_id, 'draft', 'submitted', employee_id, local_time) for entry_id in submitted])
+            
+            refresh_daily_totals(c, [(employee_id, day) for day in days])
+            conn.commit()
+    finally:
+        release_connection(conn)
+    
+    counts = {'added': len(inserts), 'updated': len(updates), 'removed': len(deletes), 'submitted': len(submitted)}
+    if any(counts.values()):
+        log_audit(employee_id, "TIME_ENTRY_WEEK_SAVE", "time_entry", None,
+                  f"Week of {days[0]}: " + ", ".join(f"{n} {action}" for action, n in counts.items()))
+    return counts
+
 def workhub_ee_internal():
     user = st.session_state.user
     
@@ -1030,28 +2578,25 @@ def workhub_ee_internal():
                 # Calculate total days
                 if end_date >= start_date:
                     total_days = (end_date - start_date).days + 1
-                    st.info(f"📆 **Total Days:** {total_days} day(s)")
+                    working_days = count_working_days(start_date, end_date)
+                    st.info(f"📆 **Total Days:** {total_days} day(s) · **Working Days:** {working_days}")
                 else:
                     st.error("End date must be after start date")
                     total_days = 0
+                    working_days = 0
                 
                 if category == 'Leave':
-                    leave_type = st.selectbox("Leave Type", [
-                        "Annual Leave", "Sick Leave", "Personal Leave", 
-                        "Maternity/Paternity Leave", "Unpaid Leave", "Compassionate Leave", "Other Leave"
-                    ], key="ee_leave_type")
+                    leave_type = st.selectbox("Leave Type", LEAVE_TYPES, key="ee_leave_type")
                     task_type = leave_type
+                    balances = get_leave_balances(user['id'])
+                    current = balances[balances['Leave Type'] == leave_type]
+                    balance = float(current['Balance (hrs)'].iloc[0]) if not current.empty else 0.0
+                    st.caption(f"🧾 Current {leave_type} balance: **{balance:.1f}h**")
                 elif category == 'Other Absence':
-                    absence_type = st.selectbox("Absence Type", [
-                        "Jury Duty", "Bereavement", "Medical Appointment",
-                        "Family Emergency", "Public Holiday", "Work From Home", "Other Absence"
-                    ], key="ee_absence_type")
+                    absence_type = st.selectbox("Absence Type", ABSENCE_TYPES, key="ee_absence_type")
                     task_type = absence_type
                 else:  # Training
-                    training_type = st.selectbox("Training Type", [
-                        "Internal Training", "External Course", "Conference",
-                        "Workshop", "Certification", "Self-Study", "Onboarding", "Seminar"
-                    ], key="ee_training_type")
+                    training_type = st.selectbox("Training Type", TRAINING_TYPES, key="ee_training_type")
                     task_type = training_type
             
             with col2:
@@ -1062,8 +2607,9 @@ def workhub_ee_internal():
                 with hcol2:
                     minutes_per_day = st.selectbox("Minutes", [0, 15, 30, 45], key="ee_mins")
                 
-                # Calculate total hours
-                total_hours = (hours_per_day + minutes_per_day/60) * total_days if total_days > 0 else 0
+                # Calculate total hours over working days (every day if the range has none)
+                charged_days = working_days or total_days
+                total_hours = (hours_per_day + minutes_per_day/60) * charged_days if total_days > 0 else 0
                 st.success(f"⏱️ **Total Hours:** {total_hours:.1f} hours")
                 
                 # Show info based on category
@@ -1086,13 +2632,17 @@ def workhub_ee_internal():
         st.markdown("<br>", unsafe_allow_html=True)
         
         col1, col2, col3 = st.columns([1, 1, 2])
+        form_values = (category, start_date, end_date, hours_per_day, minutes_per_day, description, task_type)
         
         with col1:
             if st.button("💾 Save Draft", use_container_width=True, key="ee_draft"):
                 if total_days > 0:
-                    save_ee_internal_entry(user['id'], start_date, end_date, hours_per_day, minutes_per_day, description, task_type, 'draft', category)
-                    st.success("✅ Draft saved!")
-                    st.rerun()
+                    if save_ee_internal_entry(user['id'], start_date, end_date, hours_per_day, minutes_per_day, description, task_type, 'draft', category,
+                                              submission_key('ee_draft', *form_values)):
+                        st.success("✅ Draft saved!")
+                        st.rerun()
+                    else:
+                        st.info("ℹ️ This draft was already saved; edit the form to log another")
                 else:
                     st.error("Invalid date range")
         
@@ -1102,9 +2652,12 @@ def workhub_ee_internal():
                     if not description:
                         st.error("Please provide a description/reason")
                     else:
-                        save_ee_internal_entry(user['id'], start_date, end_date, hours_per_day, minutes_per_day, description, task_type, 'submitted', category)
-                        st.success("✅ Request submitted for approval!")
-                        st.rerun()
+                        if save_ee_internal_entry(user['id'], start_date, end_date, hours_per_day, minutes_per_day, description, task_type, 'submitted', category,
+                                                  submission_key('ee_submit', *form_values)):
+                            st.success("✅ Request submitted for approval!")
+                            st.rerun()
+                        else:
+                            st.info("ℹ️ This request was already submitted; edit the form to log another")
                 else:
                     st.error("Invalid date range")
         
@@ -1112,8 +2665,9 @@ def workhub_ee_internal():
         st.markdown("---")
         st.markdown("##### 📋 My EE Internal Requests")
         my_requests = execute_df("""
-            SELECT te.id, te.entry_date as "Start Date", te.task_type as "Type",
-                   te.entry_category as "Category", te.hours as "Hours/Day",
+            SELECT te.id, lower(te.entry_period) as "Start Date", upper(te.entry_period) - 1 as "End Date",
+                   te.task_type as "Type", te.entry_category as "Category",
+                   te.hours / COALESCE(NULLIF(te.working_days, 0), NULLIF(upper(te.entry_period) - lower(te.entry_period), 0)) as "Hours/Day",
                    te.status as "Status", te.description as "Description",
                    te.review_comment as "Manager Comment"
             FROM time_entries te
@@ -1129,70 +2683,63 @@ def workhub_ee_internal():
         st.markdown("---")
         st.info("👆 Select a category above to submit an EE Internal request.")
 
-def save_ee_internal_entry(employee_id, start_date, end_date, hours, minutes, description, task_type, status, entry_category):
-    """Save EE Internal entry with date range support"""
-    conn = get_connection()
-    try:
-        with conn.cursor() as c:
-            local_time = get_local_time_naive()
-            submitted_at = local_time if status == 'submitted' else None
-            
-            # Store the date range info in description
-            date_range_info = f"[{start_date} to {end_date}] "
-            full_description = date_range_info + (description or "")
-            
-            # Calculate total days
-            total_days = (end_date - start_date).days + 1
-            total_hours = hours * total_days + (minutes/60) * total_days
-            
-            c.execute("""INSERT INTO time_entries 
-                        (employee_id, project_id, entry_date, hours, minutes, description, task_type, 
-                         is_billable, status, submitted_at, created_at, updated_at, entry_type, entry_category)
-                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
-                      (employee_id, None, start_date, total_hours, 0, full_description, task_type, 
-                       False, status, submitted_at, local_time, local_time, 'ee_internal', entry_category))
-            entry_id = c.fetchone()[0]
-            conn.commit()
-            log_audit(employee_id, f"EE_INTERNAL_{status.upper()}", "time_entry", entry_id, f"{entry_category}: {task_type}")
-    finally:
-        release_connection(conn)
-
-def save_time_entry(employee_id, project_id, entry_date, hours, minutes, description, task_type, is_billable, status, entry_type, entry_category):
-    conn = get_connection()
-    try:
-        with conn.cursor() as c:
-            local_time = get_local_time_naive()
-            submitted_at = local_time if status == 'submitted' else None
-            c.execute("""INSERT INTO time_entries (employee_id, project_id, entry_date, hours, minutes, description, task_type, is_billable, status, submitted_at, created_at, updated_at, entry_type, entry_category)
-                         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
-                      (employee_id, project_id, entry_date, hours, minutes, description, task_type, is_billable, status, submitted_at, local_time, local_time, entry_type, entry_category))
-            entry_id = c.fetchone()[0]
-            conn.commit()
-            log_audit(employee_id, f"TIME_ENTRY_{status.upper()}", "time_entry", entry_id)
-    finally:
-        release_connection(conn)
+def save_ee_internal_entry(employee_id, start_date, end_date, hours, minutes, description, task_type, status, entry_category, idempotency_key=None):
+    """Save EE Internal entry with date range support; returns the new id, or None if the key was already used"""
+    # Charge working days only, unless the whole range is non-working
+    total_days = (end_date - start_date).days + 1
+    working_days = count_working_days(start_date, end_date)
+    charged_days = working_days or total_days
+    total_hours = hours * charged_days + (minutes/60) * charged_days
+    
+    def write(c):
+        local_time = get_local_time_naive()
+        submitted_at = local_time if status == 'submitted' else None
+        c.execute("""INSERT INTO time_entries 
+                    (employee_id, project_id, entry_date, entry_period, working_days, hours, minutes, description, task_type, 
+                     is_billable, status, submitted_at, created_at, updated_at, entry_type, entry_category, idempotency_key)
+                     VALUES (%s, %s, %s, daterange(%s, %s, '[]'), %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                     ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING RETURNING id""",
+                  (employee_id, None, start_date, start_date, end_date, working_days, total_hours, 0, description, task_type, 
+                   False, status, submitted_at, local_time, local_time, 'ee_internal', entry_category, idempotency_key))
+        row = c.fetchone()
+        if row is None:
+            return None
+        record_status_event(c, row[0], None, status, employee_id)
+        refresh_daily_totals(c, entry_day_keys(c, [row[0]]))
+        return row[0]
+    
+    entry_id = run_idempotent_write(write)
+    if entry_id:
+        log_audit(employee_id, f"EE_INTERNAL_{status.upper()}", "time_entry", entry_id, f"{entry_category}: {task_type}")
+        get_team_availability.clear()
+    return entry_id
+
+def save_time_entry(employee_id, project_id, entry_date, hours, minutes, description, task_type, is_billable, status, entry_type, entry_category, idempotency_key=None):
+    """Insert a time entry; returns the new id, or None if the idempotency key was already used"""
+    def write(c):
+        local_time = get_local_time_naive()
+        submitted_at = local_time if status == 'submitted' else None
+        c.execute("""INSERT INTO time_entries (employee_id, project_id, entry_date, hours, minutes, description, task_type, is_billable, status, submitted_at, created_at, updated_at, entry_type, entry_category, idempotency_key)
+                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                     ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING RETURNING id""",
+                  (employee_id, project_id, entry_date, hours, minutes, description, task_type, is_billable, status, submitted_at, local_time, local_time, entry_type, entry_category, idempotency_key))
+        row = c.fetchone()
+        if row is None:
+            return None
+        record_status_event(c, row[0], None, status, employee_id)
+        refresh_daily_totals(c, [(employee_id, entry_date)])
+        return row[0]
+    
+    entry_id = run_idempotent_write(write)
+    if entry_id:
+        log_audit(employee_id, f"TIME_ENTRY_{status.upper()}", "time_entry", entry_id)
+    return entry_id
 
 def show_entries_table(employee_id, date=None):
-    query = """
-        SELECT te.id, 
-               COALESCE(c.name, 'EE Internal') as "Client", 
-               COALESCE(p.name, te.entry_category) as "Project/Category", 
-               te.entry_date as "Date",
-               te.hours as "Hours", te.minutes as "Mins", te.task_type as "Task",
-               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
-               te.status as "Status"
-        FROM time_entries te
-        LEFT JOIN projects p ON te.project_id = p.id
-        LEFT JOIN clients c ON p.client_id = c.id
-        WHERE te.employee_id = %s
-    """
-    params = [employee_id]
     if date:
-        query += " AND te.entry_date = %s"
-        params.append(date)
-    query += " ORDER BY te.entry_date DESC, te.created_at DESC LIMIT 20"
-    
-    df = execute_df(query, tuple(params))
+        df = execute_df('day_entries', (employee_id, date))
+    else:
+        df = execute_df('recent_entries', (employee_id,))
     
     if not df.empty:
         st.dataframe(df, use_container_width=True, hide_index=True)
@@ -1205,16 +2752,9 @@ def workhub_analytics():
     st.subheader("📊 My Dashboard")
     
     today = datetime.date.today()
-    week_start = today - timedelta(days=today.weekday())
+    week_start = get_week_start(today)
     
-    summary = execute_df("""
-        SELECT 
-            COALESCE(SUM(hours + minutes/60.0), 0) as total_hours,
-            COALESCE(SUM(CASE WHEN is_billable THEN hours + minutes/60.0 ELSE 0 END), 0) as billable_hours,
-            COUNT(*) as entry_count
-        FROM time_entries
-        WHERE employee_id = %s AND entry_date >= %s AND status != 'draft'
-    """, (user['id'], week_start))
+    summary = execute_df('week_summary', (user['id'], week_start))
     
     col1, col2, col3, col4 = st.columns(4)
     total_h = float(summary['total_hours'].iloc[0] or 0)
@@ -1231,14 +2771,7 @@ def workhub_analytics():
     
     with col1:
         st.markdown("##### Billable vs Non-Billable (30 Days)")
-        pie_data = execute_df("""
-            SELECT 
-                CASE WHEN is_billable THEN 'Billable' ELSE 'Non-Billable' END as "Type",
-                SUM(hours + minutes/60.0) as "Hours"
-            FROM time_entries
-            WHERE employee_id = %s AND entry_date >= CURRENT_DATE - INTERVAL '30 days' AND status != 'draft'
-            GROUP BY is_billable
-        """, (user['id'],))
+        pie_data = execute_df('billable_split', (user['id'],))
         
         if not pie_data.empty:
             fig = px.pie(pie_data, values='Hours', names='Type', 
@@ -1250,12 +2783,7 @@ def workhub_analytics():
     
     with col2:
         st.markdown("##### Daily Hours (14 Days)")
-        daily_data = execute_df("""
-            SELECT entry_date as "Date", SUM(hours + minutes/60.0) as "Hours"
-            FROM time_entries
-            WHERE employee_id = %s AND entry_date >= CURRENT_DATE - INTERVAL '14 days' AND status != 'draft'
-            GROUP BY entry_date ORDER BY entry_date
-        """, (user['id'],))
+        daily_data = execute_df('daily_hours', (user['id'],))
         
         if not daily_data.empty:
             fig = px.bar(daily_data, x='Date', y='Hours', color_discrete_sequence=['#636EFA'])
@@ -1284,7 +2812,7 @@ def workhub_recalls():
     recallable = execute_df("""
         SELECT te.id, 
                COALESCE(c.name, 'EE Internal') as "Client", 
-               COALESCE(p.name, te.entry_category) as "Project", 
+               COALESCE(p.name, te.entry_category::text) as "Project", 
                te.entry_date as "Date",
                te.hours as "Hours", te.status as "Status", te.submitted_at
         FROM time_entries te
@@ -1315,9 +2843,12 @@ def workhub_recalls():
                     try:
                         with conn.cursor() as c:
                             c.execute("UPDATE time_entries SET status='recalled', updated_at=%s WHERE id=%s", (get_local_time(), row['id']))
+                            record_status_event(c, row['id'], 'submitted', 'recalled', user['id'])
+                            refresh_daily_totals(c, entry_day_keys(c, [row['id']]))
                             conn.commit()
                     finally:
                         release_connection(conn)
+                    get_team_availability.clear()
                     log_audit(user['id'], "RECALL_ENTRY", "time_entry", row['id'])
                     st.success("✅ Entry recalled!")
                     st.rerun()
@@ -1329,7 +2860,7 @@ def workhub_recalls():
     st.markdown("##### 📜 My Recall History")
     history = execute_df("""
         SELECT te.entry_date as "Date", 
-               COALESCE(p.name, te.entry_category) as "Project",
+               COALESCE(p.name, te.entry_category::text) as "Project",
                te.hours as "Hours",
                te.status as "Current Status",
                te.updated_at as "Last Updated"
@@ -1348,51 +2879,73 @@ def workhub_history():
     user = st.session_state.user
     st.subheader("📋 My Time Entry History")
     
-    col1, col2, col3 = st.columns([1, 1, 1])
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 2])
     with col1:
         start_date = st.date_input("From", datetime.date.today() - timedelta(days=30), key="hist_start")
     with col2:
         end_date = st.date_input("To", datetime.date.today(), key="hist_end")
     with col3:
-        status_filter = st.selectbox("Status", ["All", "draft", "submitted", "approved", "rejected", "recalled"], key="hist_status")
+        status_filter = st.selectbox("Status", ["All"] + ENTRY_STATUSES, key="hist_status")
+    with col4:
+        search = st.text_input("Search Descriptions", placeholder='e.g. "client workshop" -travel', key="hist_search").strip()
     
-    query = """
-        SELECT te.entry_date as "Date", 
-               COALESCE(c.name, 'EE Internal') as "Client", 
-               COALESCE(p.name, te.entry_category) as "Project",
-               te.hours as "Hours", te.minutes as "Mins", te.task_type as "Task",
-               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
-               te.status as "Status", te.review_comment as "Comment"
-        FROM time_entries te
-        LEFT JOIN projects p ON te.project_id = p.id
-        LEFT JOIN clients c ON p.client_id = c.id
-        WHERE te.employee_id = %s AND te.entry_date BETWEEN %s AND %s
-    """
+    where = "WHERE te.employee_id = %s AND te.entry_date BETWEEN %s AND %s"
     params = [user['id'], start_date, end_date]
     
     if status_filter != "All":
-        query += " AND te.status = %s"
+        where += " AND te.status = %s"
         params.append(status_filter)
     
-    query += " ORDER BY te.entry_date DESC"
-    
-    df = execute_df(query, tuple(params))
+    order = "te.entry_date DESC, te.id DESC"
+    rank_params = []
+    if search:
+        match, rank, search_params = search_clause('te', search)
+        where += f" AND {match}"
+        params += search_params
+        order = f"{rank} DESC, {order}"
+        rank_params = search_params
+    
+    # Totals cover every match; only the visible page of rows is fetched. Unsearched views use the catalogue.
+    history_params = (user['id'], start_date, end_date, None if status_filter == "All" else status_filter)
+    if search:
+        totals = execute_query(f"""
+            SELECT COUNT(*) as entries, COALESCE(SUM(te.hours + te.minutes / 60.0), 0) as hours,
+                   COALESCE(SUM(te.hours + te.minutes / 60.0) FILTER (WHERE te.status = 'approved'), 0) as approved
+            FROM time_entries te {where}
+        """, tuple(params))[0]
+    else:
+        totals = execute_query('history_totals', history_params)[0]
     
-    if not df.empty:
-        # Summary stats
-        total_hours = df['Hours'].sum() + df['Mins'].sum() / 60
-        approved_df = df[df['Status'] == 'approved']
-        approved_hours = approved_df['Hours'].sum() + approved_df['Mins'].sum() / 60 if not approved_df.empty else 0
-        
+    if totals['entries']:
         col1, col2, col3 = st.columns(3)
-        col1.metric("Total Entries", len(df))
-        col2.metric("Total Hours", f"{total_hours:.1f}")
-        col3.metric("Approved Hours", f"{approved_hours:.1f}")
+        col1.metric("Total Entries", totals['entries'])
+        col2.metric("Total Hours", f"{totals['hours']:.1f}")
+        col3.metric("Approved Hours", f"{totals['approved']:.1f}")
         
+        offset = page_selector(totals['entries'], "hist_page")
+        select = f"""
+            SELECT te.entry_date as "Date", 
+                   COALESCE(c.name, 'EE Internal') as "Client", 
+                   COALESCE(p.name, te.entry_category::text) as "Project",
+                   te.hours as "Hours", te.minutes as "Mins", te.task_type as "Task",
+                   te.description as "Description",
+                   CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
+                   te.status as "Status", te.review_comment as "Comment"
+            FROM time_entries te
+            LEFT JOIN projects p ON te.project_id = p.id
+            LEFT JOIN clients c ON p.client_id = c.id
+            {where}
+            ORDER BY {order}
+        """
+        if search:
+            df = execute_df(select + " LIMIT %s OFFSET %s", tuple(params + rank_params + [SEARCH_PAGE_SIZE, offset]))
+        else:
+            df = execute_df('history_page', history_params + (SEARCH_PAGE_SIZE, offset))
         st.dataframe(df, use_container_width=True, hide_index=True)
         
-        csv = df.to_csv(index=False)
-        st.download_button("📥 Download CSV", csv, "my_timesheet.csv", "text/csv")
+        if st.button("📥 Prepare CSV of All Matches", key="hist_export"):
+            csv = execute_df(select, tuple(params + rank_params), query_class='export').to_csv(index=False)
+            st.download_button("📥 Download CSV", csv, "my_timesheet.csv", "text/csv")
     else:
         st.info("📭 No entries found for selected period")
 
@@ -1402,7 +2955,7 @@ def manage360_dashboard():
     st.title("🧮 Manage360 - Manager Portal")
     st.markdown(f"Welcome, **{user['full_name']}**")
     
-    tabs = st.tabs(["📋 Review Queue", "✅ Approvals", "👥 Team Overview", "📊 Analytics", "📁 Projects"])
+    tabs = st.tabs(["📋 Review Queue", "✅ Approvals", "👥 Team Overview", "📅 Availability", "📈 Capacity", "📊 Analytics", "📁 Projects"])
     
     with tabs[0]:
         manage360_review_queue()
@@ -1411,8 +2964,12 @@ def manage360_dashboard():
     with tabs[2]:
         manage360_team()
     with tabs[3]:
-        manage360_analytics()
+        manage360_availability()
     with tabs[4]:
+        manage360_capacity()
+    with tabs[5]:
+        render_guarded(manage360_analytics)
+    with tabs[6]:
         manage360_projects()
 
 def manage360_review_queue():
@@ -1434,30 +2991,58 @@ def manage360_review_queue():
 
 def show_all_pending_reviews(user):
     """Show all pending reviews"""
-    pending = execute_df("""
-        SELECT te.id, u.full_name as "Employee", 
-               COALESCE(c.name, 'EE Internal') as "Client", 
-               COALESCE(p.name, te.entry_category) as "Project/Category",
-               te.entry_date as "Date", te.hours as "Hours", te.minutes as "Mins",
-               te.task_type as "Type", te.description as "Description",
-               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
-               te.submitted_at as "Submitted",
-               te.entry_type as "Entry_Type",
-               te.entry_category as "Category"
-        FROM time_entries te
-        JOIN users u ON te.employee_id = u.id
-        LEFT JOIN projects p ON te.project_id = p.id
-        LEFT JOIN clients c ON p.client_id = c.id
-        WHERE te.status = 'submitted' 
-        AND (p.manager_id = %s OR %s IN (SELECT id FROM users WHERE role IN ('manager', 'admin')))
-        ORDER BY te.submitted_at ASC
-    """, (user['id'], user['id']))
+    search = st.text_input("🔍 Search Descriptions", placeholder="e.g. onboarding OR migration", key="review_search").strip()
+    
+    where = """WHERE te.status = 'submitted' 
+        AND (p.manager_id = %s OR %s IN (SELECT id FROM users WHERE role IN ('manager', 'admin')))"""
+    params = [user['id'], user['id']]
+    order = "te.submitted_at ASC, te.id"
+    rank_params = []
+    if search:
+        match, rank, search_params = search_clause('te', search)
+        where += f" AND {match}"
+        params += search_params
+        order = f"{rank} DESC, {order}"
+        rank_params = search_params
+    
+    if search:
+        total = execute_query(f"""
+            SELECT COUNT(*) as n FROM time_entries te LEFT JOIN projects p ON te.project_id = p.id {where}
+        """, tuple(params))[0]['n']
+    else:
+        total = execute_query('pending_review_count', (user['id'],))[0]['n']
     
-    if pending.empty:
-        st.success("🎉 No pending reviews! All caught up.")
+    if not total:
+        if search:
+            st.info("🔍 No pending entries match your search")
+        else:
+            st.success("🎉 No pending reviews! All caught up.")
         return
     
-    st.info(f"📬 **{len(pending)}** total entries awaiting review")
+    st.info(f"📬 **{total}** {'matching' if search else 'total'} entries awaiting review")
+    offset = page_selector(total, "review_page")
+    
+    if search:
+        pending = execute_df(f"""
+            SELECT te.id, u.full_name as "Employee", 
+                   COALESCE(c.name, 'EE Internal') as "Client", 
+                   COALESCE(p.name, te.entry_category::text) as "Project/Category",
+                   te.entry_date as "Date", te.hours as "Hours", te.minutes as "Mins",
+                   te.task_type as "Type", te.description as "Description",
+                   CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
+                   te.submitted_at as "Submitted",
+                   te.entry_type as "Entry_Type",
+                   te.entry_category as "Category"
+            FROM time_entries te
+            JOIN users u ON te.employee_id = u.id
+            LEFT JOIN projects p ON te.project_id = p.id
+            LEFT JOIN clients c ON p.client_id = c.id
+            {where}
+            ORDER BY {order}
+            LIMIT %s OFFSET %s
+        """, tuple(params + rank_params + [SEARCH_PAGE_SIZE, offset]))
+    else:
+        pending = execute_df('pending_review_page', (user['id'], SEARCH_PAGE_SIZE, offset))
     
     for _, row in pending.iterrows():
         entry_type_icon = "🏢" if row['Entry_Type'] == 'ee_internal' else "📁"
@@ -1494,17 +3079,7 @@ def show_ee_internal_reviews(user):
     st.markdown("### 🏢 EE Internal Requests")
     st.markdown("Review and approve/deny Leave, Training, and Other Absence requests.")
     
-    pending = execute_df("""
-        SELECT te.id, u.full_name as "Employee", u.department as "Department",
-               te.entry_category as "Category", te.task_type as "Request Type",
-               te.entry_date as "Start Date", te.hours as "Total Hours",
-               te.description as "Description/Reason",
-               te.submitted_at as "Submitted"
-        FROM time_entries te
-        JOIN users u ON te.employee_id = u.id
-        WHERE te.status = 'submitted' AND te.entry_type = 'ee_internal'
-        ORDER BY te.submitted_at ASC
-    """)
+    pending = execute_df('pending_ee_internal')
     
     if pending.empty:
         st.success("🎉 No pending EE Internal requests!")
@@ -1544,9 +3119,15 @@ def show_ee_internal_reviews(user):
                 st.write(f"**📝 Type:** {row['Request Type']}")
             
             with col2:
-                st.write(f"**📅 Start Date:** {row['Start Date']}")
+                st.write(f"**📅 Dates:** {row['Start Date']} → {row['End Date']} ({row['Days']} day(s))")
                 st.write(f"**⏱️ Total Hours:** {row['Total Hours']:.1f} hours")
                 st.write(f"**📤 Submitted:** {row['Submitted']}")
+                if row['Category'] == 'Leave':
+                    balance = float(row['Balance']) if pd.notna(row['Balance']) else 0.0
+                    st.write(f"**🧾 {row['Request Type']} Balance:** {balance:.1f}h → {balance - row['Total Hours']:.1f}h after approval")
+            
+            if row['Conflicts']:
+                st.warning(f"⚠️ **Overlaps in {row['Department'] or 'department'}:** {row['Conflicts']}")
             
             st.markdown("**📝 Description/Reason:**")
             st.info(row['Description/Reason'] or 'No description provided')
@@ -1575,21 +3156,7 @@ def show_project_time_reviews(user):
     """Show only project time entries"""
     st.markdown("### 📁 Project Time Entries")
     
-    pending = execute_df("""
-        SELECT te.id, u.full_name as "Employee", 
-               c.name as "Client", p.name as "Project",
-               te.entry_date as "Date", te.hours as "Hours", te.minutes as "Mins",
-               te.task_type as "Task", te.description as "Description",
-               CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
-               te.submitted_at as "Submitted"
-        FROM time_entries te
-        JOIN users u ON te.employee_id = u.id
-        JOIN projects p ON te.project_id = p.id
-        JOIN clients c ON p.client_id = c.id
-        WHERE te.status = 'submitted' AND te.entry_type = 'project_work'
-        AND (p.manager_id = %s OR %s IN (SELECT id FROM users WHERE role IN ('manager', 'admin')))
-        ORDER BY te.submitted_at ASC
-    """, (user['id'], user['id']))
+    pending = execute_df('pending_project_time', (user['id'],))
     
     if pending.empty:
         st.success("🎉 No pending project time entries!")
@@ -1619,16 +3186,94 @@ def show_project_time_reviews(user):
                 st.warning("❌ Rejected")
                 st.rerun()
 
+def get_out_of_office(on_date):
+    """Approved or pending EE Internal entries whose date range covers on_date"""
+    return execute_df("""
+        SELECT u.full_name as "Employee", u.department as "Department",
+               te.entry_category as "Category", te.task_type as "Type",
+               lower(te.entry_period) as "From", upper(te.entry_period) - 1 as "To",
+               te.status as "Status"
+        FROM time_entries te
+        JOIN users u ON te.employee_id = u.id
+        WHERE te.entry_type = 'ee_internal' AND te.status IN ('approved', 'submitted')
+        AND te.entry_period @> %s::date
+        ORDER BY u.full_name
+    """, (on_date,))
+
+@st.cache_data(ttl=300)
+def get_team_availability(start, end, department=None):
+    """Per-day, per-department count of people on approved or pending EE Internal time"""
+    query = """
+        SELECT ted.work_date as "Date", COALESCE(u.department, 'Unassigned') as "Department",
+               COUNT(DISTINCT ted.employee_id) FILTER (WHERE ted.status = 'approved') as "Out",
+               COUNT(DISTINCT ted.employee_id) FILTER (WHERE ted.status = 'submitted') as "Pending",
+               string_agg(DISTINCT u.full_name, ', ') as "Who"
+        FROM time_entry_days ted
+        JOIN users u ON ted.employee_id = u.id
+        WHERE ted.entry_type = 'ee_internal' AND ted.status IN ('approved', 'submitted')
+        AND ted.entry_period && daterange(%s, %s, '[]') AND ted.work_date BETWEEN %s AND %s
+    """
+    params = [start, end, start, end]
+    if department:
+        query += " AND u.department = %s"
+        params.append(department)
+    query += " GROUP BY ted.work_date, u.department ORDER BY 1, 2"
+    return execute_df(query, tuple(params))
+
+def post_leave_ledger(c, employee_id, leave_type, kind, hours, time_entry_id=None, note=None, created_by=None):
+    """Apply a signed hours posting to leave_balances and record it in leave_ledger.
+    Takes an open cursor so the posting commits with the caller's change."""
+    local_time = get_local_time_naive()
+    c.execute("""INSERT INTO leave_balances (employee_id, leave_type, balance_hours, updated_at)
+                 VALUES (%s, %s, %s, %s)
+                 ON CONFLICT (employee_id, leave_type) DO UPDATE
+                 SET balance_hours = leave_balances.balance_hours + EXCLUDED.balance_hours, updated_at = EXCLUDED.updated_at
+                 RETURNING balance_hours""", (employee_id, leave_type, hours, local_time))
+    balance = c.fetchone()[0]
+    c.execute("""INSERT INTO leave_ledger (employee_id, leave_type, kind, hours, balance_after, time_entry_id, note, created_by, created_at)
+                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+              (employee_id, leave_type, kind, hours, balance, time_entry_id, note, created_by, local_time))
+    return balance
+
+def get_leave_balances(employee_id):
+    return execute_df("""
+        SELECT leave_type as "Leave Type", balance_hours as "Balance (hrs)", updated_at as "Updated"
+        FROM leave_balances WHERE employee_id = %s ORDER BY leave_type
+    """, (employee_id,))
+
 def update_entry_status(entry_id, status, reviewer_id, comment=None):
     conn = get_connection()
     try:
         with conn.cursor() as c:
             local_time = get_local_time()
+            c.execute("""SELECT status, entry_type, entry_category, task_type, employee_id, hours + minutes / 60.0,
+                                project_id, entry_date
+                         FROM time_entries WHERE id=%s FOR UPDATE""", (entry_id,))
+            previous = c.fetchone()
             c.execute("""UPDATE time_entries SET status=%s, reviewed_by=%s, reviewed_at=%s, review_comment=%s, updated_at=%s
                          WHERE id=%s""", (status, reviewer_id, local_time, comment, local_time, entry_id))
+            record_status_event(c, entry_id, previous[0] if previous else None, status, reviewer_id, comment)
+            
+            # Keep leave balances in step with approvals
+            if previous and previous[1] == 'ee_internal' and previous[2] == 'Leave' and previous[3]:
+                old_status, _, _, leave_type, employee_id, leave_hours = previous[:6]
+                if status == 'approved' and old_status != 'approved':
+                    post_leave_ledger(c, employee_id, leave_type, 'usage', -leave_hours, entry_id, comment, reviewer_id)
+                elif old_status == 'approved' and status != 'approved':
+                    post_leave_ledger(c, employee_id, leave_type, 'reversal', leave_hours, entry_id, comment, reviewer_id)
+            
+            # Keep project budget burn in step with approvals
+            if previous and previous[6]:
+                old_status, entry_hours, project_id, entry_date = previous[0], previous[5], previous[6], previous[7]
+                if status == 'approved' and old_status != 'approved':
+                    apply_project_hours(c, project_id, entry_date, entry_hours)
+                elif old_status == 'approved' and status != 'approved':
+                    apply_project_hours(c, project_id, entry_date, -entry_hours)
+            refresh_daily_totals(c, entry_day_keys(c, [entry_id]))
             conn.commit()
     finally:
         release_connection(conn)
+    get_team_availability.clear()
     log_audit(reviewer_id, f"ENTRY_{status.upper()}", "time_entry", entry_id, comment)
 
 def manage360_approvals():
@@ -1644,7 +3289,7 @@ def manage360_approvals():
     
     query = """
         SELECT te.id, u.full_name as "Employee", 
-               COALESCE(p.name, te.entry_category) as "Project", 
+               COALESCE(p.name, te.entry_category::text) as "Project", 
                te.entry_date as "Date",
                te.hours as "Hours", te.status as "Status", r.full_name as "Reviewer",
                te.reviewed_at as "Reviewed", te.review_comment as "Comment"
@@ -1660,47 +3305,278 @@ def manage360_approvals():
         query += " AND te.status = %s"
         params.append(status_filter)
     
-    query += " ORDER BY te.reviewed_at DESC LIMIT 100"
+    df = data_grid("approvals_grid", query, params, sort_columns=("Date", "Employee", "Hours"),
+                   filter_columns=("Employee", "Project", "Reviewer", "Comment"))
     
-    df = execute_df(query, tuple(params))
-    
-    if not df.empty:
-        st.dataframe(df, use_container_width=True, hide_index=True)
-    else:
+    if df.empty:
         st.info("📭 No approval history found")
 
 def manage360_team():
     st.subheader("👥 Team Overview")
     
-    team = execute_df("""
-        SELECT u.id, u.full_name as "Name", u.email as "Email", u.department as "Department",
-               COUNT(DISTINCT pa.project_id) as "Projects",
-               COALESCE(SUM(CASE WHEN te.entry_date >= CURRENT_DATE - INTERVAL '7 days' THEN te.hours ELSE 0 END), 0) as "Week_Hours"
-        FROM users u
-        LEFT JOIN project_assignments pa ON u.id = pa.employee_id
-        LEFT JOIN time_entries te ON u.id = te.employee_id AND te.status != 'draft'
-        WHERE u.role = 'employee' AND u.is_active = TRUE
-        GROUP BY u.id, u.full_name, u.email, u.department
-        ORDER BY u.full_name
-    """)
+    team = execute_df('team_overview')
     
     if not team.empty:
         st.dataframe(team, use_container_width=True, hide_index=True)
         
+        out_today = get_out_of_office(datetime.date.today())
+        if not out_today.empty:
+            st.info(f"🏖️ **Out Today** ({len(out_today)})")
+            st.dataframe(out_today, use_container_width=True, hide_index=True)
+        
         overtime_threshold = float(get_setting('overtime_threshold') or 9)
-        overtime = execute_df(f"""
-            SELECT u.full_name as "Employee", te.entry_date as "Date", 
-                   SUM(te.hours + te.minutes/60.0) as "Total_Hours"
-            FROM time_entries te
-            JOIN users u ON te.employee_id = u.id
-            WHERE te.entry_date >= CURRENT_DATE - INTERVAL '7 days' AND te.status != 'draft'
-            GROUP BY u.full_name, te.entry_date
-            HAVING SUM(te.hours + te.minutes/60.0) > {overtime_threshold}
+        overtime = execute_df("""
+            SELECT u.full_name as "Employee", dt.work_date as "Date", dt.hours as "Total_Hours"
+            FROM daily_totals dt
+            JOIN users u ON dt.employee_id = u.id
+            WHERE dt.is_overtime AND dt.work_date >= CURRENT_DATE - INTERVAL '7 days'
+            ORDER BY dt.work_date DESC, u.full_name
         """)
         
         if not overtime.empty:
             st.warning(f"⚠️ **Overtime Alerts** (>{overtime_threshold}h/day)")
             st.dataframe(overtime, use_container_width=True, hide_index=True)
+        
+        with st.expander("📭 Missing Timesheets"):
+            col1, col2 = st.columns(2)
+            with col1:
+                gap_start = st.date_input("From", get_week_start(datetime.date.today()) - timedelta(days=7), key="gap_start")
+            with col2:
+                gap_end = st.date_input("To", datetime.date.today() - timedelta(days=1), key="gap_end")
+            
+            gaps = find_missing_timesheets(gap_start, gap_end)
+            if gaps.empty:
+                st.success("🎉 No missing timesheets in this period")
+            else:
+                per_employee = gaps.groupby('Employee', as_index=False).agg(Days=('Date', 'count'), Hours_Logged=('Hours_Logged', 'sum'))
+                st.dataframe(per_employee, use_container_width=True, hide_index=True)
+                if st.button("📨 Send Reminder Digests"):
+                    gap_count, sent = send_missing_timesheet_digests(gap_start, gap_end)
+                    log_audit(st.session_state.user['id'], "SEND_REMINDERS", "system", None, f"{gap_count} gaps, {sent} messages")
+                    st.success(f"✅ Sent {sent} digest(s) covering {gap_count} missing day(s)")
+        
+        with st.expander("📈 Overtime History"):
+            col1, col2 = st.columns(2)
+            with col1:
+                ot_start = st.date_input("From", datetime.date.today() - timedelta(days=90), key="ot_start")
+            with col2:
+                ot_end = st.date_input("To", datetime.date.today(), key="ot_end")
+            
+            history = execute_df("""
+                SELECT u.full_name as "Employee", COUNT(*) as "Overtime_Days",
+                       SUM(dt.hours - %s) as "Overtime_Hours", MAX(dt.hours) as "Peak_Day_Hours",
+                       MAX(dt.work_date) as "Last_Overtime"
+                FROM daily_totals dt
+                JOIN users u ON dt.employee_id = u.id
+                WHERE dt.is_overtime AND dt.work_date BETWEEN %s AND %s
+                GROUP BY u.id, u.full_name
+                ORDER BY "Overtime_Hours" DESC
+            """, (overtime_threshold, ot_start, ot_end))
+            
+            if not history.empty:
+                st.dataframe(history, use_container_width=True, hide_index=True)
+                weekly = execute_df("""
+                    SELECT date_trunc('week', dt.work_date)::date as "Week", COUNT(*) as "Overtime_Days"
+                    FROM daily_totals dt
+                    WHERE dt.is_overtime AND dt.work_date BETWEEN %s AND %s
+                    GROUP BY 1 ORDER BY 1
+                """, (ot_start, ot_end))
+                fig = px.bar(weekly, x='Week', y='Overtime_Days', color_discrete_sequence=['#EF553B'])
+                fig.update_layout(margin=dict(t=20, b=20, l=20, r=20))
+                st.plotly_chart(fig, use_container_width=True)
+            else:
+                st.info("No overtime recorded in this period")
+
+def manage360_availability():
+    st.subheader("📅 Team Availability")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        month = st.date_input("Month", datetime.date.today(), key="avail_month")
+    with col2:
+        departments = execute_df("SELECT DISTINCT department FROM users WHERE department IS NOT NULL AND is_active = TRUE ORDER BY department")
+        department = st.selectbox("Department", ["All"] + departments['department'].tolist(), key="avail_dept")
+    
+    month_start = month.replace(day=1)
+    month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    
+    availability = get_team_availability(month_start, month_end, None if department == "All" else department)
+    
+    if availability.empty:
+        st.success("🎉 Everyone is available this month")
+        return
+    
+    grid = availability.assign(Total=availability['Out'] + availability['Pending']).pivot_table(
+        index='Department', columns='Date', values='Total', aggfunc='sum', fill_value=0
+    )
+    grid = grid.reindex(columns=pd.date_range(month_start, month_end).date, fill_value=0)
+    
+    fig = go.Figure(go.Heatmap(
+        z=grid.values, x=[d.strftime('%d %a') for d in grid.columns], y=grid.index.tolist(),
+        colorscale='YlOrRd', hovertemplate="%{y} · %{x}: %{z} out<extra></extra>"
+    ))
+    fig.update_layout(margin=dict(t=20, b=20, l=20, r=20), height=120 + 40 * len(grid.index))
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.caption("Counts include approved and pending EE Internal requests.")
+    st.dataframe(availability, use_container_width=True, hide_index=True)
+
+@st.cache_data(ttl=6 * 3600)
+def build_capacity_forecast(week_start, weeks_back=8, weeks_ahead=4):
+    """Planned vs actual hours per assignment and week around week_start.
+    
+    Keyed on the current week so the matrices are rebuilt once per week (or when
+    allocations change). Returns (assignments, capacity, planned, actual) where planned
+    and actual are assignment x week frames sharing the same index and columns.
+    """
+    day_hours = float(get_setting('standard_day_hours') or 8)
+    horizon_start = week_start - timedelta(weeks=weeks_back)
+    horizon_end = week_start + timedelta(weeks=weeks_ahead + 1) - timedelta(days=1)
+    
+    weeks = execute_df("""
+        SELECT week_start, COUNT(*) FILTER (WHERE is_working_day) AS working_days
+        FROM work_calendar WHERE cal_date BETWEEN %s AND %s
+        GROUP BY week_start ORDER BY week_start
+    """, (horizon_start, horizon_end), query_class='report')
+    assignments = execute_df("""
+        SELECT pa.employee_id, u.full_name as employee, pa.project_id, p.name as project,
+               COALESCE(pa.allocation_pct, 0) as allocation_pct
+        FROM project_assignments pa
+        JOIN users u ON pa.employee_id = u.id
+        JOIN projects p ON pa.project_id = p.id
+        WHERE u.is_active = TRUE AND p.status = 'active'
+        ORDER BY u.full_name, p.name
+    """, query_class='report')
+    actual_rows = execute_df("""
+        SELECT te.employee_id, te.project_id, wc.week_start, SUM(te.hours + te.minutes / 60.0) as hours
+        FROM time_entries te
+        JOIN work_calendar wc ON wc.cal_date = te.entry_date
+        WHERE te.entry_type = 'project_work' AND te.status IN ('submitted', 'approved')
+        AND te.entry_date BETWEEN %s AND %s
+        GROUP BY te.employee_id, te.project_id, wc.week_start
+    """, (horizon_start, horizon_end), query_class='report')
+    
+    capacity = weeks.set_index('week_start')['working_days'].astype(float) * day_hours
+    index = pd.MultiIndex.from_frame(assignments[['employee_id', 'project_id']])
+    planned = pd.DataFrame((assignments['allocation_pct'].to_numpy()[:, None] / 100.0) * capacity.to_numpy()[None, :],
+                           index=index, columns=capacity.index)
+    if actual_rows.empty:
+        actual = planned * 0
+    else:
+        actual = (actual_rows.pivot_table(index=['employee_id', 'project_id'], columns='week_start',
+                                          values='hours', aggfunc='sum')
+                  .reindex(index=index, columns=capacity.index).fillna(0))
+    return assignments, capacity, planned, actual
+
+def manage360_capacity():
+    st.subheader("📈 Capacity & Forecast")
+    
+    this_week = get_week_start(datetime.date.today())
+    assignments, capacity, planned, actual = build_capacity_forecast(this_week)
+    
+    if assignments.empty:
+        st.info("📭 No active project assignments")
+        return
+    
+    names = assignments.drop_duplicates('employee_id').set_index('employee_id')['employee']
+    past = [w for w in capacity.index if w < this_week]
+    
+    # Employee-level matrices: sum each employee's assignment rows
+    planned_emp = planned.groupby(level='employee_id').sum()
+    actual_emp = actual.groupby(level='employee_id').sum()
+    allocation = assignments.groupby('employee_id')['allocation_pct'].sum()
+    
+    summary = pd.DataFrame({
+        'Employee': names,
+        'Allocation_Pct': allocation,
+        'Planned_To_Date': planned_emp[past].sum(axis=1),
+        'Actual_To_Date': actual_emp[past].sum(axis=1),
+        'Planned_Ahead': planned_emp.drop(columns=past).sum(axis=1),
+    })
+    summary['Variance'] = summary['Actual_To_Date'] - summary['Planned_To_Date']
+    summary['Utilization_Pct'] = (actual_emp[past].sum(axis=1) / (capacity[past].sum() or float('nan')) * 100).round(1)
+    
+    over = summary[summary['Allocation_Pct'] > 100]
+    if not over.empty:
+        st.warning(f"⚠️ {len(over)} employee(s) allocated over 100%: {', '.join(over['Employee'])}")
+    
+    st.dataframe(summary.round(1), use_container_width=True, hide_index=True)
+    
+    st.markdown("##### Actual − Planned Hours by Week")
+    variance = (actual_emp - planned_emp).round(1)
+    variance[[w for w in capacity.index if w >= this_week]] = -planned_emp[[w for w in capacity.index if w >= this_week]]
+    fig = go.Figure(go.Heatmap(
+        z=variance.values, x=[w.strftime('%d %b') for w in variance.columns], y=names.reindex(variance.index).tolist(),
+        colorscale='RdBu', zmid=0, hovertemplate="%{y} · %{x}: %{z}h<extra></extra>"
+    ))
+    fig.update_layout(margin=dict(t=20, b=20, l=20, r=20), height=120 + 30 * len(variance.index))
+    st.plotly_chart(fig, use_container_width=True)
+    st.caption("Past weeks show actual minus planned hours; the current and future weeks show planned hours still to come (negative).")
+    
+    st.markdown("##### By Project")
+    projects = assignments.assign(
+        Planned_To_Date=planned[past].sum(axis=1).to_numpy(),
+        Actual_To_Date=actual[past].sum(axis=1).to_numpy(),
+        Planned_Ahead=planned.drop(columns=past).sum(axis=1).to_numpy(),
+    ).groupby('project', as_index=False)[['Planned_To_Date', 'Actual_To_Date', 'Planned_Ahead']].sum()
+    st.dataframe(projects.rename(columns={'project': 'Project'}).round(1), use_container_width=True, hide_index=True)
+
+@st.cache_data(ttl=24 * 3600)
+def get_approval_sla(as_of, days=90):
+    """Reviewer turnaround percentiles and bounce counts as of a day (cached daily)"""
+    since = as_of - timedelta(days=days)
+    reviewers = execute_df("""
+        WITH ev AS (
+            SELECT time_entry_id, to_status, changed_by, changed_at,
+                   LAG(to_status) OVER w AS prev_status, LAG(changed_at) OVER w AS prev_at
+            FROM entry_status_events
+            WHERE time_entry_id IN (SELECT time_entry_id FROM entry_status_events
+                                    WHERE changed_at >= %s AND to_status IN ('approved', 'rejected'))
+            WINDOW w AS (PARTITION BY time_entry_id ORDER BY changed_at, id)
+        )
+        SELECT r.full_name as "Reviewer", COUNT(*) as "Decisions",
+               COUNT(*) FILTER (WHERE ev.to_status = 'rejected') as "Rejected",
+               ROUND(percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM ev.changed_at - ev.prev_at) / 3600)::numeric, 1) as "P50_Hours",
+               ROUND(percentile_cont(0.9) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM ev.changed_at - ev.prev_at) / 3600)::numeric, 1) as "P90_Hours",
+               ROUND(MAX(EXTRACT(EPOCH FROM ev.changed_at - ev.prev_at) / 3600)::numeric, 1) as "Max_Hours"
+        FROM ev
+        JOIN users r ON ev.changed_by = r.id
+        WHERE ev.to_status IN ('approved', 'rejected') AND ev.prev_status = 'submitted' AND ev.changed_at >= %s
+        GROUP BY r.id, r.full_name
+        ORDER BY "P90_Hours" DESC
+    """, (since, since), query_class='report')
+    bounces = execute_df("""
+        WITH ev AS (
+            SELECT time_entry_id, to_status, LAG(to_status) OVER (PARTITION BY time_entry_id ORDER BY changed_at, id) AS prev_status
+            FROM entry_status_events WHERE changed_at >= %s
+        )
+        SELECT u.full_name as "Employee",
+               COUNT(*) FILTER (WHERE ev.to_status = 'rejected') as "Rejections",
+               COUNT(*) FILTER (WHERE ev.prev_status IN ('rejected', 'recalled') AND ev.to_status = 'submitted') as "Resubmissions",
+               COUNT(*) FILTER (WHERE ev.to_status = 'recalled') as "Recalls"
+        FROM ev
+        JOIN time_entries te ON ev.time_entry_id = te.id
+        JOIN users u ON te.employee_id = u.id
+        GROUP BY u.id, u.full_name
+        HAVING COUNT(*) FILTER (WHERE ev.to_status IN ('rejected', 'recalled')) > 0
+        ORDER BY "Rejections" DESC
+    """, (since,), query_class='report')
+    return reviewers, bounces
+
+@st.cache_data(ttl=300)
+def get_review_backlog():
+    """Submitted entries bucketed by how long they have waited; ages move, so this is cached briefly"""
+    backlog = execute_df("""
+        SELECT CASE WHEN age < INTERVAL '1 day' THEN '< 1 day'
+                    WHEN age < INTERVAL '2 days' THEN '1-2 days'
+                    WHEN age < INTERVAL '3 days' THEN '2-3 days'
+                    WHEN age < INTERVAL '7 days' THEN '3-7 days'
+                    ELSE '> 7 days' END as "Age",
+               MIN(age) as min_age, COUNT(*) as "Entries"
+        FROM (SELECT %s - submitted_at AS age FROM time_entries WHERE status = 'submitted' AND submitted_at IS NOT NULL) pending
+        GROUP BY 1 ORDER BY min_age
+    """, (get_local_time_naive(),), query_class='report')
+    return backlog.drop(columns=['min_age'])
 
 def manage360_analytics():
     st.subheader("📊 Team Analytics")
@@ -1715,7 +3591,7 @@ def manage360_analytics():
             COALESCE(SUM(CASE WHEN status='approved' THEN hours ELSE 0 END), 0) as total
         FROM time_entries
         WHERE entry_date >= CURRENT_DATE - INTERVAL '30 days'
-    """)
+    """, query_class='report')
     
     col1.metric("👥 Active Employees", int(metrics['employees'].iloc[0] or 0))
     col2.metric("📋 Pending Reviews", int(metrics['pending'].iloc[0] or 0))
@@ -1737,7 +3613,7 @@ def manage360_analytics():
             JOIN projects p ON te.project_id = p.id
             WHERE te.entry_date >= CURRENT_DATE - INTERVAL '30 days' AND te.status = 'approved'
             GROUP BY p.id, p.name ORDER BY "Hours" DESC LIMIT 10
-        """)
+        """, query_class='report')
         
         if not proj_data.empty:
             fig = px.bar(proj_data, x='Project', y='Hours', color_discrete_sequence=['#636EFA'])
@@ -1754,7 +3630,7 @@ def manage360_analytics():
             JOIN users u ON te.employee_id = u.id
             WHERE te.entry_date >= CURRENT_DATE - INTERVAL '30 days' AND te.status = 'approved'
             GROUP BY u.id, u.full_name ORDER BY "Hours" DESC LIMIT 10
-        """)
+        """, query_class='report')
         
         if not emp_data.empty:
             fig = px.bar(emp_data, x='Employee', y='Hours', color_discrete_sequence=['#00CC96'])
@@ -1762,6 +3638,33 @@ def manage360_analytics():
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No data available")
+    
+    st.markdown("---")
+    st.markdown("##### ⏱️ Approval SLA (90 Days)")
+    reviewers, bounces = get_approval_sla(get_local_time_naive().date())
+    backlog = get_review_backlog()
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("**Time to Decision by Reviewer (hours)**")
+        if not reviewers.empty:
+            st.dataframe(reviewers, use_container_width=True, hide_index=True)
+        else:
+            st.info("No reviews recorded yet")
+    
+    with col2:
+        st.markdown("**Pending Backlog Age**")
+        if not backlog.empty:
+            fig = px.bar(backlog, x='Age', y='Entries', color_discrete_sequence=['#EF553B'])
+            fig.update_layout(margin=dict(t=20, b=20, l=20, r=20))
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No entries awaiting review")
+    
+    if not bounces.empty:
+        st.markdown("**Rejections & Resubmissions by Employee**")
+        st.dataframe(bounces, use_container_width=True, hide_index=True)
 
 def manage360_projects():
     st.subheader("📁 Project Management")
@@ -1780,6 +3683,7 @@ def manage360_projects():
             with col2:
                 new_manager = st.selectbox("Project Manager", managers['full_name'].tolist(), key="new_proj_mgr")
                 new_proj_desc = st.text_input("Description", key="new_proj_desc")
+                new_proj_budget = st.number_input("Budget Hours (0 = no budget)", min_value=0.0, value=0.0, step=10.0, key="new_proj_budget")
             
             if st.button("Create Project", type="primary"):
                 if new_proj_name:
@@ -1788,8 +3692,9 @@ def manage360_projects():
                     conn = get_connection()
                     try:
                         with conn.cursor() as c:
-                            c.execute("INSERT INTO projects (client_id, name, description, manager_id) VALUES (%s, %s, %s, %s) RETURNING id",
-                                      (client_id, new_proj_name, new_proj_desc, manager_id))
+                            c.execute("""INSERT INTO projects (client_id, name, description, manager_id, budget_hours)
+                                         VALUES (%s, %s, %s, %s, %s) RETURNING id""",
+                                      (client_id, new_proj_name, new_proj_desc, manager_id, new_proj_budget or None))
                             proj_id = c.fetchone()[0]
                             conn.commit()
                     finally:
@@ -1798,62 +3703,636 @@ def manage360_projects():
                     st.success("✅ Project created!")
                     st.rerun()
     
-    projects = execute_df("""
-        SELECT p.id, c.name as "Client", p.name as "Project", u.full_name as "Manager",
-               p.status as "Status", COUNT(DISTINCT pa.employee_id) as "Team_Size",
-               COALESCE(SUM(te.hours), 0) as "Total_Hours"
-        FROM projects p
-        JOIN clients c ON p.client_id = c.id
-        LEFT JOIN users u ON p.manager_id = u.id
-        LEFT JOIN project_assignments pa ON p.id = pa.project_id
-        LEFT JOIN time_entries te ON p.id = te.project_id AND te.status = 'approved'
-        WHERE c.name != 'EE Internal'
-        GROUP BY p.id, c.name, p.name, u.full_name, p.status
-        ORDER BY p.created_at DESC
-    """)
+    projects = execute_df('project_overview')
     
     if not projects.empty:
         st.dataframe(projects, use_container_width=True, hide_index=True)
         
+        alert_pct = float(get_setting('budget_alert_pct') or 80)
+        over_budget = projects[projects['Budget_Used_Pct'].astype(float) >= alert_pct]
+        if not over_budget.empty:
+            st.warning(f"⚠️ **Budget Alerts** (≥{alert_pct:.0f}% of budget used)")
+            st.dataframe(over_budget[['Client', 'Project', 'Manager', 'Total_Hours', 'Budget_Hours', 'Budget_Used_Pct']],
+                         use_container_width=True, hide_index=True)
+        
+        budgeted = projects[projects['Budget_Hours'].notna()]
+        if not budgeted.empty:
+            with st.expander("📉 Budget Burn-down"):
+                burn_labels = {int(project_id): f"{client} / {project}" for project_id, client, project
+                               in zip(budgeted['id'], budgeted['Client'], budgeted['Project'])}
+                show_budget_burndown(st.selectbox("Project", list(burn_labels), format_func=burn_labels.get, key="burn_proj"))
+        
         st.markdown("---")
         st.markdown("##### 👤 Assign Employee to Project")
-        col1, col2, col3 = st.columns([2, 2, 1])
-        
-        employees = execute_df("SELECT id, full_name FROM users WHERE role='employee' AND is_active=TRUE")
+        col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
         
         with col1:
-            assign_proj = st.selectbox("Select Project", projects['Project'].tolist())
+            assign_proj = typeahead_picker("Select Project", 'project', "assign_proj", "c.name != 'EE Internal'")
         with col2:
-            if not employees.empty:
-                assign_emp = st.selectbox("Select Employee", employees['full_name'].tolist())
-            else:
-                st.warning("No employees found")
-                assign_emp = None
+            assign_emp = typeahead_picker("Select Employee", 'employee', "assign_emp", "role = 'employee' AND is_active = TRUE")
         with col3:
+            allocation = st.number_input("Allocation %", min_value=0, max_value=100, value=0, step=5, key="assign_alloc")
+        with col4:
             st.write("")
             st.write("")
-            if assign_emp and st.button("Assign", type="primary"):
-                proj_id = int(projects[projects['Project'] == assign_proj]['id'].values[0])
-                emp_id = int(employees[employees['full_name'] == assign_emp]['id'].values[0])
+            if assign_proj and assign_emp and st.button("Assign", type="primary"):
+                proj_id, emp_id = assign_proj[0], assign_emp[0]
                 conn = get_connection()
                 try:
                     with conn.cursor() as c:
-                        c.execute("INSERT INTO project_assignments (project_id, employee_id) VALUES (%s, %s) ON CONFLICT DO NOTHING", (proj_id, emp_id))
+                        c.execute("""INSERT INTO project_assignments (project_id, employee_id, allocation_pct) VALUES (%s, %s, %s)
+                                     ON CONFLICT (project_id, employee_id) DO UPDATE SET allocation_pct = EXCLUDED.allocation_pct""",
+                                  (proj_id, emp_id, allocation))
                         conn.commit()
-                    st.success(f"✅ Assigned {assign_emp} to {assign_proj}")
+                    build_capacity_forecast.clear()
+                    st.success(f"✅ Assigned {assign_emp[1]} to {assign_proj[1]} at {allocation}%")
                     st.rerun()
                 except Exception as e:
                     st.warning(f"Could not assign: {e}")
                 finally:
                     release_connection(conn)
 
+def show_budget_burndown(project_id):
+    """Remaining budget over time from project_hours_daily, projected at the recent burn rate"""
+    budget_row = execute_query("SELECT budget_hours, consumed_hours FROM projects WHERE id = %s", (project_id,))
+    budget = float(budget_row[0]['budget_hours'] or 0) if budget_row else 0
+    if budget <= 0:
+        st.info("No budget set for this project")
+        return
+    
+    burn = execute_df("""
+        SELECT work_date as "Date", hours as "Hours" FROM project_hours_daily
+        WHERE project_id = %s AND hours != 0 ORDER BY work_date
+    """, (project_id,))
+    if burn.empty:
+        st.info("No approved hours yet")
+        return
+    
+    burn['Date'] = pd.to_datetime(burn['Date'])
+    burn['Remaining'] = budget - burn['Hours'].cumsum()
+    remaining = float(burn['Remaining'].iloc[-1])
+    
+    today = pd.Timestamp(datetime.date.today())
+    recent = burn[burn['Date'] >= today - pd.Timedelta(days=28)]
+    daily_rate = float(recent['Hours'].sum()) / 28
+    
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=burn['Date'], y=burn['Remaining'], mode='lines+markers', name='Remaining'))
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Budget", f"{budget:.0f}h")
+    col2.metric("Remaining", f"{remaining:.1f}h")
+    if daily_rate > 0 and remaining > 0:
+        finish = today + pd.Timedelta(days=remaining / daily_rate)
+        fig.add_trace(go.Scatter(x=[today, finish], y=[remaining, 0], mode='lines', name='Projected',
+                                 line=dict(dash='dash')))
+        col3.metric("Projected Exhaustion", finish.strftime('%Y-%m-%d'))
+    else:
+        col3.metric("Burn Rate (28d)", f"{daily_rate:.1f}h/day")
+    fig.add_hline(y=0, line_color="red")
+    fig.update_layout(margin=dict(t=20, b=20, l=20, r=20))
+    st.plotly_chart(fig, use_container_width=True)
+
+# ============== BILLING ==============
+def price_entries(entries, rates):
+    """Attach the most specific rate in effect on each entry's date.
+    
+    One as-of join per scope (employee, project, role, client); an entry keeps the
+    first scope that matches. Entries without a rate are left with NaN rate/amount.
+    """
+    priced = entries.assign(entry_date=pd.to_datetime(entries['entry_date'])).sort_values('entry_date').reset_index(drop=True)
+    priced['rate'] = float('nan')
+    priced['rate_scope'] = None
+    rates = rates.assign(effective_from=pd.to_datetime(rates['effective_from']))
+    
+    for scope in BILLING_RATE_SCOPES:
+        key = BILLING_RATE_KEYS[scope]
+        scoped = rates.loc[rates['scope'] == scope, [key, 'effective_from', 'hourly_rate']].dropna(subset=[key])
+        if scoped.empty:
+            continue
+        scoped = scoped.astype({key: priced[key].dtype}).sort_values('effective_from')
+        matched = pd.merge_asof(priced[['entry_date', key]], scoped, left_on='entry_date',
+                                right_on='effective_from', by=key, direction='backward')
+        fill = priced['rate'].isna() & matched['hourly_rate'].notna()
+        priced.loc[fill, 'rate'] = matched.loc[fill, 'hourly_rate']
+        priced.loc[fill, 'rate_scope'] = scope
+    
+    priced['amount'] = (priced['hours'] * priced['rate']).round(2)
+    return priced
+
+def run_invoices(period_start, period_end, created_by, client_ids=None):
+    """Price uninvoiced approved billable entries in the period and write one invoice per client.
+    Returns (invoice count, line count, DataFrame of entries with no applicable rate)."""
+    query = """
+        SELECT te.id AS time_entry_id, te.employee_id, te.project_id, p.client_id, u.role,
+               te.entry_date, te.hours + te.minutes / 60.0 AS hours
+        FROM time_entries te
+        JOIN projects p ON te.project_id = p.id
+        JOIN users u ON te.employee_id = u.id
+        WHERE te.status = 'approved' AND te.is_billable AND te.entry_type = 'project_work'
+        AND te.entry_date BETWEEN %s AND %s
+        AND NOT EXISTS (SELECT 1 FROM invoice_lines il WHERE il.time_entry_id = te.id AND NOT il.voided)
+    """
+    params = [period_start, period_end]
+    if client_ids:
+        query += " AND p.client_id = ANY(%s)"
+        params.append(list(client_ids))
+    entries = execute_df(query, tuple(params))
+    if entries.empty:
+        return 0, 0, entries
+    
+    rates = execute_df("""
+        SELECT scope, client_id, project_id, employee_id, role, hourly_rate, effective_from
+        FROM billing_rates WHERE effective_from <= %s
+    """, (period_end,))
+    priced = price_entries(entries, rates)
+    unpriced = priced[priced['rate'].isna()]
+    lines = priced[priced['rate'].notna()]
+    if lines.empty:
+        return 0, 0, unpriced
+    
+    headers = lines.groupby('client_id', as_index=False).agg(total_hours=('hours', 'sum'), total_amount=('amount', 'sum'))
+    local_time = get_local_time_naive()
+    conn = get_connection()
+    try:
+        with conn.cursor() as c:
+            created = execute_values(c, """INSERT INTO invoices (client_id, period_start, period_end, total_hours, total_amount, created_by, created_at)
+                                           VALUES %s RETURNING id, client_id""",
+                                     [(int(h.client_id), period_start, period_end, float(h.total_hours), round(float(h.total_amount), 2),
+                                       created_by, local_time) for h in headers.itertuples(index=False)],
+                                     fetch=True)
+            invoice_ids = {client_id: invoice_id for invoice_id, client_id in created}
+            execute_values(c, """INSERT INTO invoice_lines (invoice_id, time_entry_id, employee_id, project_id, entry_date,
+                                                            hours, rate, rate_scope, amount) VALUES %s""",
+                           list(zip(lines['client_id'].map(invoice_ids).astype(int).tolist(),
+                                    lines['time_entry_id'].astype(int).tolist(),
+                                    lines['employee_id'].astype(int).tolist(),
+                                    lines['project_id'].astype(int).tolist(),
+                                    lines['entry_date'].dt.date.tolist(),
+                                    lines['hours'].astype(float).tolist(),
+                                    lines['rate'].astype(float).tolist(),
+                                    lines['rate_scope'].tolist(),
+                                    lines['amount'].astype(float).tolist())),
+                           page_size=1000)
+            conn.commit()
+    finally:
+        release_connection(conn)
+    return len(invoice_ids), len(lines), unpriced
+
+# Allowed invoice status changes: drafts are issued to the client; either can be voided
+INVOICE_TRANSITIONS = {'draft': ('issued', 'void'), 'issued': ('void',), 'void': ()}
+
+def transition_invoice(invoice_id, status):
+    """Move an invoice to status. Voiding also frees its entries for the next invoice run.
+    Returns False if the invoice's current status does not allow the change."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT status FROM invoices WHERE id=%s FOR UPDATE", (invoice_id,))
+            row = c.fetchone()
+            if not row or status not in INVOICE_TRANSITIONS[row[0]]:
+                return False
+            c.execute("UPDATE invoices SET status=%s WHERE id=%s", (status, invoice_id))
+            if status == 'void':
+                c.execute("UPDATE invoice_lines SET voided = TRUE WHERE invoice_id=%s", (invoice_id,))
+            conn.commit()
+    finally:
+        release_connection(conn)
+    return True
+
+# ============== NOTIFICATIONS ==============
+def deliver_mail(messages):
+    """Send (to, subject, body) tuples through the configured mail backend.
+    
+    [mail] backend = "smtp" sends over one SMTP connection (host/port/username/password/
+    use_tls); the default "file" backend writes .eml files to [mail] outbox for local runs.
+    """
+    messages = [m for m in messages if m[0]]
+    if not messages:
+        return 0
+    sender = get_config('mail', 'sender', 'timesheets@localhost')
+    emails = []
+    for to, subject, body in messages:
+        msg = EmailMessage()
+        msg['From'] = sender
+        msg['To'] = to
+        msg['Subject'] = subject
+        msg.set_content(body)
+        emails.append(msg)
+    
+    if get_config('mail', 'backend', 'file') == 'smtp':
+        with smtplib.SMTP(get_config('mail', 'host', 'localhost'), int(get_config('mail', 'port', 1025))) as smtp:
+            if str(get_config('mail', 'use_tls', 'false')).lower() == 'true':
+                smtp.starttls()
+            if get_config('mail', 'username'):
+                smtp.login(get_config('mail', 'username'), get_config('mail', 'password'))
+            for msg in emails:
+                smtp.send_message(msg)
+    else:
+        outbox = get_config('mail', 'outbox', 'outbox')
+        os.makedirs(outbox, exist_ok=True)
+        # The batch id keeps concurrent runs in the same second apart; 'xb' refuses to overwrite regardless
+        stamp = f"{get_local_time().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        for i, msg in enumerate(emails):
+            with open(os.path.join(outbox, f"{stamp}_{i:05d}.eml"), 'xb') as f:
+                f.write(bytes(msg))
+    return len(emails)
+
+def find_missing_timesheets(start_date, end_date):
+    """Working days on which active staff logged less than a standard day, in one query"""
+    min_hours = float(get_setting('standard_day_hours') or 8)
+    return execute_df("""
+        SELECT u.id as employee_id, u.full_name as "Employee", u.email as "Email",
+               wc.cal_date as "Date", COALESCE(dt.hours, 0) as "Hours_Logged"
+        FROM users u
+        JOIN work_calendar wc ON wc.cal_date BETWEEN GREATEST(%s, u.created_at::date) AND %s AND wc.is_working_day
+        LEFT JOIN daily_totals dt ON dt.employee_id = u.id AND dt.work_date = wc.cal_date
+        WHERE u.is_active = TRUE AND u.role IN ('employee', 'manager')
+        AND COALESCE(dt.hours, 0) < %s
+        ORDER BY u.full_name, wc.cal_date
+    """, (start_date, end_date, min_hours))
+
+def send_missing_timesheet_digests(start_date, end_date):
+    """One reminder per employee and one roll-up per project manager (admins for unmanaged staff).
+    Returns (gap count, messages sent)."""
+    gaps = find_missing_timesheets(start_date, end_date)
+    if gaps.empty:
+        return 0, 0
+    
+    managers = execute_df("""
+        SELECT DISTINCT pa.employee_id, m.id as manager_id, m.email as manager_email
+        FROM project_assignments pa
+        JOIN projects p ON pa.project_id = p.id
+        JOIN users m ON p.manager_id = m.id
+        WHERE m.is_active = TRUE AND p.status = 'active'
+    """)
+    admins = execute_df("SELECT id as manager_id, email as manager_email FROM users WHERE role = 'admin' AND is_active = TRUE")
+    
+    gaps['Line'] = gaps['Date'].astype(str) + ": " + gaps['Hours_Logged'].map('{:.1f}h'.format)
+    company = get_setting('company_name') or 'Execution Edge'
+    period = f"{start_date} to {end_date}"
+    messages = []
+    
+    for (employee_id, name, email), rows in gaps.groupby(['employee_id', 'Employee', 'Email'], sort=False):
+        messages.append((email, f"[{company}] Timesheet reminder ({period})",
+                         f"Hi {name},\n\nThese working days are missing or under-filled:\n\n"
+                         + "\n".join(rows['Line']) + "\n\nPlease submit your time in WorkHub."))
+    
+    routed = gaps.merge(managers, on='employee_id', how='left')
+    unmanaged = routed[routed['manager_id'].isna()].drop(columns=['manager_id', 'manager_email'])
+    routed = pd.concat([routed.dropna(subset=['manager_id']), unmanaged.merge(admins, how='cross')])
+    for manager_email, rows in routed.groupby('manager_email', sort=False):
+        summary = rows.groupby('Employee', sort=True)['Date'].agg(['count', 'min', 'max'])
+        body = "\n".join(f"- {emp}: {r['count']} day(s) between {r['min']} and {r['max']}" for emp, r in summary.iterrows())
+        messages.append((manager_email, f"[{company}] Team timesheet gaps ({period})",
+                         f"Team members with missing or under-filled working days:\n\n{body}"))
+    
+    return len(gaps), deliver_mail(messages)
+
+# ============== BACKGROUND JOBS ==============
+SCHEDULER_TICK_SECONDS = 60
+
+def job_refresh_rollups(conn):
+    """Recompute daily totals for the last five weeks and project burn for active projects"""
+    cutoff = datetime.date.today() - timedelta(days=35)
+    with conn.cursor() as c:
+        c.execute("""SELECT employee_id, entry_date FROM time_entries
+                     WHERE entry_type = 'project_work' AND entry_date >= %s
+                     UNION
+                     SELECT te.employee_id, d::date FROM time_entries te
+                     CROSS JOIN LATERAL generate_series(lower(te.entry_period), upper(te.entry_period) - 1,
+                                                        INTERVAL '1 day') AS d
+                     WHERE te.entry_type = 'ee_internal' AND te.entry_period && daterange(%s, NULL) AND d >= %s
+                     UNION
+                     SELECT employee_id, work_date FROM daily_totals WHERE work_date >= %s""",
+                  (cutoff, cutoff, cutoff, cutoff))
+        day_keys = c.fetchall()
+        refresh_daily_totals(c, day_keys)
+        c.execute("SELECT id FROM projects WHERE status = 'active'")
+        project_ids = [row[0] for row in c.fetchall()]
+        recalculate_project_hours(c, project_ids)
+    return f"{len(day_keys)} employee-days, {len(project_ids)} projects"
+
+def job_maintain_calendar(conn):
+    """Roll the working-day calendar horizon forward"""
+    with conn.cursor() as c:
+        refresh_work_calendar(c)
+    return "calendar refreshed"
+
+def job_warm_caches(conn):
+    """Pre-build this week's capacity forecast and the daily approval SLA so the first manager view is instant"""
+    build_capacity_forecast(get_week_start(datetime.date.today()))
+    get_approval_sla(get_local_time_naive().date())
+    return "capacity forecast and approval SLA warmed"
+
+def job_purge_retention(conn):
+    """Drop job history older than 90 days, abandoned import batches and audit logs past audit_retention_days (0 keeps all)"""
+    retention_days = int(get_setting('audit_retention_days') or 0)
+    with conn.cursor() as c:
+        c.execute("DELETE FROM job_runs WHERE started_at < %s", (get_local_time_naive() - timedelta(days=90),))
+        purged_runs = c.rowcount
+        c.execute("DELETE FROM import_staging WHERE staged_at < %s", (get_local_time_naive() - timedelta(days=1),))
+        purged_logs = 0
+        if retention_days > 0:
+            c.execute("DELETE FROM audit_logs WHERE created_at < %s", (get_local_time_naive() - timedelta(days=retention_days),))
+            purged_logs = c.rowcount
+    return f"{purged_runs} job runs, {purged_logs} audit logs purged"
+
+def job_send_digests(conn):
+    """Weekly missing-timesheet digests for the previous work week"""
+    if get_setting('reminder_digests_enabled') != 'true':
+        return "disabled"
+    this_week = get_week_start(datetime.date.today())
+    gap_count, sent = send_missing_timesheet_digests(this_week - timedelta(days=7), this_week - timedelta(days=1))
+    return f"{gap_count} gaps, {sent} messages"
+
+def job_dedupe_entries(conn):
+    """Remove double-submitted entries: identical unreviewed rows created within a minute of an earlier twin"""
+    with conn.cursor() as c:
+        c.execute("""SELECT DISTINCT te.id FROM time_entries te
+                     JOIN time_entries keep ON keep.employee_id = te.employee_id AND keep.id < te.id
+                          AND keep.entry_date = te.entry_date AND keep.entry_period = te.entry_period
+                          AND keep.project_id IS NOT DISTINCT FROM te.project_id
+                          AND keep.entry_type IS NOT DISTINCT FROM te.entry_type
+                          AND keep.entry_category IS NOT DISTINCT FROM te.entry_category
+                          AND keep.task_type IS NOT DISTINCT FROM te.task_type
+                          AND keep.hours = te.hours AND keep.minutes = te.minutes
+                          AND keep.description IS NOT DISTINCT FROM te.description
+                          AND keep.status = te.status
+                          AND te.created_at - keep.created_at BETWEEN INTERVAL '0' AND INTERVAL '1 minute'
+                     WHERE te.status IN ('draft', 'submitted')""")
+        duplicate_ids = [row[0] for row in c.fetchall()]
+        if duplicate_ids:
+            day_keys = entry_day_keys(c, duplicate_ids)
+            c.execute("DELETE FROM time_entries WHERE id = ANY(%s)", (duplicate_ids,))
+            refresh_daily_totals(c, day_keys)
+            c.execute("""INSERT INTO audit_logs (action, entity_type, details, created_at) VALUES (%s, %s, %s, %s)""",
+                      ("DEDUPE_ENTRIES", "time_entry", ", ".join(map(str, duplicate_ids)), get_local_time_naive()))
+    return f"{len(duplicate_ids)} duplicate entries removed"
+
+SCHEDULED_JOBS = {
+    'refresh_rollups': (timedelta(hours=1), job_refresh_rollups),
+    'maintain_calendar': (timedelta(days=1), job_maintain_calendar),
+    'warm_caches': (timedelta(hours=6), job_warm_caches),
+    'purge_retention': (timedelta(days=1), job_purge_retention),
+    'send_digests': (timedelta(days=7), job_send_digests),
+    'dedupe_entries': (timedelta(days=1), job_dedupe_entries),
+}
+
+def run_job(name, force=False):
+    """Run a scheduled job if it is due and this process wins its advisory lock.
+    Returns the run detail, or None when skipped."""
+    interval, job = SCHEDULED_JOBS[name]
+    conn = get_connection()
+    try:
+        with conn.cursor() as c:
+            c.execute("SELECT pg_try_advisory_lock(hashtext('timesheet-job:' || %s))", (name,))
+            locked = c.fetchone()[0]
+            conn.commit()
+            if not locked:
+                return None
+            try:
+                if not force:
+                    c.execute("SELECT MAX(started_at) FROM job_runs WHERE job_name = %s AND status != 'failed'", (name,))
+                    last_run = c.fetchone()[0]
+                    if last_run and get_local_time_naive() - last_run < interval:
+                        conn.commit()
+                        return None
+                
+                started_at = get_local_time_naive()
+                c.execute("INSERT INTO job_runs (job_name, status, started_at) VALUES (%s, 'running', %s) RETURNING id",
+                          (name, started_at))
+                run_id = c.fetchone()[0]
+                conn.commit()
+                
+                started = time.monotonic()
+                running = get_running_queries()
+                token = uuid.uuid4().hex
+                with running['lock']:
+                    running['queries'][token] = {'Site': f"job:{name}", 'Class': 'job', 'User': 'scheduler',
+                                                 'Started': started_at, 'started_at': started,
+                                                 'pid': conn.info.backend_pid, 'pool': 'primary'}
+                try:
+                    c.execute(f"SET LOCAL statement_timeout = {query_timeout_ms('job')}")
+                    detail, status = job(conn), 'success'
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logger.exception("Scheduled job %s failed", name)
+                    detail, status = f"{type(e).__name__}: {e}", 'failed'
+                finally:
+                    with running['lock']:
+                        running['queries'].pop(token, None)
+                c.execute("""UPDATE job_runs SET status = %s, finished_at = %s, duration_ms = %s, detail = %s
+                             WHERE id = %s""",
+                          (status, get_local_time_naive(), int((time.monotonic() - started) * 1000), detail, run_id))
+                conn.commit()
+                return detail
+            finally:
+                c.execute("SELECT pg_advisory_unlock(hashtext('timesheet-job:' || %s))", (name,))
+                conn.commit()
+    finally:
+        release_connection(conn)
+
+def record_job_failure(name, detail):
+    """Record a failure outside the job itself (lock, connection or bookkeeping) in job_runs"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as c:
+            local_time = get_local_time_naive()
+            c.execute("""INSERT INTO job_runs (job_name, status, started_at, finished_at, duration_ms, detail)
+                         VALUES (%s, 'failed', %s, %s, 0, %s)""", (name, local_time, local_time, detail))
+            conn.commit()
+    finally:
+        release_connection(conn)
+
+def scheduler_loop():
+    while True:
+        for name in SCHEDULED_JOBS:
+            try:
+                run_job(name)
+            except Exception as e:
+                logger.exception("Scheduler could not run job %s", name)
+                try:
+                    record_job_failure(name, f"{type(e).__name__}: {e}")
+                except Exception:
+                    logger.exception("Could not record the failure of job %s", name)
+        time.sleep(SCHEDULER_TICK_SECONDS)
+
+@st.cache_resource
+def start_scheduler():
+    """Start the background job thread once per server process"""
+    if str(get_config('scheduler', 'enabled', 'true')).lower() != 'true':
+        return None
+    thread = threading.Thread(target=scheduler_loop, name="timesheet-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+# ============== BULK IMPORT ==============
+IMPORT_COLUMNS = ['username', 'client', 'project', 'entry_date', 'hours', 'minutes',
+                  'task_type', 'description', 'billable', 'status']
+IMPORT_REQUIRED = ['username', 'client', 'project', 'entry_date', 'hours']
+IMPORT_STATUSES = ['approved', 'submitted', 'draft']
+
+def read_import_file(uploaded):
+    """Parse an uploaded CSV/XLSX into staging-ready columns; unparseable values become NULL for SQL validation"""
+    if uploaded.name.lower().endswith('.xlsx'):
+        raw = pd.read_excel(uploaded, dtype=str)
+    else:
+        raw = pd.read_csv(uploaded, dtype=str)
+    raw.columns = [str(col).strip().lower().replace(' ', '_') for col in raw.columns]
+    missing = [col for col in IMPORT_REQUIRED if col not in raw.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    
+    def text(col, default=None):
+        return raw[col].str.strip() if col in raw.columns else pd.Series(default, index=raw.index, dtype=object)
+    
+    billable = text('billable')
+    return pd.DataFrame({
+        'row_no': range(2, len(raw) + 2),
+        'username': text('username'),
+        'client': text('client'),
+        'project': text('project'),
+        'entry_date': pd.to_datetime(raw['entry_date'], errors='coerce').dt.date,
+        'hours': pd.to_numeric(raw['hours'], errors='coerce'),
+        'minutes': pd.to_numeric(text('minutes', '0'), errors='coerce').fillna(0).round().astype('Int64'),
+        'task_type': text('task_type', PROJECT_TASK_TYPES[0]).fillna(PROJECT_TASK_TYPES[0]),
+        'description': text('description'),
+        'is_billable': billable.isna() | billable.str.lower().isin(['yes', 'y', 'true', '1']),
+        'status': text('status', 'approved').fillna('approved').str.lower(),
+    })
+
+def stage_import(frame):
+    """COPY parsed rows into import_staging, resolve names to ids and flag invalid rows; returns the batch id"""
+    batch_id = uuid.uuid4().hex
+    buffer = StringIO()
+    frame.assign(batch_id=batch_id).to_csv(buffer, index=False, header=False, columns=['batch_id'] + list(frame.columns))
+    buffer.seek(0)
+    
+    conn = get_connection()
+    try:
+        with conn.cursor() as c:
+            c.copy_expert(f"COPY import_staging (batch_id, {', '.join(frame.columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            c.execute("""UPDATE import_staging s SET employee_id = u.id FROM users u
+                         WHERE s.batch_id = %s AND lower(u.username) = lower(s.username)""", (batch_id,))
+            c.execute("""UPDATE import_staging s SET project_id = p.id
+                         FROM (SELECT DISTINCT ON (lower(c.name), lower(p.name)) p.id, lower(c.name) AS client, lower(p.name) AS project
+                               FROM projects p JOIN clients c ON p.client_id = c.id
+                               ORDER BY lower(c.name), lower(p.name), p.id) p
+                         WHERE s.batch_id = %s AND lower(s.client) = p.client AND lower(s.project) = p.project""", (batch_id,))
+            c.execute("""UPDATE import_staging s SET error = NULLIF(concat_ws('; ',
+                             CASE WHEN s.employee_id IS NULL THEN 'unknown user' END,
+                             CASE WHEN s.project_id IS NULL THEN 'unknown client/project' END,
+                             CASE WHEN s.entry_date IS NULL THEN 'invalid date' END,
+                             CASE WHEN s.hours IS NULL OR s.hours < 0 OR s.minutes NOT BETWEEN 0 AND 59
+                                       OR s.hours + s.minutes / 60.0 NOT BETWEEN 0.01 AND 24 THEN 'invalid hours' END,
+                             CASE WHEN s.task_type <> ALL(%s) THEN 'unknown task type' END,
+                             CASE WHEN s.status <> ALL(%s) THEN 'invalid status' END,
+                             CASE WHEN s.employee_id IS NOT NULL AND s.project_id IS NOT NULL AND NOT EXISTS (
+                                       SELECT 1 FROM project_assignments pa
+                                       WHERE pa.project_id = s.project_id AND pa.employee_id = s.employee_id)
+                                  THEN 'not assigned to project' END), '')
+                         WHERE s.batch_id = %s""", (PROJECT_TASK_TYPES, IMPORT_STATUSES, batch_id))
+            # Duplicates and impossible days need the other rows, so run as a second pass over the valid rows
+            c.execute("""WITH checks AS (
+                             SELECT s.row_no,
+                                    ROW_NUMBER() OVER (PARTITION BY s.employee_id, s.project_id, s.entry_date, s.hours, s.minutes,
+                                                       COALESCE(s.description, '') ORDER BY s.row_no) > 1 AS repeated,
+                                    EXISTS (SELECT 1 FROM time_entries te
+                                            WHERE te.employee_id = s.employee_id AND te.entry_date = s.entry_date
+                                            AND te.project_id = s.project_id AND te.hours = s.hours AND te.minutes = s.minutes
+                                            AND te.status <> 'rejected') AS recorded,
+                                    SUM(s.hours + s.minutes / 60.0) OVER (PARTITION BY s.employee_id, s.entry_date)
+                                        + COALESCE(dt.hours, 0) AS day_hours
+                             FROM import_staging s
+                             LEFT JOIN daily_totals dt ON dt.employee_id = s.employee_id AND dt.work_date = s.entry_date
+                             WHERE s.batch_id = %s AND s.error IS NULL
+                         )
+                         UPDATE import_staging s SET error = concat_ws('; ',
+                             CASE WHEN checks.repeated THEN 'duplicate row in file' END,
+                             CASE WHEN checks.recorded THEN 'already recorded' END,
+                             CASE WHEN checks.day_hours > 24 THEN 'day exceeds 24 hours' END)
+                         FROM checks
+                         WHERE s.batch_id = %s AND s.row_no = checks.row_no
+                         AND (checks.repeated OR checks.recorded OR checks.day_hours > 24)""", (batch_id, batch_id))
+            conn.commit()
+    finally:
+        release_connection(conn)
+    return batch_id
+
+def import_summary(batch_id):
+    """Valid/invalid counts, overtime days and the first row errors for a staged batch.
+    Read from the primary: unlogged staging tables are not replicated."""
+    counts = execute_query("""
+        SELECT COUNT(*) FILTER (WHERE error IS NULL) AS valid, COUNT(*) FILTER (WHERE error IS NOT NULL) AS invalid
+        FROM import_staging WHERE batch_id = %s
+    """, (batch_id,), primary=True)[0]
+    overtime = execute_query("""
+        SELECT COUNT(*) AS days FROM (
+            SELECT s.employee_id, s.entry_date
+            FROM import_staging s
+            LEFT JOIN daily_totals dt ON dt.employee_id = s.employee_id AND dt.work_date = s.entry_date
+            WHERE s.batch_id = %s AND s.error IS NULL
+            GROUP BY s.employee_id, s.entry_date, dt.hours
+            HAVING SUM(s.hours + s.minutes / 60.0) + COALESCE(dt.hours, 0)
+                   > COALESCE((SELECT value::real FROM settings WHERE key = 'overtime_threshold'), 9)
+        ) days
+    """, (batch_id,), primary=True)[0]['days']
+    errors = execute_df("""
+        SELECT row_no as "Row", username as "User", client as "Client", project as "Project",
+               entry_date as "Date", hours as "Hours", error as "Error"
+        FROM import_staging WHERE batch_id = %s AND error IS NOT NULL
+        ORDER BY row_no LIMIT 1000
+    """, (batch_id,), primary=True)
+    return counts['valid'], counts['invalid'], overtime, errors
+
+def merge_import(batch_id, admin_id):
+    """Insert a batch's valid rows into time_entries in one statement and refresh the rollups they touch"""
+    conn = get_connection()
+    try:
+        with conn.cursor() as c:
+            local_time = get_local_time_naive()
+            c.execute("""WITH inserted AS (
+                             INSERT INTO time_entries (employee_id, project_id, entry_date, hours, minutes, description, task_type,
+                                                       is_billable, status, submitted_at, reviewed_by, reviewed_at,
+                                                       created_at, updated_at, entry_type)
+                             SELECT employee_id, project_id, entry_date, hours, minutes, description, task_type::task_kind,
+                                    is_billable, status::entry_status,
+                                    CASE WHEN status <> 'draft' THEN %(now)s END,
+                                    CASE WHEN status = 'approved' THEN %(admin)s END,
+                                    CASE WHEN status = 'approved' THEN %(now)s END,
+                                    %(now)s, %(now)s, 'project_work'
+                             FROM import_staging WHERE batch_id = %(batch)s AND error IS NULL
+                             ORDER BY row_no
+                             RETURNING id, status
+                         )
+                         INSERT INTO entry_status_events (time_entry_id, from_status, to_status, changed_by, changed_at, comment)
+                         SELECT id, NULL, status, %(admin)s, %(now)s, 'imported' FROM inserted""",
+                      {'now': local_time, 'admin': admin_id, 'batch': batch_id})
+            imported = c.rowcount
+            c.execute("""SELECT DISTINCT employee_id, entry_date FROM import_staging
+                         WHERE batch_id = %s AND error IS NULL AND status = ANY(%s)""", (batch_id, COUNTED_STATUSES))
+            refresh_daily_totals(c, c.fetchall())
+            c.execute("""SELECT DISTINCT project_id FROM import_staging
+                         WHERE batch_id = %s AND error IS NULL AND status = 'approved'""", (batch_id,))
+            recalculate_project_hours(c, [row[0] for row in c.fetchall()])
+            c.execute("DELETE FROM import_staging WHERE batch_id = %s", (batch_id,))
+            conn.commit()
+    finally:
+        release_connection(conn)
+    log_audit(admin_id, "BULK_IMPORT", "time_entry", None, f"{imported} entries imported")
+    return imported
+
+def discard_import(batch_id):
+    execute_query("DELETE FROM import_staging WHERE batch_id = %s", (batch_id,), fetch=False)
+
 # ============== TECHCORE (ADMIN PORTAL) ==============
 def techcore_dashboard():
     user = st.session_state.user
     st.title("⚙️ TechCore - Admin Portal")
     st.markdown(f"Welcome, **{user['full_name']}**")
     
-    tabs = st.tabs(["👥 Users", "🏢 Clients", "📁 Projects", "📊 Reports", "📤 Export Center", "⚙️ Settings", "📜 Audit Logs"])
+    tabs = st.tabs(["👥 Users", "🏢 Clients", "📁 Projects", "🏖️ Leave", "💵 Billing", "📊 Reports", "📥 Import", "📤 Export Center", "⚙️ Settings", "📜 Audit Logs", "⚡ Performance"])
     
     with tabs[0]:
         techcore_users()
@@ -1862,13 +4341,21 @@ def techcore_dashboard():
     with tabs[2]:
         techcore_projects_admin()
     with tabs[3]:
-        techcore_reports()
+        techcore_leave()
     with tabs[4]:
-        techcore_export_center()
+        techcore_billing()
     with tabs[5]:
-        techcore_settings()
+        render_guarded(techcore_reports)
     with tabs[6]:
+        techcore_import()
+    with tabs[7]:
+        render_guarded(techcore_export_center)
+    with tabs[8]:
+        techcore_settings()
+    with tabs[9]:
         techcore_audit()
+    with tabs[10]:
+        techcore_performance()
 
 def techcore_users():
     st.subheader("👥 User Management")
@@ -1905,26 +4392,28 @@ def techcore_users():
             else:
                 st.warning("⚠️ Username, password, and full name are required")
     
-    users = execute_df("""
+    data_grid("users_grid", """
         SELECT id, username as "Username", full_name as "Name", email as "Email", 
                role as "Role", department as "Department",
                CASE WHEN is_active THEN 'Active' ELSE 'Inactive' END as "Status",
                created_at as "Created"
-        FROM users ORDER BY created_at DESC
-    """)
-    
-    st.dataframe(users, use_container_width=True, hide_index=True)
+        FROM users
+    """, sort_columns=("Created", "Username", "Name"), filter_columns=("Username", "Name", "Email", "Department", "Role"))
     
     st.markdown("---")
     st.markdown("##### ✏️ Edit User")
     col1, col2 = st.columns(2)
     
     with col1:
-        edit_user = st.selectbox("Select User", users['Username'].tolist())
-        user_id = int(users[users['Username'] == edit_user]['id'].values[0])
+        picked = typeahead_picker("Select User", 'user', "edit_user")
     with col2:
         action = st.selectbox("Action", ["Reset Password", "Toggle Active", "Change Role", "🗑️ Delete User"])
     
+    if picked is None:
+        return
+    user_id = picked[0]
+    edit_user = execute_query("SELECT username FROM users WHERE id=%s", (user_id,))[0]['username']
+    
     if action == "Reset Password":
         new_pwd = st.text_input("New Password", type="password", key="reset_pwd")
         if st.button("Reset Password"):
@@ -1974,9 +4463,16 @@ def techcore_users():
                     conn = get_connection()
                     try:
                         with conn.cursor() as c:
+                            c.execute("DELETE FROM daily_totals WHERE employee_id=%s", (user_id,))
+                            c.execute("""SELECT DISTINCT project_id FROM time_entries
+                                         WHERE employee_id=%s AND status='approved' AND project_id IS NOT NULL""", (user_id,))
+                            affected_projects = [row[0] for row in c.fetchall()]
                             c.execute("DELETE FROM time_entries WHERE employee_id=%s", (user_id,))
+                            recalculate_project_hours(c, affected_projects)
                             c.execute("DELETE FROM project_assignments WHERE employee_id=%s", (user_id,))
                             c.execute("DELETE FROM recall_requests WHERE employee_id=%s", (user_id,))
+                            c.execute("DELETE FROM leave_ledger WHERE employee_id=%s", (user_id,))
+                            c.execute("DELETE FROM leave_balances WHERE employee_id=%s", (user_id,))
                             c.execute("DELETE FROM users WHERE id=%s", (user_id,))
                             conn.commit()
                     finally:
@@ -2013,31 +4509,23 @@ def techcore_clients():
                 finally:
                     release_connection(conn)
     
-    clients = execute_df("""
-        SELECT c.id, c.name as "Client", c.description as "Description",
-               CASE WHEN c.is_active THEN 'Active' ELSE 'Inactive' END as "Status",
-               COUNT(DISTINCT p.id) as "Projects",
-               COALESCE(SUM(te.hours), 0) as "Total_Hours"
-        FROM clients c
-        LEFT JOIN projects p ON c.id = p.client_id
-        LEFT JOIN time_entries te ON p.id = te.project_id AND te.status = 'approved'
-        GROUP BY c.id, c.name, c.description, c.is_active
-        ORDER BY c.name
-    """)
-    
-    st.dataframe(clients, use_container_width=True, hide_index=True)
+    clients = data_grid("clients_grid", GRID_QUERIES['clients'], sort_columns=("Client", "Projects", "Total_Hours"), filter_columns=("Client", "Description"))
     
-    if not clients.empty:
+    # The grid filter only narrows the listing; the picker below searches every client
+    if not clients.empty or st.session_state.get("clients_grid_filter"):
         st.markdown("---")
         st.markdown("##### ✏️ Manage Client")
         col1, col2 = st.columns(2)
         
         with col1:
-            selected_client = st.selectbox("Select Client", clients['Client'].tolist())
-            client_id = int(clients[clients['Client'] == selected_client]['id'].values[0])
+            picked = typeahead_picker("Select Client", 'client', "manage_client")
         with col2:
             client_action = st.selectbox("Action", ["Toggle Active", "🗑️ Delete Client"], key="client_action")
         
+        if picked is None:
+            return
+        client_id, selected_client = picked
+        
         if client_action == "Toggle Active":
             if st.button("Toggle Client Status"):
                 conn = get_connection()
@@ -2058,51 +4546,55 @@ def techcore_clients():
                     conn = get_connection()
                     try:
                         with conn.cursor() as c:
-                            c.execute("SELECT id FROM projects WHERE client_id=%s", (client_id,))
-                            project_ids = [row[0] for row in c.fetchall()]
-                            for pid in project_ids:
-                                c.execute("DELETE FROM time_entries WHERE project_id=%s", (pid,))
-                                c.execute("DELETE FROM project_assignments WHERE project_id=%s", (pid,))
-                            c.execute("DELETE FROM projects WHERE client_id=%s", (client_id,))
-                            c.execute("DELETE FROM clients WHERE id=%s", (client_id,))
-                            conn.commit()
+                            # Issued and void invoices are kept; only drafts go with the client
+                            c.execute("SELECT COUNT(*) FROM invoices WHERE client_id=%s AND status != 'draft'", (client_id,))
+                            billed = c.fetchone()[0]
+                            if not billed:
+                                c.execute("DELETE FROM invoices WHERE client_id=%s", (client_id,))
+                                c.execute("SELECT id FROM projects WHERE client_id=%s", (client_id,))
+                                project_ids = [row[0] for row in c.fetchall()]
+                                c.execute("SELECT id FROM time_entries WHERE project_id = ANY(%s)", (project_ids,))
+                                day_keys = entry_day_keys(c, [row[0] for row in c.fetchall()])
+                                for pid in project_ids:
+                                    c.execute("DELETE FROM time_entries WHERE project_id=%s", (pid,))
+                                    c.execute("DELETE FROM project_assignments WHERE project_id=%s", (pid,))
+                                    c.execute("DELETE FROM project_hours_daily WHERE project_id=%s", (pid,))
+                                refresh_daily_totals(c, day_keys)
+                                c.execute("DELETE FROM projects WHERE client_id=%s", (client_id,))
+                                c.execute("DELETE FROM clients WHERE id=%s", (client_id,))
+                                conn.commit()
                     finally:
                         release_connection(conn)
-                    log_audit(st.session_state.user['id'], "DELETE_CLIENT", "client", client_id)
-                    st.success(f"✅ Client '{selected_client}' deleted!")
-                    st.rerun()
+                    if billed:
+                        st.error(f"❌ '{selected_client}' has {billed} issued or void invoice(s). Deactivate the client instead.")
+                    else:
+                        log_audit(st.session_state.user['id'], "DELETE_CLIENT", "client", client_id)
+                        st.success(f"✅ Client '{selected_client}' deleted!")
+                        st.rerun()
                 else:
                     st.error("Client name doesn't match.")
 
 def techcore_projects_admin():
     st.subheader("📁 All Projects")
     
-    projects = execute_df("""
-        SELECT p.id, c.name as "Client", p.name as "Project", u.full_name as "Manager",
-               p.status as "Status", p.created_at as "Created",
-               COUNT(DISTINCT pa.employee_id) as "Team",
-               COALESCE(SUM(te.hours), 0) as "Hours"
-        FROM projects p
-        JOIN clients c ON p.client_id = c.id
-        LEFT JOIN users u ON p.manager_id = u.id
-        LEFT JOIN project_assignments pa ON p.id = pa.project_id
-        LEFT JOIN time_entries te ON p.id = te.project_id AND te.status = 'approved'
-        GROUP BY p.id, c.name, p.name, u.full_name, p.status, p.created_at
-        ORDER BY p.created_at DESC
-    """)
-    
-    st.dataframe(projects, use_container_width=True, hide_index=True)
+    projects = data_grid("projects_grid", GRID_QUERIES['projects'], sort_columns=("Created", "Project", "Client", "Hours"), filter_columns=("Project", "Client", "Manager", "Status"))
     
-    if not projects.empty:
+    # The grid filter only narrows the listing; the picker below searches every project
+    if not projects.empty or st.session_state.get("projects_grid_filter"):
         st.markdown("---")
         st.markdown("##### ✏️ Manage Project")
         col1, col2 = st.columns(2)
         
         with col1:
-            sel_proj = st.selectbox("Select Project", projects['Project'].tolist())
-            proj_id = int(projects[projects['Project'] == sel_proj]['id'].values[0])
+            picked = typeahead_picker("Select Project", 'project', "manage_proj")
         with col2:
-            proj_action = st.selectbox("Action", ["Update Status", "🗑️ Delete Project"], key="proj_action")
+            proj_action = st.selectbox("Action", ["Update Status", "Set Budget", "🗑️ Delete Project"], key="proj_action")
+        
+        if picked is None:
+            return
+        proj_id = picked[0]
+        selected = execute_query("SELECT name, budget_hours FROM projects WHERE id=%s", (proj_id,))[0]
+        sel_proj = selected['name']
         
         if proj_action == "Update Status":
             new_status = st.selectbox("New Status", ["active", "on_hold", "completed", "cancelled"])
@@ -2117,6 +4609,22 @@ def techcore_projects_admin():
                 st.success("✅ Status updated!")
                 st.rerun()
         
+        elif proj_action == "Set Budget":
+            current_budget = selected['budget_hours']
+            new_budget = st.number_input("Budget Hours (0 = no budget)", min_value=0.0, step=10.0,
+                                         value=float(current_budget) if current_budget is not None else 0.0)
+            if st.button("Save Budget"):
+                conn = get_connection()
+                try:
+                    with conn.cursor() as c:
+                        c.execute("UPDATE projects SET budget_hours=%s WHERE id=%s", (new_budget or None, proj_id))
+                        conn.commit()
+                finally:
+                    release_connection(conn)
+                log_audit(st.session_state.user['id'], "SET_BUDGET", "project", proj_id, str(new_budget))
+                st.success("✅ Budget updated!")
+                st.rerun()
+        
         elif proj_action == "🗑️ Delete Project":
             st.warning(f"⚠️ Permanently delete project: **{sel_proj}**")
             confirm = st.text_input("Type project name to confirm:", key="confirm_delete_proj")
@@ -2125,9 +4633,13 @@ def techcore_projects_admin():
                     conn = get_connection()
                     try:
                         with conn.cursor() as c:
+                            c.execute("SELECT id FROM time_entries WHERE project_id=%s", (proj_id,))
+                            day_keys = entry_day_keys(c, [row[0] for row in c.fetchall()])
                             c.execute("DELETE FROM time_entries WHERE project_id=%s", (proj_id,))
                             c.execute("DELETE FROM project_assignments WHERE project_id=%s", (proj_id,))
+                            c.execute("DELETE FROM project_hours_daily WHERE project_id=%s", (proj_id,))
                             c.execute("DELETE FROM projects WHERE id=%s", (proj_id,))
+                            refresh_daily_totals(c, day_keys)
                             conn.commit()
                     finally:
                         release_connection(conn)
@@ -2137,6 +4649,226 @@ def techcore_projects_admin():
                 else:
                     st.error("Project name doesn't match.")
 
+def techcore_leave():
+    st.subheader("🏖️ Leave Balances")
+    
+    employees = execute_df("SELECT id, full_name FROM users WHERE is_active=TRUE ORDER BY full_name")
+    employee_names = {int(emp_id): name for emp_id, name in zip(employees['id'], employees['full_name'])}
+    
+    with st.expander("➕ Post Accrual / Adjustment"):
+        col1, col2 = st.columns(2)
+        with col1:
+            # Options are ids (None for everyone), so employees sharing a name stay distinct
+            post_target = st.selectbox("Employee", [None] + list(employee_names), key="leave_emp",
+                                       format_func=lambda emp_id: employee_names.get(emp_id, "All active employees"))
+            post_type = st.selectbox("Leave Type", LEAVE_TYPES, key="leave_post_type")
+        with col2:
+            post_kind = st.selectbox("Kind", ["accrual", "adjustment"], key="leave_kind")
+            post_hours = st.number_input("Hours (negative to deduct)", value=8.0, step=0.5, key="leave_hours")
+        post_note = st.text_input("Note", placeholder="e.g., Monthly accrual", key="leave_note")
+        
+        if st.button("Post to Ledger", type="primary"):
+            admin_id = st.session_state.user['id']
+            conn = get_connection()
+            try:
+                with conn.cursor() as c:
+                    if post_target is None:
+                        local_time = get_local_time_naive()
+                        c.execute("""WITH bal AS (
+                                         INSERT INTO leave_balances (employee_id, leave_type, balance_hours, updated_at)
+                                         SELECT id, %s, %s, %s FROM users WHERE is_active = TRUE
+                                         ON CONFLICT (employee_id, leave_type) DO UPDATE
+                                         SET balance_hours = leave_balances.balance_hours + EXCLUDED.balance_hours,
+                                             updated_at = EXCLUDED.updated_at
+                                         RETURNING employee_id, balance_hours
+                                     )
+                                     INSERT INTO leave_ledger (employee_id, leave_type, kind, hours, balance_after, note, created_by, created_at)
+                                     SELECT employee_id, %s, %s, %s, balance_hours, %s, %s, %s FROM bal""",
+                                  (post_type, post_hours, local_time,
+                                   post_type, post_kind, post_hours, post_note, admin_id, local_time))
+                        posted = c.rowcount
+                    else:
+                        post_leave_ledger(c, post_target, post_type, post_kind, post_hours, note=post_note, created_by=admin_id)
+                        posted = 1
+                    conn.commit()
+            finally:
+                release_connection(conn)
+            log_audit(admin_id, f"LEAVE_{post_kind.upper()}", "leave_ledger", None,
+                      f"{employee_names.get(post_target, 'All active employees')}: {post_type} {post_hours:+.1f}h")
+            st.success(f"✅ Posted to {posted} employee(s)")
+            st.rerun()
+    
+    balances = execute_df("""
+        SELECT u.full_name as "Employee", u.department as "Department",
+               lb.leave_type as "Leave Type", lb.balance_hours as "Balance (hrs)", lb.updated_at as "Updated"
+        FROM leave_balances lb
+        JOIN users u ON lb.employee_id = u.id
+        WHERE u.is_active = TRUE
+        ORDER BY u.full_name, lb.leave_type
+    """)
+    
+    if balances.empty:
+        st.info("📭 No leave balances yet. Post an accrual to get started.")
+        return
+    
+    st.dataframe(balances, use_container_width=True, hide_index=True)
+    
+    st.markdown("---")
+    st.markdown("##### 📜 Ledger")
+    ledger_emp_id = st.selectbox("Employee", list(employee_names), format_func=employee_names.get, key="ledger_emp")
+    ledger = execute_df("""
+        SELECT l.created_at as "Date", l.leave_type as "Leave Type", l.kind as "Kind",
+               l.hours as "Hours", l.balance_after as "Balance", l.note as "Note", r.full_name as "Posted By"
+        FROM leave_ledger l
+        LEFT JOIN users r ON l.created_by = r.id
+        WHERE l.employee_id = %s
+        ORDER BY l.id DESC LIMIT 100
+    """, (ledger_emp_id,))
+    
+    if not ledger.empty:
+        st.dataframe(ledger, use_container_width=True, hide_index=True)
+    else:
+        st.caption("No ledger entries")
+
+def techcore_billing():
+    st.subheader("💵 Billing")
+    
+    with st.expander("➕ Add Billing Rate"):
+        col1, col2 = st.columns(2)
+        with col1:
+            rate_scope = st.selectbox("Applies To", BILLING_RATE_SCOPES, format_func=str.title, key="rate_scope")
+            if rate_scope == 'employee':
+                options = execute_df("SELECT id, full_name as name FROM users WHERE is_active=TRUE ORDER BY full_name")
+            elif rate_scope == 'project':
+                options = execute_df("""SELECT p.id, c.name || ' / ' || p.name as name FROM projects p
+                                        JOIN clients c ON p.client_id = c.id WHERE c.name != 'EE Internal' ORDER BY name""")
+            elif rate_scope == 'client':
+                options = execute_df("SELECT id, name FROM clients WHERE name != 'EE Internal' ORDER BY name")
+            else:
+                options = pd.DataFrame({'id': ['employee', 'manager', 'admin'], 'name': ['Employee', 'Manager', 'Admin']})
+            target_names = dict(zip(options['id'], options['name']))
+            rate_target = st.selectbox("Target", list(target_names), format_func=target_names.get,
+                                       key="rate_target") if target_names else None
+        with col2:
+            hourly_rate = st.number_input("Hourly Rate", min_value=0.0, value=100.0, step=5.0, key="rate_amount")
+            effective_from = st.date_input("Effective From", datetime.date.today().replace(day=1), key="rate_from")
+        
+        if st.button("Add Rate", type="primary") and rate_target is not None:
+            columns = {'client_id': None, 'project_id': None, 'employee_id': None, 'role': None}
+            columns[BILLING_RATE_KEYS[rate_scope]] = rate_target if rate_scope == 'role' else int(rate_target)
+            conn = get_connection()
+            try:
+                with conn.cursor() as c:
+                    c.execute("""INSERT INTO billing_rates (scope, client_id, project_id, employee_id, role, hourly_rate, effective_from, created_by)
+                                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id""",
+                              (rate_scope, columns['client_id'], columns['project_id'], columns['employee_id'], columns['role'],
+                               hourly_rate, effective_from, st.session_state.user['id']))
+                    rate_id = c.fetchone()[0]
+                    conn.commit()
+            finally:
+                release_connection(conn)
+            log_audit(st.session_state.user['id'], "ADD_BILLING_RATE", "billing_rate", rate_id, f"{rate_scope} {target_names[rate_target]}: {hourly_rate}")
+            st.success("✅ Rate added!")
+            st.rerun()
+    
+    rates = execute_df("""
+        SELECT br.scope as "Scope",
+               COALESCE(u.full_name, c.name || ' / ' || p.name, br.role, cl.name) as "Applies To",
+               br.hourly_rate as "Rate", br.effective_from as "Effective From"
+        FROM billing_rates br
+        LEFT JOIN users u ON br.employee_id = u.id
+        LEFT JOIN projects p ON br.project_id = p.id
+        LEFT JOIN clients c ON p.client_id = c.id
+        LEFT JOIN clients cl ON br.client_id = cl.id
+        ORDER BY br.scope, "Applies To", br.effective_from DESC
+    """)
+    if not rates.empty:
+        st.dataframe(rates, use_container_width=True, hide_index=True)
+    else:
+        st.info("📭 No billing rates yet")
+    
+    st.markdown("---")
+    st.markdown("##### 🧾 Invoice Run")
+    col1, col2 = st.columns(2)
+    last_month_end = datetime.date.today().replace(day=1) - timedelta(days=1)
+    with col1:
+        inv_start = st.date_input("Period Start", last_month_end.replace(day=1), key="inv_start")
+    with col2:
+        inv_end = st.date_input("Period End", last_month_end, key="inv_end")
+    
+    if st.button("🧾 Generate Invoices", type="primary"):
+        invoice_count, line_count, unpriced = run_invoices(inv_start, inv_end, st.session_state.user['id'])
+        if invoice_count:
+            log_audit(st.session_state.user['id'], "INVOICE_RUN", "invoice", None,
+                      f"{inv_start} to {inv_end}: {invoice_count} invoices, {line_count} lines")
+            st.success(f"✅ Created {invoice_count} invoice(s) with {line_count} line(s)")
+        else:
+            st.info("📭 No uninvoiced billable hours to price in this period")
+        if not unpriced.empty:
+            st.warning(f"⚠️ {len(unpriced)} entries have no applicable rate and were not invoiced")
+            st.dataframe(unpriced[['time_entry_id', 'employee_id', 'project_id', 'client_id', 'entry_date', 'hours']],
+                         use_container_width=True, hide_index=True)
+    
+    invoices = execute_df("""
+        SELECT i.id, i.client_id, c.name as "Client", i.period_start as "From", i.period_end as "To",
+               i.total_hours as "Hours", i.total_amount as "Amount", i.status as "Status", i.created_at as "Created"
+        FROM invoices i
+        JOIN clients c ON i.client_id = c.id
+        ORDER BY i.created_at DESC LIMIT 100
+    """)
+    if not invoices.empty:
+        st.dataframe(invoices.drop(columns=['client_id']), use_container_width=True, hide_index=True)
+        
+        sel_invoice = st.selectbox("Invoice Lines", invoices['id'].tolist(),
+                                   format_func=lambda i: f"#{i} · {invoices[invoices['id'] == i]['Client'].iloc[0]}", key="inv_lines")
+        lines = execute_df("""
+            SELECT il.entry_date as "Date", u.full_name as "Employee", p.name as "Project",
+                   il.hours as "Hours", il.rate as "Rate", il.rate_scope as "Rate_Basis", il.amount as "Amount"
+            FROM invoice_lines il
+            LEFT JOIN users u ON il.employee_id = u.id
+            LEFT JOIN projects p ON il.project_id = p.id
+            WHERE il.invoice_id = %s
+            ORDER BY il.entry_date, u.full_name
+        """, (int(sel_invoice),))
+        st.download_button("📥 Download Invoice Lines", lines.to_csv(index=False), f"invoice_{sel_invoice}.csv", "text/csv")
+        
+        invoice = invoices[invoices['id'] == sel_invoice].iloc[0]
+        user_id = st.session_state.user['id']
+        if invoice['Status'] == 'draft':
+            if st.button("📤 Issue Invoice", key="inv_issue"):
+                if transition_invoice(int(sel_invoice), 'issued'):
+                    log_audit(user_id, "ISSUE_INVOICE", "invoice", int(sel_invoice), f"{invoice['Client']}: {invoice['Amount']}")
+                    st.success(f"✅ Invoice #{sel_invoice} issued")
+                    st.rerun()
+                else:
+                    st.error("❌ This invoice is no longer a draft")
+        if invoice['Status'] != 'void':
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                void_reason = st.text_input("Void reason", key="inv_void_reason")
+            with col2:
+                rerun = st.checkbox("Re-run period", value=True, key="inv_void_rerun",
+                                    help="Re-price this client's hours for the invoice period at current rates")
+            if st.button("🚫 Void Invoice", key="inv_void"):
+                if not void_reason.strip():
+                    st.error("Enter a reason to void the invoice.")
+                elif not transition_invoice(int(sel_invoice), 'void'):
+                    st.error("❌ This invoice has already been voided")
+                else:
+                    log_audit(user_id, "VOID_INVOICE", "invoice", int(sel_invoice), f"{invoice['Client']}: {void_reason.strip()}")
+                    unpriced = pd.DataFrame()
+                    if rerun:
+                        invoice_count, line_count, unpriced = run_invoices(invoice['From'], invoice['To'], user_id,
+                                                                           client_ids=[int(invoice['client_id'])])
+                        if invoice_count:
+                            log_audit(user_id, "INVOICE_RUN", "invoice", None,
+                                      f"{invoice['From']} to {invoice['To']} for {invoice['Client']} after voiding #{sel_invoice}: "
+                                      f"{invoice_count} invoices, {line_count} lines")
+                    st.success(f"✅ Invoice #{sel_invoice} voided")
+                    if unpriced.empty:
+                        st.rerun()
+                    st.warning(f"⚠️ {len(unpriced)} entries have no applicable rate and were not invoiced")
+
 def techcore_reports():
     st.subheader("📊 System Reports")
     
@@ -2165,7 +4897,7 @@ def techcore_reports():
                 JOIN users u ON te.employee_id = u.id
                 WHERE te.entry_date BETWEEN %s AND %s AND te.status = 'approved'
                 GROUP BY u.id, u.full_name, u.department ORDER BY "Total_Hours" DESC
-            """, (start, end))
+            """, (start, end), query_class='report')
         
         elif report_type == "Project Hours Summary":
             df = execute_df("""
@@ -2177,7 +4909,7 @@ def techcore_reports():
                 LEFT JOIN users u ON p.manager_id = u.id
                 WHERE te.entry_date BETWEEN %s AND %s AND te.status = 'approved'
                 GROUP BY p.id, c.name, p.name, u.full_name ORDER BY "Total_Hours" DESC
-            """, (start, end))
+            """, (start, end), query_class='report')
         
         elif report_type == "Client Hours Summary":
             df = execute_df("""
@@ -2189,31 +4921,40 @@ def techcore_reports():
                 JOIN clients c ON p.client_id = c.id
                 WHERE te.entry_date BETWEEN %s AND %s AND te.status = 'approved'
                 GROUP BY c.id, c.name ORDER BY "Total_Hours" DESC
-            """, (start, end))
+            """, (start, end), query_class='report')
         
         elif report_type == "EE Internal Summary":
             df = execute_df("""
-                SELECT u.full_name as "Employee", te.entry_category as "Category",
-                       te.task_type as "Type", COALESCE(SUM(te.hours), 0) as "Total_Hours",
-                       COUNT(*) as "Entries"
-                FROM time_entries te
-                JOIN users u ON te.employee_id = u.id
-                WHERE te.entry_date BETWEEN %s AND %s AND te.status = 'approved' AND te.entry_type = 'ee_internal'
-                GROUP BY u.id, u.full_name, te.entry_category, te.task_type ORDER BY "Total_Hours" DESC
-            """, (start, end))
+                SELECT u.full_name as "Employee", ted.entry_category as "Category",
+                       ted.task_type as "Type", COALESCE(SUM(ted.hours), 0) as "Total_Hours",
+                       COUNT(DISTINCT ted.entry_id) as "Entries", COUNT(*) as "Days"
+                FROM time_entry_days ted
+                JOIN users u ON ted.employee_id = u.id
+                WHERE ted.entry_period && daterange(%s, %s, '[]') AND ted.work_date BETWEEN %s AND %s
+                AND ted.status = 'approved' AND ted.entry_type = 'ee_internal'
+                GROUP BY u.id, u.full_name, ted.entry_category, ted.task_type ORDER BY "Total_Hours" DESC
+            """, (start, end, start, end), query_class='report')
         
         else:  # Utilization Report
+            day_hours = float(get_setting('standard_day_hours') or 8)
             df = execute_df("""
+                WITH capacity AS (
+                    SELECT COUNT(*) * %s as hours FROM work_calendar
+                    WHERE cal_date BETWEEN %s AND %s AND is_working_day
+                )
                 SELECT u.full_name as "Employee", u.department as "Department",
                        COALESCE(SUM(te.hours), 0) as "Total_Hours",
                        COALESCE(SUM(CASE WHEN te.is_billable THEN te.hours ELSE 0 END), 0) as "Billable",
-                       ROUND(COALESCE(SUM(CASE WHEN te.is_billable THEN te.hours ELSE 0 END), 0) * 100.0 / 
-                             NULLIF(SUM(te.hours), 0), 1) as "Utilization_Pct"
+                       ROUND((COALESCE(SUM(CASE WHEN te.is_billable THEN te.hours ELSE 0 END), 0) * 100.0 / 
+                             NULLIF(SUM(te.hours), 0))::numeric, 1) as "Utilization_Pct",
+                       MAX(cap.hours) as "Capacity_Hours",
+                       ROUND((COALESCE(SUM(te.hours), 0) * 100.0 / NULLIF(MAX(cap.hours), 0))::numeric, 1) as "Capacity_Pct"
                 FROM time_entries te
                 JOIN users u ON te.employee_id = u.id
+                CROSS JOIN capacity cap
                 WHERE te.entry_date BETWEEN %s AND %s AND te.status = 'approved'
                 GROUP BY u.id, u.full_name, u.department ORDER BY "Utilization_Pct" DESC
-            """, (start, end))
+            """, (day_hours, start, end, start, end), query_class='report')
         
         if not df.empty:
             st.dataframe(df, use_container_width=True, hide_index=True)
@@ -2222,6 +4963,53 @@ def techcore_reports():
         else:
             st.info("📭 No data found")
 
+def techcore_import():
+    st.subheader("📥 Bulk Import")
+    st.markdown("Import historical project time from CSV or Excel. Rows are validated as a batch before anything is written.")
+    
+    template = pd.DataFrame([['jdoe', 'Acme Corp', 'Website Revamp', '2024-01-15', 7, 30, PROJECT_TASK_TYPES[0],
+                              'Sprint work', 'Yes', 'approved']], columns=IMPORT_COLUMNS)
+    st.download_button("📄 Download Template", template.to_csv(index=False), "time_import_template.csv", "text/csv")
+    st.caption(f"Required: {', '.join(IMPORT_REQUIRED)}. Status is one of {', '.join(IMPORT_STATUSES)} (default approved).")
+    
+    uploaded = st.file_uploader("Time Entries File", type=['csv', 'xlsx'], key="import_file")
+    if uploaded and st.button("🔍 Validate File", type="primary"):
+        try:
+            frame = read_import_file(uploaded)
+        except ValueError as e:
+            st.error(f"❌ {e}")
+        else:
+            if st.session_state.get('import_batch'):
+                discard_import(st.session_state.import_batch)
+            with st.spinner(f"Staging {len(frame)} rows..."):
+                st.session_state.import_batch = stage_import(frame)
+    
+    batch_id = st.session_state.get('import_batch')
+    if not batch_id:
+        return
+    
+    valid, invalid, overtime_days, errors = import_summary(batch_id)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Valid Rows", valid)
+    col2.metric("Rows With Errors", invalid)
+    col3.metric("Overtime Days", overtime_days)
+    
+    if not errors.empty:
+        st.warning(f"⚠️ {invalid} rows will be skipped")
+        st.dataframe(errors, use_container_width=True, hide_index=True)
+        st.download_button("📥 Download Errors", errors.to_csv(index=False), "import_errors.csv", "text/csv")
+    
+    col1, col2 = st.columns(2)
+    if valid and col1.button(f"✅ Import {valid} Valid Rows", type="primary"):
+        with st.spinner("Importing..."):
+            imported = merge_import(batch_id, st.session_state.user['id'])
+        del st.session_state.import_batch
+        st.success(f"✅ {imported} entries imported!")
+    if col2.button("🗑️ Discard Batch"):
+        discard_import(batch_id)
+        del st.session_state.import_batch
+        st.rerun()
+
 def techcore_export_center():
     st.subheader("📤 Export Center")
     
@@ -2240,7 +5028,7 @@ def techcore_export_center():
         if st.button("📥 Export All Time Entries", use_container_width=True):
             df = execute_df("""
                 SELECT te.id as "Entry_ID", u.full_name as "Employee", u.department as "Department",
-                       COALESCE(c.name, 'EE Internal') as "Client", COALESCE(p.name, te.entry_category) as "Project",
+                       COALESCE(c.name, 'EE Internal') as "Client", COALESCE(p.name, te.entry_category::text) as "Project",
                        te.entry_date as "Date", te.hours as "Hours", te.minutes as "Minutes",
                        te.task_type as "Task_Type", te.entry_type as "Entry_Type",
                        CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable",
@@ -2253,7 +5041,7 @@ def techcore_export_center():
                 LEFT JOIN users r ON te.reviewed_by = r.id
                 WHERE te.entry_date BETWEEN %s AND %s
                 ORDER BY te.entry_date DESC
-            """, (export_start, export_end))
+            """, (export_start, export_end), query_class='export')
             
             if not df.empty:
                 csv = df.to_csv(index=False)
@@ -2266,7 +5054,7 @@ def techcore_export_center():
         if st.button("📥 Export Approved Only", use_container_width=True):
             df = execute_df("""
                 SELECT u.full_name as "Employee", COALESCE(c.name, 'EE Internal') as "Client",
-                       COALESCE(p.name, te.entry_category) as "Project", te.entry_date as "Date",
+                       COALESCE(p.name, te.entry_category::text) as "Project", te.entry_date as "Date",
                        te.hours as "Hours", te.task_type as "Task",
                        CASE WHEN te.is_billable THEN 'Yes' ELSE 'No' END as "Billable"
                 FROM time_entries te
@@ -2275,7 +5063,7 @@ def techcore_export_center():
                 LEFT JOIN clients c ON p.client_id = c.id
                 WHERE te.entry_date BETWEEN %s AND %s AND te.status = 'approved'
                 ORDER BY te.entry_date DESC
-            """, (export_start, export_end))
+            """, (export_start, export_end), query_class='export')
             
             if not df.empty:
                 csv = df.to_csv(index=False)
@@ -2293,7 +5081,7 @@ def techcore_export_center():
                        email as "Email", role as "Role", department as "Department",
                        CASE WHEN is_active THEN 'Active' ELSE 'Inactive' END as "Status"
                 FROM users ORDER BY full_name
-            """)
+            """, query_class='export')
             if not df.empty:
                 csv = df.to_csv(index=False)
                 st.download_button("⬇️ Download CSV", csv, "users_list.csv", "text/csv", key="dl_users")
@@ -2309,7 +5097,7 @@ def techcore_export_center():
                 LEFT JOIN project_assignments pa ON p.id = pa.project_id
                 LEFT JOIN users u ON pa.employee_id = u.id
                 ORDER BY c.name, p.name
-            """)
+            """, query_class='export')
             if not df.empty:
                 csv = df.to_csv(index=False)
                 st.download_button("⬇️ Download CSV", csv, "projects_teams.csv", "text/csv", key="dl_projects")
@@ -2322,12 +5110,12 @@ def techcore_export_center():
         try:
             output = BytesIO()
             with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                execute_df("SELECT * FROM users").to_excel(writer, sheet_name='Users', index=False)
-                execute_df("SELECT * FROM clients").to_excel(writer, sheet_name='Clients', index=False)
-                execute_df("SELECT * FROM projects").to_excel(writer, sheet_name='Projects', index=False)
-                execute_df("SELECT * FROM project_assignments").to_excel(writer, sheet_name='Assignments', index=False)
-                execute_df("SELECT * FROM time_entries").to_excel(writer, sheet_name='Time_Entries', index=False)
-                execute_df("SELECT * FROM audit_logs ORDER BY id DESC LIMIT 5000").to_excel(writer, sheet_name='Audit_Logs', index=False)
+                execute_df("SELECT * FROM users", query_class='export').to_excel(writer, sheet_name='Users', index=False)
+                execute_df("SELECT * FROM clients", query_class='export').to_excel(writer, sheet_name='Clients', index=False)
+                execute_df("SELECT * FROM projects", query_class='export').to_excel(writer, sheet_name='Projects', index=False)
+                execute_df("SELECT * FROM project_assignments", query_class='export').to_excel(writer, sheet_name='Assignments', index=False)
+                execute_df("SELECT * FROM time_entries", query_class='export').to_excel(writer, sheet_name='Time_Entries', index=False)
+                execute_df("SELECT * FROM audit_logs ORDER BY id DESC LIMIT 5000", query_class='export').to_excel(writer, sheet_name='Audit_Logs', index=False)
             output.seek(0)
             timestamp = get_local_time().strftime('%Y%m%d_%H%M%S')
             st.download_button("⬇️ Download Excel Backup", output, f"backup_{timestamp}.xlsx",
@@ -2354,6 +5142,8 @@ def techcore_settings():
         overtime = st.number_input("Overtime Threshold (hours/day)", value=float(settings_dict.get('overtime_threshold', 9)), min_value=1.0, max_value=24.0)
         week_start = st.selectbox("Work Week Starts", ["Monday", "Sunday"], 
                                   index=0 if settings_dict.get('work_week_start', 'Monday') == 'Monday' else 1)
+        day_hours = st.number_input("Standard Day (hours)", value=float(settings_dict.get('standard_day_hours', 8)), min_value=1.0, max_value=24.0)
+        budget_alert = st.number_input("Budget Alert (% used)", value=int(float(settings_dict.get('budget_alert_pct', 80))), min_value=1, max_value=100)
     
     if st.button("💾 Save Settings", type="primary"):
         conn = get_connection()
@@ -2364,6 +5154,13 @@ def techcore_settings():
                 c.execute("UPDATE settings SET value=%s, updated_at=%s WHERE key='recall_window_hours'", (str(recall_hrs), local_time))
                 c.execute("UPDATE settings SET value=%s, updated_at=%s WHERE key='overtime_threshold'", (str(overtime), local_time))
                 c.execute("UPDATE settings SET value=%s, updated_at=%s WHERE key='work_week_start'", (week_start, local_time))
+                c.execute("UPDATE settings SET value=%s, updated_at=%s WHERE key='standard_day_hours'", (str(day_hours), local_time))
+                c.execute("UPDATE settings SET value=%s, updated_at=%s WHERE key='budget_alert_pct'", (str(budget_alert), local_time))
+                if week_start != settings_dict.get('work_week_start'):
+                    refresh_work_calendar(c)
+                if overtime != float(settings_dict.get('overtime_threshold', 9)):
+                    c.execute("UPDATE daily_totals SET is_overtime = hours > %s WHERE is_overtime IS DISTINCT FROM (hours > %s)",
+                              (overtime, overtime))
                 conn.commit()
         finally:
             release_connection(conn)
@@ -2371,6 +5168,109 @@ def techcore_settings():
         st.success("✅ Settings saved!")
         st.rerun()
     
+    st.markdown("---")
+    st.markdown("##### 🗓️ Company Holidays")
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col1:
+        holiday_date = st.date_input("Date", datetime.date.today(), key="holiday_date")
+    with col2:
+        holiday_name = st.text_input("Holiday Name", key="holiday_name")
+    with col3:
+        st.write("")
+        st.write("")
+        if st.button("Add Holiday", use_container_width=True):
+            if holiday_name:
+                conn = get_connection()
+                try:
+                    with conn.cursor() as c:
+                        c.execute("""INSERT INTO company_holidays (holiday_date, name) VALUES (%s, %s)
+                                     ON CONFLICT (holiday_date) DO UPDATE SET name = EXCLUDED.name""", (holiday_date, holiday_name))
+                        refresh_work_calendar(c)
+                        conn.commit()
+                finally:
+                    release_connection(conn)
+                log_audit(st.session_state.user['id'], "ADD_HOLIDAY", "settings", None, f"{holiday_date}: {holiday_name}")
+                st.success("✅ Holiday added!")
+                st.rerun()
+            else:
+                st.warning("⚠️ Holiday name is required")
+    
+    holidays = execute_df("""
+        SELECT holiday_date as "Date", name as "Holiday" FROM company_holidays
+        WHERE holiday_date >= %s ORDER BY holiday_date
+    """, (datetime.date.today().replace(month=1, day=1),))
+    
+    if not holidays.empty:
+        st.dataframe(holidays, use_container_width=True, hide_index=True)
+        remove_date = st.selectbox("Remove Holiday", holidays['Date'].tolist(), key="holiday_remove")
+        if st.button("🗑️ Remove Holiday"):
+            conn = get_connection()
+            try:
+                with conn.cursor() as c:
+                    c.execute("DELETE FROM company_holidays WHERE holiday_date = %s", (remove_date,))
+                    refresh_work_calendar(c)
+                    conn.commit()
+            finally:
+                release_connection(conn)
+            log_audit(st.session_state.user['id'], "REMOVE_HOLIDAY", "settings", None, str(remove_date))
+            st.success("✅ Holiday removed!")
+            st.rerun()
+    
+    st.markdown("---")
+    st.markdown("##### 🕒 Background Jobs")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        retention = st.number_input("Audit Log Retention (days, 0 = keep all)", min_value=0,
+                                    value=int(settings_dict.get('audit_retention_days', 0)), key="audit_retention")
+    with col2:
+        digests_on = st.checkbox("Send weekly missing-timesheet digests",
+                                 value=settings_dict.get('reminder_digests_enabled') == 'true', key="digests_on")
+    if st.button("💾 Save Job Settings"):
+        conn = get_connection()
+        try:
+            local_time = get_local_time()
+            with conn.cursor() as c:
+                c.execute("UPDATE settings SET value=%s, updated_at=%s WHERE key='audit_retention_days'", (str(retention), local_time))
+                c.execute("UPDATE settings SET value=%s, updated_at=%s WHERE key='reminder_digests_enabled'",
+                          ('true' if digests_on else 'false', local_time))
+                conn.commit()
+        finally:
+            release_connection(conn)
+        log_audit(st.session_state.user['id'], "UPDATE_SETTINGS", "settings", None, "background jobs")
+        st.success("✅ Job settings saved!")
+    
+    jobs = execute_df("""
+        SELECT DISTINCT ON (job_name) job_name as "Job", status as "Last_Status", started_at as "Last_Run",
+               duration_ms as "Duration_ms", detail as "Detail"
+        FROM job_runs ORDER BY job_name, started_at DESC
+    """)
+    if not jobs.empty:
+        st.dataframe(jobs, use_container_width=True, hide_index=True)
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        manual_job = st.selectbox("Job", list(SCHEDULED_JOBS.keys()), key="manual_job")
+    with col2:
+        st.write("")
+        st.write("")
+        if st.button("▶️ Run Now", use_container_width=True):
+            detail = run_job(manual_job, force=True)
+            if detail is None:
+                st.warning("Job is already running on another server")
+            else:
+                log_audit(st.session_state.user['id'], "RUN_JOB", "system", None, manual_job)
+                st.success(f"✅ {manual_job}: {detail}")
+    
+    with st.expander("📜 Run History"):
+        history = execute_df("""
+            SELECT job_name as "Job", status as "Status", started_at as "Started",
+                   duration_ms as "Duration_ms", detail as "Detail"
+            FROM job_runs ORDER BY started_at DESC LIMIT 100
+        """)
+        st.dataframe(history, use_container_width=True, hide_index=True)
+    
     st.markdown("---")
     st.markdown("##### 📊 Database Statistics")
     
@@ -2392,38 +5292,138 @@ def techcore_settings():
 def techcore_audit():
     st.subheader("📜 Audit Logs")
     
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 2])
     with col1:
         start = st.date_input("From", datetime.date.today() - timedelta(days=7), key="audit_start")
     with col2:
         end = st.date_input("To", datetime.date.today(), key="audit_end")
     with col3:
         action_filter = st.text_input("Filter Action", placeholder="e.g., LOGIN")
+    with col4:
+        search = st.text_input("Search Details", placeholder="e.g. project budget", key="audit_search").strip()
     
-    query = """
+    # Half-open range keeps the created_at index usable
+    where = "WHERE al.created_at >= %s AND al.created_at < %s"
+    params = [start, end + timedelta(days=1)]
+    
+    if action_filter:
+        where += " AND al.action ILIKE %s"
+        params.append(f"%{action_filter}%")
+    
+    order = "al.created_at DESC, al.id DESC"
+    rank_params = []
+    if search:
+        match, rank, search_params = search_clause('al', search)
+        where += f" AND {match}"
+        params += search_params
+        order = f"{rank} DESC, {order}"
+        rank_params = search_params
+    
+    total = execute_query(f"SELECT COUNT(*) as n FROM audit_logs al {where}", tuple(params))[0]['n']
+    offset = page_selector(total, "audit_page", page_size=100)
+    
+    select = f"""
         SELECT al.id, u.username as "User", al.action as "Action", 
                al.entity_type as "Entity", al.entity_id as "Entity_ID",
                al.details as "Details", al.created_at as "Timestamp"
         FROM audit_logs al
         LEFT JOIN users u ON al.user_id = u.id
-        WHERE DATE(al.created_at) BETWEEN %s AND %s
+        {where}
+        ORDER BY {order}
     """
-    params = [start, end]
+    logs = execute_df(select + " LIMIT 100 OFFSET %s", tuple(params + rank_params + [offset]))
     
-    if action_filter:
-        query += " AND al.action ILIKE %s"
-        params.append(f"%{action_filter}%")
+    st.info(f"📋 Showing {len(logs)} of {total} records")
+    st.dataframe(logs, use_container_width=True, hide_index=True)
     
-    query += " ORDER BY al.created_at DESC LIMIT 500"
+    if total and st.button("📥 Prepare Audit Log Export", key="audit_export"):
+        csv = execute_df(select, tuple(params + rank_params), query_class='export').to_csv(index=False)
+        st.download_button("📥 Download Audit Log", csv, "audit_log.csv", "text/csv")
+
+def techcore_performance():
+    st.subheader("⚡ Performance")
+    st.caption("Connection pool statistics for this server process, shared by all sessions and background jobs. "
+               "Each script run checks out one connection on its first query and holds it until the run ends; "
+               "Reused counts the later queries in the run that shared it.")
+    
+    occupancy, sites, exhaustions = pool_snapshot()
+    
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    col1.metric("In Use", occupancy['in_use'])
+    col2.metric("Idle", occupancy['idle'])
+    col3.metric("Waiting", occupancy['waiting'])
+    col4.metric("Pool Size", f"{occupancy['total']} / {occupancy['max']}")
+    col5.metric("Peak In Use", occupancy['peak_in_use'])
+    col6.metric("Wait Timeouts", len(exhaustions))
+    
+    replica = init_replica_pool()
+    replica_error = get_replica_state()['error']
+    if replica_error:
+        st.warning(f"📚 Read replica unreachable, reads are going to the primary: {replica_error}")
+    elif replica is not None:
+        status = replica.status()
+        st.caption(f"📚 Read replica: {status['in_use']} in use · {status['idle']} idle · "
+                   f"{status['waiting']} waiting · {status['total']} / {replica.maxconn} open · "
+                   f"{status['health_failures']} health check failure(s)")
+    
+    if occupancy['health_failures']:
+        st.warning(f"🩺 {occupancy['health_failures']} pool health check failure(s); last: {occupancy['health_error']}")
+    
+    if occupancy['held_now']:
+        st.caption(f"🔌 Currently held by: {', '.join(occupancy['held_now'])}")
+    
+    st.markdown("##### ⏱️ Checkout Wait & Hold Time by Call Site")
+    if not sites.empty:
+        st.dataframe(sites, use_container_width=True, hide_index=True)
+        
+        fig = px.bar(sites.head(15), x='Call Site', y=['Avg Wait (ms)', 'Avg Hold (ms)'], barmode='group')
+        fig.update_layout(margin=dict(t=20, b=20, l=20, r=20))
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info("No checkouts recorded yet")
+    
+    st.markdown("##### 🛑 Running Queries")
+    st.caption("Report, export and job statements in flight. Timeouts: " +
+               " · ".join(f"{cls} {query_timeout_ms(cls) / 1000:g}s" for cls in QUERY_TIMEOUTS_MS))
+    running = get_running_queries()
+    with running['lock']:
+        queries = dict(running['queries'])
+    if queries:
+        now = time.monotonic()
+        for token, query in sorted(queries.items(), key=lambda item: item[1]['started_at']):
+            col1, col2 = st.columns([5, 1])
+            col1.write(f"**{query['Site']}** ({query['Class']}) · {query['User']} · "
+                       f"running {now - query['started_at']:.1f}s on {query['pool']} (pid {query['pid']})")
+            if col2.button("Cancel", key=f"cancel_query_{token}"):
+                if cancel_running_query(token):
+                    log_audit(st.session_state.user['id'], "QUERY_CANCEL", "system", None,
+                              f"{query['Site']} pid {query['pid']}")
+                    st.success("✅ Cancel requested")
+                else:
+                    st.info("Query already finished")
+                st.rerun()
+    else:
+        st.info("No long-running queries right now")
     
-    logs = execute_df(query, tuple(params))
+    st.markdown("##### 🧾 Prepared Statements")
+    statements = statement_snapshot()
+    if not statements.empty:
+        st.caption("Catalogue queries are prepared once per connection; Prepares counts the first use on each.")
+        st.dataframe(statements, use_container_width=True, hide_index=True)
+    else:
+        st.info("No catalogue statements executed yet")
     
-    st.info(f"📋 Showing {len(logs)} records")
-    st.dataframe(logs, use_container_width=True, hide_index=True)
+    st.markdown("##### 🚨 Pool Exhaustion")
+    if not exhaustions.empty:
+        st.dataframe(exhaustions.iloc[::-1], use_container_width=True, hide_index=True)
+    else:
+        st.success("✅ No caller has timed out waiting for a connection")
     
-    if not logs.empty:
-        csv = logs.to_csv(index=False)
-        st.download_button("📥 Download Audit Log", csv, "audit_log.csv", "text/csv")
+    col1, col2 = st.columns([3, 1])
+    col1.caption(f"Collecting since {occupancy['since']:%Y-%m-%d %H:%M}")
+    if col2.button("🔄 Reset Statistics", key="reset_pool_stats"):
+        reset_pool_stats()
+        st.rerun()
 
 # ============== MAIN APPLICATION ==============
 def main():
@@ -2527,6 +5527,7 @@ def main():
     
     # Initialize database
     init_database()
+    start_scheduler()
     
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
@@ -2572,16 +5573,21 @@ def main():
             st.session_state.user = None
             st.rerun()
     
-    # Route to appropriate portal
+    # Route to appropriate portal. Pages that run long queries guard each tab separately so the
+    # other tabs still render; this catches a timeout anywhere else on the page.
     if "TechCore" in portal:
-        techcore_dashboard()
+        render_guarded(techcore_dashboard)
     elif "Manage360" in portal:
-        manage360_dashboard()
+        render_guarded(manage360_dashboard)
     else:
-        workhub_dashboard()
+        render_guarded(workhub_dashboard)
 
 if __name__ == "__main__":
-    main()
+    begin_connection_scope()
+    try:
+        main()
+    finally:
+        end_connection_scope()
 
 
 
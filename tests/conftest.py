@@ -0,0 +1,63 @@
+"""
+Shared fixtures. Database tests run against the PostgreSQL server named by
+TEST_DATABASE_URL, in a throwaway database whose schema is built by
+app.init_database(), and are skipped when it is unset.
+"""
+
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app():
+    pytest.importorskip("streamlit")
+    pytest.importorskip("psycopg2")
+    import app as app_module
+    return app_module
+
+
+@pytest.fixture(scope="session")
+def database(app):
+    """Connection to a fresh database migrated by init_database, dropped after the session"""
+    dsn = os.environ.get("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    import psycopg2
+
+    name = f"test_{uuid.uuid4().hex[:12]}"
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    with admin.cursor() as c:
+        c.execute(f"CREATE DATABASE {name}")
+    conn = psycopg2.connect(dsn, dbname=name, connection_factory=app.PreparedConnection)
+    try:
+        # init_database takes its connection from the run scope, which would otherwise check one out of the pool
+        app.begin_connection_scope()
+        scope = app.get_run_scope()
+        scope.conns['primary'], scope.depths['primary'] = conn, 0
+        try:
+            app.init_database.clear()
+            app.init_database()
+        finally:
+            scope.conns, scope.active = {}, False
+        yield conn
+    finally:
+        conn.close()
+        with admin.cursor() as c:
+            c.execute(f"DROP DATABASE IF EXISTS {name}")
+        admin.close()
+
+
+@pytest.fixture
+def db(database):
+    """Cursor on the test database; everything a test writes is rolled back"""
+    try:
+        with database.cursor() as c:
+            yield c
+    finally:
+        database.rollback()
@@ -0,0 +1,89 @@
+"""
+Regression tests for the team, project and admin listings: an employee assigned
+to several projects must not have their hours counted once per assignment.
+"""
+
+import datetime
+
+
+def seed_multi_project_employee(c):
+    """One employee on three projects with four recent entries; returns (employee_id, project_ids)"""
+    c.execute("""INSERT INTO users (username, password_hash, full_name, email, role) VALUES
+                 ('manager', 'x', 'Manager', 'm@example.com', 'manager'), ('ada', 'x', 'Ada', 'ada@example.com', 'employee')
+                 RETURNING id""")
+    manager_id, employee_id = [row[0] for row in c.fetchall()]
+    c.execute("INSERT INTO clients (name) VALUES ('Acme') RETURNING id")
+    client_id = c.fetchone()[0]
+    project_ids = []
+    for name in ("Alpha", "Beta", "Gamma"):
+        c.execute("INSERT INTO projects (client_id, name, manager_id, budget_hours) VALUES (%s, %s, %s, 100) RETURNING id",
+                  (client_id, name, manager_id))
+        project_ids.append(c.fetchone()[0])
+        c.execute("INSERT INTO project_assignments (project_id, employee_id) VALUES (%s, %s)",
+                  (project_ids[-1], employee_id))
+    
+    today = datetime.date.today()
+    entries = [(project_ids[0], 6, 'approved'), (project_ids[0], 2, 'approved'),
+               (project_ids[1], 3, 'approved'), (project_ids[2], 4, 'draft')]
+    for project_id, hours, status in entries:
+        c.execute("""INSERT INTO time_entries (employee_id, project_id, entry_date, hours, status)
+                     VALUES (%s, %s, %s, %s, %s)""", (employee_id, project_id, today, hours, status))
+    return employee_id, project_ids
+
+
+def fetch_statement(app, c, name):
+    app.execute_statement(c, name)
+    columns = [col.name for col in c.description]
+    return [dict(zip(columns, row)) for row in c.fetchall()]
+
+
+def test_team_overview_counts_each_entry_once(app, db):
+    employee_id, _ = seed_multi_project_employee(db)
+    
+    team = {row['id']: row for row in fetch_statement(app, db, 'team_overview')}
+    
+    assert team[employee_id]['Projects'] == 3
+    assert float(team[employee_id]['Week_Hours']) == 11
+
+
+def test_project_burn_is_per_project(app, db):
+    _, project_ids = seed_multi_project_employee(db)
+    
+    app.recalculate_project_hours(db, project_ids)
+    projects = {row['id']: row for row in fetch_statement(app, db, 'project_overview')}
+    
+    assert [float(projects[p]['Total_Hours']) for p in project_ids] == [8, 3, 0]
+    assert [projects[p]['Team_Size'] for p in project_ids] == [1, 1, 1]
+    assert float(projects[project_ids[0]]['Budget_Used_Pct']) == 8.0
+
+
+def fetch_grid(app, c, name):
+    c.execute(app.GRID_QUERIES[name])
+    columns = [col.name for col in c.description]
+    return [dict(zip(columns, row)) for row in c.fetchall()]
+
+
+def test_client_listing_totals_each_project_once(app, db):
+    _, project_ids = seed_multi_project_employee(db)
+    db.execute("INSERT INTO clients (name) VALUES ('Idle Co') RETURNING id")
+    idle_id = db.fetchone()[0]
+    
+    app.recalculate_project_hours(db, project_ids)
+    clients = {row['Client']: row for row in fetch_grid(app, db, 'clients')}
+    
+    assert clients['Acme']['Projects'] == 3
+    assert float(clients['Acme']['Total_Hours']) == 11
+    assert clients['Idle Co']['id'] == idle_id
+    assert (clients['Idle Co']['Projects'], float(clients['Idle Co']['Total_Hours'])) == (0, 0)
+
+
+def test_projects_admin_listing_is_per_project(app, db):
+    _, project_ids = seed_multi_project_employee(db)
+    
+    app.recalculate_project_hours(db, project_ids)
+    projects = {row['id']: row for row in fetch_grid(app, db, 'projects')}
+    
+    assert [float(projects[p]['Hours']) for p in project_ids] == [8, 3, 0]
+    assert [projects[p]['Team'] for p in project_ids] == [1, 1, 1]
+    assert [projects[p]['Manager'] for p in project_ids] == ['Manager'] * 3
+    assert float(projects[project_ids[0]]['Budget_Used_Pct']) == 8.0